@@ -76,15 +76,16 @@ class ActivityAdmin(admin.ModelAdmin):
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
     """Admin interface for Leaderboard model"""
-    list_display = ('id', 'entity_name', 'entity_type', 'rank', 'total_points', 'team', 'updated_at')
+    list_display = ('id', 'entity_name', 'entity_type', 'total_points', 'team', 'updated_at')
     list_filter = ('entity_type', 'team', 'updated_at')
     search_fields = ('entity_name', 'team')
-    ordering = ('rank',)
+    # Rank order; ranks themselves are counted by the ranking engine
+    ordering = ('entity_type', '-total_points', 'entity_name')
     readonly_fields = ('updated_at',)
     
     fieldsets = (
         ('Leaderboard Entry', {
-            'fields': ('entity_type', 'entity_name', 'rank', 'team')
+            'fields': ('entity_type', 'entity_name', 'team')
         }),
         ('Statistics', {
             'fields': ('total_points',)
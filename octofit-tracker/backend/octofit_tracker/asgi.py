@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_asgi_application()
+
+# Imported after setup: the stream reads settings and the ranking engine publishes to it
+from octofit_tracker.live import with_live_updates  # noqa: E402
+
+application = with_live_updates(application)
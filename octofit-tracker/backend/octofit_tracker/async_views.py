@@ -0,0 +1,115 @@
+"""Async read endpoints for the activity feed, leaderboard and team dashboards.
+
+These mirror the hot GET paths of the viewsets as native coroutine views, so an
+ASGI worker awaits the database instead of parking a thread per request while
+dashboards poll. Query results are fetched with the async ORM and serialized
+with the regular serializers, with per-page counts computed up front because
+the list serializers query synchronously.
+"""
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from .caching import cached_async_view
+from .models import Activity, Leaderboard, Team, User
+from .pagination import ActivityPagination, KeysetPagination, LeaderboardPagination
+from .serializers import ActivitySerializer, LeaderboardSerializer, TeamSerializer, rank_entries
+
+
+def async_get(view):
+    """Allow only GET and report API exceptions (e.g. a bad cursor) as JSON.
+
+    Django's ``require_GET`` wraps views in a sync function on this version, which
+    would turn these coroutines back into thread-bound views.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return HttpResponseNotAllowed(['GET'])
+        try:
+            return await view(request, *args, **kwargs)
+        except APIException as error:
+            return JsonResponse({'detail': str(error.detail)}, status=error.status_code)
+    return wrapper
+
+
+async def paginate(request, queryset, pagination_class, serializer_class, context=None):
+    """Fetch one keyset page of ``queryset`` and return it as a paginated JSON response"""
+    paginator = pagination_class()
+    page_queryset = paginator.get_page_queryset(queryset, Request(request))
+    rows = paginator.set_page([row async for row in page_queryset])
+    if context is not None:
+        context = await context(rows)
+    # One child serializer for the page, as ListSerializer does, but without the
+    # list serializers' synchronous count queries (the counts are in the context)
+    serializer = serializer_class(context=context or {})
+    data = [serializer.to_representation(row) for row in rows]
+    return JsonResponse(OrderedDict([
+        ('next', paginator.get_next_link()),
+        ('previous', paginator.get_previous_link()),
+        ('results', data),
+    ]))
+
+
+async def member_counts(teams):
+    counts = (
+        User.objects.filter(team__in={team.name for team in teams})
+        .order_by()
+        .values('team')
+        .annotate(count=Count('id'))
+    )
+    return {'member_counts': {row['team']: row['count'] async for row in counts}}
+
+
+async def activities_counts(entries):
+    emails = {}
+    names = {entry.entity_name for entry in entries if entry.entity_type == 'user'}
+    async for name, email in User.objects.filter(name__in=names).values_list('name', 'email'):
+        emails[email] = name
+    counts = (
+        Activity.objects.filter(user_email__in=list(emails))
+        .order_by()
+        .values('user_email')
+        .annotate(count=Count('id'))
+    )
+    # Users sharing a name share a leaderboard entry, so their counts are summed
+    totals = Counter()
+    async for row in counts:
+        totals[emails[row['user_email']]] += row['count']
+    return {'activities_counts': dict(totals)}
+
+
+async def leaderboard_context(entries):
+    context = await activities_counts(entries)
+    # One score tree read, plus a tie count when the page starts or ends inside a tie
+    context['ranks'] = await sync_to_async(rank_entries)(entries)
+    return context
+
+
+@async_get
+async def activities_by_user(request):
+    """Get activities filtered by user email"""
+    user_email = request.GET.get('user_email')
+    if not user_email:
+        return JsonResponse({'error': 'user_email parameter is required'}, status=400)
+    activities = Activity.objects.select_related('user', 'team_ref').filter(user_email=user_email)
+    return await paginate(request, activities, ActivityPagination, ActivitySerializer)
+
+
+@async_get
+@cached_async_view('leaderboard')
+async def leaderboard(request, entity_type):
+    """Get the all-time user or team leaderboard"""
+    entries = Leaderboard.objects.filter(entity_type=entity_type)
+    return await paginate(request, entries, LeaderboardPagination, LeaderboardSerializer, leaderboard_context)
+
+
+@async_get
+async def teams(request):
+    """Get teams with their member counts"""
+    return await paginate(request, Team.objects.all(), KeysetPagination, TeamSerializer, member_counts)
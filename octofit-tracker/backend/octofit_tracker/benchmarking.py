@@ -0,0 +1,63 @@
+"""Timing helpers shared by the benchmark management commands."""
+import math
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
+# Passed to run a benchmark that replaces data outside the benchmark settings
+DROPS_DATA_FLAG = '--i-know-this-drops-data'
+
+
+def percentile(samples, pct):
+    """Return the nearest-rank percentile of ``samples``"""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def summarize(samples):
+    """Summarize durations in seconds as milliseconds"""
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def measure(func, repeat, warmup=1, clock=time.perf_counter):
+    """Call ``func`` ``repeat`` times after ``warmup`` calls and return the durations.
+
+    Pass ``clock=time.thread_time`` to measure CPU time instead of wall time.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = clock()
+        func()
+        samples.append(clock() - started)
+    return samples
+
+
+def add_drops_data_argument(parser):
+    parser.add_argument(
+        DROPS_DATA_FLAG, dest='drops_data', action='store_true',
+        help='Run even though the database is not the benchmark one; its data is replaced',
+    )
+
+
+def ensure_disposable_database(options, what):
+    """Refuse to go on unless the benchmark settings are in effect or ``DROPS_DATA_FLAG`` was passed"""
+    if getattr(settings, 'BENCHMARK_DATABASE', False) or options.get('drops_data'):
+        return
+    raise CommandError(
+        f'Refusing to {what} outside the benchmark settings. Run with '
+        f'DJANGO_SETTINGS_MODULE=octofit_tracker.settings_benchmark, or pass {DROPS_DATA_FLAG} '
+        f'if this database may be wiped.'
+    )
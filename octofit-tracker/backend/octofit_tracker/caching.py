@@ -0,0 +1,169 @@
+"""Response caching with signal-driven invalidation and conditional GET support."""
+import hashlib
+import time
+import uuid
+from contextlib import nullcontext
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework.response import Response
+
+from .routers import primary_reads
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _generation_key(scope):
+    return f'octofit:generation:{scope}'
+
+
+def current_generation(scope):
+    """Return ``(token, last_modified)`` for ``scope``, starting a generation if needed"""
+    cache = _cache()
+    generation = cache.get(_generation_key(scope))
+    if generation is None:
+        cache.add(_generation_key(scope), (uuid.uuid4().hex, time.time()), None)
+        generation = cache.get(_generation_key(scope))
+    return generation
+
+
+async def acurrent_generation(scope):
+    """Async variant of ``current_generation`` for coroutine views"""
+    cache = _cache()
+    generation = await cache.aget(_generation_key(scope))
+    if generation is None:
+        await cache.aadd(_generation_key(scope), (uuid.uuid4().hex, time.time()), None)
+        generation = await cache.aget(_generation_key(scope))
+    return generation
+
+
+def invalidate(*scopes):
+    """Start a new generation for each scope, orphaning every response cached under the old one"""
+    cache = _cache()
+    for scope in scopes:
+        cache.set(_generation_key(scope), (uuid.uuid4().hex, time.time()), None)
+
+
+def _fill_reads(started):
+    """Route the reads of a cache fill to the default database while the read alias may lag ``started``.
+
+    A replica that has not caught up with the write behind an invalidation
+    would otherwise be cached, and served, under the new generation's ETag.
+    """
+    if time.time() - started < settings.REPLICA_LAG_SECONDS:
+        return primary_reads()
+    return nullcontext()
+
+
+def _not_modified(request, etag):
+    # Only the ETag is trusted: Last-Modified has one second resolution, so a
+    # change within the same second as the last one would still look fresh
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+    return etag in etags or '*' in etags
+
+
+def _etag(token, request):
+    fingerprint = f'{token}:{request.build_absolute_uri()}:{request.META.get("HTTP_ACCEPT", "")}'
+    return quote_etag(hashlib.sha1(fingerprint.encode()).hexdigest())
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'no-cache'
+    response['Vary'] = 'Accept'
+    return response
+
+
+def cached_response(scope):
+    """Cache the data of a GET handler until ``scope`` is invalidated.
+
+    The ETag is derived from the scope's generation and the request, so a
+    matching If-None-Match is answered with a 304 without touching the
+    database or the cached body. If-Modified-Since alone is not enough.
+    Responses cached soon after an invalidation are read from the default
+    database (see ``_fill_reads``).
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            token, last_modified = current_generation(scope)
+            etag = _etag(token, request)
+
+            if _not_modified(request, etag):
+                response = Response(status=304)
+            else:
+                cache = _cache()
+                key = f'octofit:response:{scope}:{etag}'
+                data = cache.get(key)
+                if data is None:
+                    with _fill_reads(last_modified):
+                        response = handler(self, request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+                else:
+                    response = Response(data)
+            return _set_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def cached_async_view(scope):
+    """``cached_response`` for coroutine function views returning JSON bodies"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token, last_modified = await acurrent_generation(scope)
+            etag = _etag(token, request)
+
+            if _not_modified(request, etag):
+                response = HttpResponseNotModified()
+            else:
+                cache = _cache()
+                key = f'octofit:async-response:{scope}:{etag}'
+                content = await cache.aget(key)
+                if content is None:
+                    with _fill_reads(last_modified):
+                        response = await view(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    await cache.aset(key, response.content, settings.RESPONSE_CACHE_TIMEOUT)
+                else:
+                    response = HttpResponse(content, content_type='application/json')
+            return _set_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def conditional_response(version):
+    """Answer GETs with 304 while ``version(view, request)`` is unchanged.
+
+    ``version`` returns ``(token, last_modified)`` from a query much cheaper than
+    the handler, or None to skip validation for the request.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            current = version(self, request)
+            if current is None:
+                return handler(self, request, *args, **kwargs)
+            token, last_modified = current
+            etag = _etag(token, request)
+            if _not_modified(request, etag):
+                response = Response(status=304)
+            else:
+                response = handler(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            return _set_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,18 @@
+"""System checks for settings that only hold within a single process."""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_response_cache(app_configs, **kwargs):
+    """Warn when cached responses and their invalidations stay in one process"""
+    backend = settings.CACHES[settings.RESPONSE_CACHE_ALIAS]['BACKEND']
+    if not backend.endswith('.LocMemCache'):
+        return []
+    return [Warning(
+        'Responses are cached in local memory, which every worker process keeps '
+        'to itself: an invalidation in one worker leaves the others serving stale data.',
+        hint="Set OCTOFIT_CACHE_BACKEND to 'file' (one host), 'redis' or another shared "
+             "backend, or to 'dummy' to turn response caching off.",
+        id='octofit_tracker.W001',
+    )]
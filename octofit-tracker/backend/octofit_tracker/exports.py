@@ -0,0 +1,49 @@
+"""Row encoders for streaming exports."""
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the caller"""
+
+    def write(self, value):
+        return value
+
+
+def prefer_linked(rows, indexes):
+    """Yield rows with the ``indexes`` columns replaced by the trailing columns that are not None.
+
+    Exports read a value through its relation and fall back to the row's own
+    copy here rather than with ``Coalesce``, which djongo cannot translate.
+    """
+    width = -len(indexes)
+    for row in rows:
+        values = list(row[:width])
+        for index, value in zip(indexes, row[width:]):
+            if value is not None:
+                values[index] = value
+        yield values
+
+
+def ndjson_lines(rows, fields):
+    """Yield one JSON object per line for each row tuple"""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+def csv_lines(rows, fields):
+    """Yield a header line and then one CSV line for each row tuple"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([
+            value.isoformat() if hasattr(value, 'isoformat') else value for value in row
+        ])
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
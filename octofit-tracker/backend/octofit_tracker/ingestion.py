@@ -0,0 +1,210 @@
+"""Batched activity writes and the durable queue behind queued ingestion.
+
+With ``ACTIVITY_INGEST_MODE = 'queued'`` the create endpoint only validates an
+activity and appends it to a local SQLite queue in WAL mode, so the response
+no longer waits on the database. The ``drain_activity_queue`` worker claims
+entries in large batches and writes them through ``write_activities``, the
+same path as the bulk endpoint, which scores each batch in one pass.
+
+Delivery is at least once: a worker that dies after writing a batch but before
+acknowledging it leaves the entries claimed, and they are written again once
+their lease expires.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+
+from .instrumentation import registry, sample_lines
+from .models import Activity
+from .relations import link_activities
+from .scoring import apply_activity_changes, suspended
+from .search import index_documents
+from .serializers import ActivitySerializer
+
+
+def write_activities(items, batch_size=500):
+    """Validate and insert ``items``, returning ``(created, errors)`` with errors by item index"""
+    activities = []
+    errors = []
+    for index, item in enumerate(items):
+        serializer = ActivitySerializer(data=item)
+        if serializer.is_valid():
+            activities.append(Activity(**serializer.validated_data))
+        else:
+            errors.append({'index': index, 'errors': serializer.errors})
+    if not activities:
+        return [], errors
+
+    link_activities(activities)
+    with transaction.atomic():
+        if connections[router.db_for_write(Activity)].features.can_return_rows_from_bulk_insert:
+            created = Activity.objects.bulk_create(activities, batch_size=batch_size)
+            index_documents('activity', [activity for activity in created if activity.notes], replace=False)
+        else:
+            # Without RETURNING (djongo) bulk_create leaves every pk unset, so save
+            # row by row; post_save indexes the notes and scoring waits for the batch
+            with suspended():
+                for activity in activities:
+                    activity.save(force_insert=True)
+            created = activities
+        # bulk_create skips model signals, so score the whole batch in one pass
+        apply_activity_changes([(activity, 1) for activity in created])
+    return created, errors
+
+
+class IngestQueue:
+    """Append-only SQLite queue of activity payloads with leased claims and a dead-letter table."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Every acknowledged enqueue survives a power loss, not only a crash
+            connection.execute('PRAGMA synchronous=FULL')
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    claimed_until REAL
+                );
+                CREATE TABLE IF NOT EXISTS dead_letters (
+                    id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    failed_at REAL NOT NULL,
+                    errors TEXT NOT NULL
+                );
+            ''')
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def enqueue(self, payloads):
+        """Append ``payloads`` in one transaction and return their queue ids"""
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            return [
+                connection.execute(
+                    'INSERT INTO entries (payload, enqueued_at) VALUES (?, ?)',
+                    (json.dumps(payload, cls=DjangoJSONEncoder), now),
+                ).lastrowid
+                for payload in payloads
+            ]
+
+    def claim(self, limit, lease_seconds=60):
+        """Lease up to ``limit`` of the oldest unclaimed or expired entries as ``[(id, payload)]``"""
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT id, payload FROM entries WHERE claimed_until IS NULL OR claimed_until < ? '
+                'ORDER BY id LIMIT ?',
+                (now, limit),
+            ).fetchall()
+            connection.executemany(
+                'UPDATE entries SET claimed_until = ? WHERE id = ?', [(now + lease_seconds, pk) for pk, _ in rows]
+            )
+        return [(pk, json.loads(payload)) for pk, payload in rows]
+
+    def ack(self, ids):
+        """Remove entries that were written"""
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('DELETE FROM entries WHERE id = ?', [(pk,) for pk in ids])
+
+    def release(self, ids):
+        """Return claimed entries to the queue, e.g. after the database rejected a batch"""
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('UPDATE entries SET claimed_until = NULL WHERE id = ?', [(pk,) for pk in ids])
+
+    def reject(self, failures):
+        """Move ``{id: errors}`` entries that can never be written to the dead-letter table"""
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for pk, errors in failures.items():
+                connection.execute(
+                    'INSERT OR REPLACE INTO dead_letters (id, payload, enqueued_at, failed_at, errors) '
+                    'SELECT id, payload, enqueued_at, ?, ? FROM entries WHERE id = ?',
+                    (now, json.dumps(errors), pk),
+                )
+                connection.execute('DELETE FROM entries WHERE id = ?', (pk,))
+
+    def stats(self):
+        """Return the queue depth, the age of the oldest entry in seconds and the dead-letter count"""
+        connection = self._connection()
+        depth, oldest = connection.execute('SELECT COUNT(*), MIN(enqueued_at) FROM entries').fetchone()
+        dead, = connection.execute('SELECT COUNT(*) FROM dead_letters').fetchone()
+        return {
+            'depth': depth,
+            'lag_seconds': round(max(time.time() - oldest, 0.0), 3) if oldest is not None else 0.0,
+            'dead_letters': dead,
+        }
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def activity_queue():
+    """Return the queue at ``ACTIVITY_INGEST_QUEUE_PATH``, one instance per path"""
+    path = str(settings.ACTIVITY_INGEST_QUEUE_PATH)
+    with _queues_lock:
+        if path not in _queues:
+            _queues[path] = IngestQueue(path)
+        return _queues[path]
+
+
+def drain(queue, batch_size=500, lease_seconds=60):
+    """Write one claimed batch and return ``(written, rejected)``, releasing it if the write fails"""
+    entries = queue.claim(batch_size, lease_seconds)
+    if not entries:
+        return 0, 0
+    try:
+        created, errors = write_activities([payload for _, payload in entries], batch_size)
+    except Exception:
+        queue.release([pk for pk, _ in entries])
+        raise
+    failures = {entries[error['index']][0]: error['errors'] for error in errors}
+    queue.ack([pk for pk, _ in entries if pk not in failures])
+    if failures:
+        queue.reject(failures)
+    return len(created), len(failures)
+
+
+@registry.register_collector
+def queue_metrics():
+    if settings.ACTIVITY_INGEST_MODE != 'queued':
+        return []
+    stats = activity_queue().stats()
+    return [
+        *sample_lines('octofit_ingest_queue_depth', 'Activities waiting in the ingestion queue.', 'gauge',
+                      [({}, stats['depth'])]),
+        *sample_lines('octofit_ingest_queue_lag_seconds', 'Age of the oldest queued activity.', 'gauge',
+                      [({}, stats['lag_seconds'])]),
+        *sample_lines('octofit_ingest_dead_letters', 'Queued activities that failed validation when drained.',
+                      'gauge', [({}, stats['dead_letters'])]),
+    ]
@@ -0,0 +1,251 @@
+"""Per-view request metrics exposed in the Prometheus text format."""
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values):
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f'{{{pairs}}}' if pairs else ''
+
+
+def sample_lines(name, documentation, kind, samples):
+    """Exposition lines for a gauge or counter from ``[(labels dict, value)]``"""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{_label_text(tuple(labels), tuple(labels.values()))} {value}')
+    return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a fixed tuple of label values."""
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        names = self.labels + ('le',)
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_label_text(names, label_values + (bound,))} {cumulative}')
+            labels = _label_text(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Histograms plus callables that return extra exposition lines (e.g. gauges)."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """Add ``collector()``, called on every scrape for a list of exposition lines"""
+        self._collectors.append(collector)
+        return collector
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    'octofit_request_duration_seconds', 'Total time spent handling a request.', ('view', 'method', 'status'),
+)
+request_queries = registry.histogram(
+    'octofit_request_db_queries', 'Database queries issued per request.', ('view',), QUERY_BUCKETS,
+)
+request_db_duration = registry.histogram(
+    'octofit_request_db_duration_seconds', 'Time spent waiting on the database per request.', ('view',),
+)
+request_view_duration = registry.histogram(
+    'octofit_request_view_duration_seconds',
+    'Time spent in the view outside the database, mostly serialization.', ('view',),
+)
+request_render_duration = registry.histogram(
+    'octofit_request_render_duration_seconds', 'Time spent rendering the response body.', ('view',),
+)
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` that counts and times queries, keeping their SQL if asked."""
+
+    def __init__(self, keep_sql=False, max_kept=50):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_sql = keep_sql
+        self.max_kept = max_kept
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if self.keep_sql and len(self.queries) < self.max_kept:
+                self.queries.append((elapsed, sql))
+
+
+def view_label(request):
+    """Name a request after its viewset and action, or its view function"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    cls = getattr(match.func, 'cls', None)
+    if cls is not None:
+        actions = getattr(match.func, 'actions', None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{cls.__name__}.{action}'
+    return match.view_name or getattr(match.func, '__name__', 'view')
+
+
+class RequestMetricsMiddleware:
+    """Records queries, database time, view time, render time and latency per view.
+
+    Only a ``REQUEST_METRICS_SAMPLE_RATE`` share of requests is measured.
+    Requests slower than ``REQUEST_METRICS_SLOW_MS`` are logged with their
+    slowest queries. With ``REQUEST_METRICS_ENABLED`` off, the middleware
+    removes itself from the stack at startup.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # Under ASGI stay async, so Django does not run the whole chain in a thread
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled(request):
+            return self.get_response(request)
+        recorder = self.start(request)
+        started = time.perf_counter()
+        with self.recording(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not self.sampled(request):
+            return await self.get_response(request)
+        recorder = self.start(request)
+        started = time.perf_counter()
+        # Queries run on the connections of the sync thread serving this request
+        stack = await sync_to_async(self.recording)(recorder)
+        with stack:
+            response = await self.get_response(request)
+        return self.finish(request, response, recorder, time.perf_counter() - started)
+
+    def sampled(self, request):
+        sampled = random.random() < settings.REQUEST_METRICS_SAMPLE_RATE
+        return sampled and request.path not in settings.REQUEST_METRICS_EXCLUDED_PATHS
+
+    def start(self, request):
+        request._metrics_render = 0.0
+        return QueryRecorder(keep_sql=settings.REQUEST_METRICS_SLOW_MS is not None)
+
+    @staticmethod
+    def recording(recorder):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def finish(self, request, response, recorder, total):
+        label = view_label(request)
+        render = request._metrics_render
+        request_duration.observe(total, label, request.method, response.status_code)
+        request_queries.observe(recorder.count, label)
+        request_db_duration.observe(recorder.duration, label)
+        request_view_duration.observe(max(total - recorder.duration - render, 0.0), label)
+        request_render_duration.observe(render, label)
+        slow_ms = settings.REQUEST_METRICS_SLOW_MS
+        if slow_ms is not None and total * 1000 >= slow_ms:
+            self.log_slow(request, label, total, recorder)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses render after this hook; the callback closes the timer
+        if hasattr(request, '_metrics_render'):
+            started = time.perf_counter()
+
+            def rendered(response):
+                request._metrics_render = time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow(self, request, label, total, recorder):
+        slowest = sorted(recorder.queries, key=lambda query: query[0], reverse=True)[:10]
+        trace = '\n'.join(f'  {elapsed * 1000:8.2f} ms  {sql}' for elapsed, sql in slowest)
+        logger.warning(
+            'Slow request %s %s (%s): %.1f ms, %d queries, %.1f ms in the database\n%s',
+            request.method, request.get_full_path(), label, total * 1000, recorder.count,
+            recorder.duration * 1000, trace,
+        )
+
+
+def metrics(request):
+    """Expose the collected metrics for Prometheus to scrape"""
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
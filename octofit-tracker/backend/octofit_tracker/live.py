@@ -0,0 +1,215 @@
+"""Server-Sent Events stream of leaderboard rank changes.
+
+The ranking engine is the single producer: every batch it applies is published
+once to ``rank_broker`` after the write commits, and the broker fans the event
+out to one queue per connected client. A ``ranks`` event lists the entries the
+batch moved with their old rank and their rank after the whole batch; clients
+put those entries at their new ranks and fill the other ranks with the
+remaining entries in their previous order, since none of those changed points.
+Replaying the entries as separate moves would be wrong: each new rank already
+counts the batch's other moves. Clients load the initial list over REST and
+reconnect with ``Last-Event-ID`` to replay what they missed from a short
+backlog. A ``resync`` event tells them to reload instead, when the backlog no
+longer covers the gap or the table was changed outside the engine.
+
+Django 4.1 cannot stream from a coroutine, so the stream is a plain ASGI app
+mounted in front of Django by ``with_live_updates``. Under WSGI the stream
+paths answer 501 instead, and the API root only links the stream when this
+process serves it.
+
+The broker lives in one process and only sees changes made by that process's
+ranking engine. With several workers, or writes from ``drain_activity_queue``,
+a subscriber misses the rank changes made elsewhere, so run the stream on a
+single ASGI process that also serves the writes, or have clients refresh the
+list over REST as well.
+"""
+import asyncio
+import json
+import threading
+import uuid
+from collections import deque
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.http import JsonResponse
+
+STREAM_PATHS = ('/api/leaderboard/stream/', '/leaderboard/stream/')
+
+# Set once with_live_updates mounts the stream in this process
+_serving = False
+
+
+def streaming():
+    """Whether this process serves the leaderboard stream"""
+    return _serving
+
+
+class Subscription:
+    """A client's queue of pending events, owned by the event loop serving it."""
+
+    def __init__(self, loop, entity_type=None, max_pending=1000):
+        self.loop = loop
+        self.entity_type = entity_type
+        self.queue = asyncio.Queue(max_pending)
+
+    def wants(self, event):
+        return self.entity_type is None or event['entity_type'] in (None, self.entity_type)
+
+    def put(self, event):
+        """Queue ``event``, replacing the backlog with a resync when the client falls behind"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync', 'id': event['id'], 'entity_type': None})
+
+
+class RankBroker:
+    """Fans published rank changes out to every subscription, from any thread."""
+
+    def __init__(self, backlog=1000):
+        # Event ids restart with the process; the epoch tells a reconnecting
+        # client that its Last-Event-ID belongs to an earlier run.
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._backlog = deque(maxlen=backlog)
+        self._last_id = 0
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, loop, entity_type=None, last_event_id=None):
+        """Register a subscription, replaying events after ``last_event_id`` if still held"""
+        subscription = Subscription(loop, entity_type)
+        with self._lock:
+            if last_event_id is not None:
+                last = self.parse_event_id(last_event_id)
+                missed = [event for event in self._backlog if last is not None and event['id'] > last]
+                if last is None or last > self._last_id or (missed and missed[0]['id'] != last + 1):
+                    subscription.put({'type': 'resync', 'id': self._last_id, 'entity_type': None})
+                else:
+                    for event in missed:
+                        if subscription.wants(event):
+                            subscription.put(event)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def event_id(self, event):
+        return f'{self.epoch}-{event["id"]}'
+
+    def parse_event_id(self, value):
+        """Return the sequence number of an id from this run, or None"""
+        epoch, _, number = value.partition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event_type, **change):
+        """Number ``change`` and deliver it to every interested subscription"""
+        with self._lock:
+            self._last_id += 1
+            event = {'type': event_type, 'id': self._last_id, **change}
+            self._backlog.append(event)
+            subscriptions = [subscription for subscription in self._subscriptions if subscription.wants(event)]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The client's loop has closed without unsubscribing
+                self.unsubscribe(subscription)
+        return event
+
+
+rank_broker = RankBroker()
+
+
+def format_event(event):
+    """Encode ``event`` as an SSE message"""
+    data = {key: value for key, value in event.items() if key not in ('type', 'id')}
+    return f'id: {rank_broker.event_id(event)}\nevent: {event["type"]}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+def _headers(scope):
+    return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope['headers']}
+
+
+async def leaderboard_stream(scope, receive, send):
+    """ASGI app streaming rank changes, optionally filtered with ``?entity_type=user|team``"""
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    query = parse_qs(scope.get('query_string', b'').decode())
+    entity_type = query.get('entity_type', [None])[0]
+    headers = _headers(scope)
+    last_event_id = headers.get('last-event-id') or query.get('last_event_id', [None])[0]
+
+    response_headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]
+    origin = headers.get('origin')
+    if origin and (settings.CORS_ALLOW_ALL_ORIGINS or origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', ())):
+        response_headers.append((b'access-control-allow-origin', origin.encode('latin1')))
+
+    subscription = rank_broker.subscribe(asyncio.get_running_loop(), entity_type, last_event_id)
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+        await send({
+            'type': 'http.response.body',
+            'body': f'retry: {settings.LIVE_RETRY_MILLISECONDS}\n\n'.encode(),
+            'more_body': True,
+        })
+        while not disconnected.done():
+            next_event = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {next_event, disconnected},
+                timeout=settings.LIVE_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if next_event in done:
+                body = format_event(next_event.result())
+            else:
+                next_event.cancel()
+                if disconnected in done:
+                    break
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        rank_broker.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def stream_unavailable(request):
+    """Answer the stream paths when they reach Django, i.e. outside the ASGI application"""
+    return JsonResponse(
+        {'error': 'The leaderboard stream is only served by the ASGI application (octofit_tracker.asgi); '
+                  'poll /api/leaderboard/ instead'},
+        status=501,
+    )
+
+
+def with_live_updates(application):
+    """Serve the leaderboard stream next to the Django ASGI ``application``"""
+    global _serving
+    _serving = True
+
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in STREAM_PATHS:
+            await leaderboard_stream(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+    return router
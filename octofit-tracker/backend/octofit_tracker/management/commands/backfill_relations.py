@@ -0,0 +1,51 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from octofit_tracker.models import User, Activity
+from octofit_tracker.relations import link_activities, link_users
+
+
+class Command(BaseCommand):
+    help = 'Link users and activities to their Team and User rows, one chunk at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows loaded and linked per batch (default: 1000)')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        self.backfill(User, link_users, ['team', 'team_ref'], chunk_size)
+        self.backfill(Activity, link_activities, ['user_email', 'team', 'user', 'team_ref'], chunk_size)
+
+    def backfill(self, model, link, fields, chunk_size):
+        """Walk ``model`` in primary key order and write relations that changed"""
+        label = model._meta.verbose_name_plural
+        relations = [
+            field.attname for field in map(model._meta.get_field, fields) if field.is_relation
+        ]
+        scanned = updated = 0
+        last_pk = 0
+        while True:
+            rows = list(model.objects.only(*fields).filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+            if not rows:
+                break
+            before = {row.pk: [getattr(row, name) for name in relations] for row in rows}
+            link(rows)
+
+            # One UPDATE per distinct set of relation ids rather than one per row
+            changes = defaultdict(list)
+            for row in rows:
+                values = [getattr(row, name) for name in relations]
+                if values != before[row.pk]:
+                    changes[tuple(values)].append(row.pk)
+            with transaction.atomic():
+                for values, pks in changes.items():
+                    model.objects.filter(pk__in=pks).update(**dict(zip(relations, values)))
+
+            scanned += len(rows)
+            updated += sum(len(pks) for pks in changes.values())
+            last_pk = rows[-1].pk
+            self.stdout.write(f'{label}: scanned {scanned:,}, linked {updated:,}', ending='\r')
+
+        self.stdout.write(self.style.SUCCESS(f'{label}: scanned {scanned:,}, linked {updated:,}'))
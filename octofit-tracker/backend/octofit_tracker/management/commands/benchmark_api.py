@@ -0,0 +1,215 @@
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from octofit_tracker.benchmarking import add_drops_data_argument, ensure_disposable_database, summarize
+from octofit_tracker.models import User, Team, Activity
+from octofit_tracker.seeding import (
+    reset_tables, seed_dataset, synthetic_activities, team_name, user_email,
+)
+from octofit_tracker.urls import router
+
+# Query parameters for the custom actions that require them, by endpoint name
+ACTION_PARAMS = {
+    'user-by-team': lambda: {'team': team_name(0)},
+    'activity-by-user': lambda: {'user_email': user_email(0)},
+    'activity-export': lambda: {'team': team_name(0), 'date_from': (date.today() - timedelta(days=7)).isoformat()},
+    'workout-by-difficulty': lambda: {'difficulty': 'advanced'},
+    'stats-users': lambda: {'user_email': user_email(0), 'period': 'week'},
+    'stats-teams': lambda: {'team': team_name(0), 'period': 'week'},
+    'stats-streak': lambda: {'user_email': user_email(0)},
+    'search-list': lambda: {'q': 'athlete 1'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic dataset and load-test every API endpoint, reporting latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument('--teams', type=int, default=10)
+        parser.add_argument('--activities', type=int, default=100_000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to seed activities')
+        parser.add_argument('--skip-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients per endpoint')
+        parser.add_argument('--include-writes', action='store_true',
+                            help='Also benchmark activity create and bulk ingestion')
+        parser.add_argument('--only', help='Comma-separated endpoint names to run')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--baseline', help='JSON report from an earlier run to compare against')
+        parser.add_argument('--max-regression', type=float,
+                            help='Fail if any endpoint p95 is this many percent slower than the baseline')
+        add_drops_data_argument(parser)
+
+    def handle(self, *args, **options):
+        if options['include_writes']:
+            ensure_disposable_database(options, 'benchmark writes')
+        if not options['skip_seed']:
+            self.seed(options)
+
+        endpoints = dict(self.endpoints(options))
+        if options['only']:
+            wanted = set(options['only'].split(','))
+            endpoints = {name: spec for name, spec in endpoints.items() if name in wanted}
+
+        results = {}
+        for name, (method, path, body) in endpoints.items():
+            self.stdout.write(f'Benchmarking {name} ({method.upper()} {path})...')
+            results[name] = self.drive(method, path, body, options['requests'], options['concurrency'])
+
+        report = {'meta': self.metadata(options), 'endpoints': results}
+        self.print_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}')
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['max_regression'])
+
+    def seed(self, options):
+        ensure_disposable_database(options, 'wipe and reseed the database')
+        started = time.perf_counter()
+
+        def progress(model, written):
+            rate = written / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f'  {model._meta.verbose_name_plural}: {written:,} ({rate:,.0f} rows/s)', ending='\r')
+
+        self.stdout.write(
+            f'Seeding {options["users"]:,} users, {options["teams"]:,} teams '
+            f'and {options["activities"]:,} activities...'
+        )
+        reset_tables()
+        seed_dataset(options['users'], options['teams'], options['activities'], seed=options['seed'],
+                     workers=options['workers'], progress=progress)
+        self.stdout.write(f'\nSeeded in {time.perf_counter() - started:.1f}s')
+
+    def endpoints(self, options):
+        """Yield ``(name, (method, path, body))`` for every router endpoint"""
+        for prefix, viewset, basename in router.registry:
+            queryset = getattr(viewset, 'queryset', None)
+            if queryset is not None:
+                yield f'{basename}-list', ('get', f'/api/{prefix}/', None)
+                pk = queryset.model.objects.order_by('pk').values_list('pk', flat=True).first()
+                if pk is not None:
+                    yield f'{basename}-detail', ('get', f'/api/{prefix}/{pk}/', None)
+            elif f'{basename}-list' in ACTION_PARAMS:
+                query = urlencode(ACTION_PARAMS[f'{basename}-list']())
+                yield f'{basename}-list', ('get', f'/api/{prefix}/?{query}', None)
+            for extra in viewset.get_extra_actions():
+                if 'get' not in extra.mapping:
+                    continue
+                name = f'{basename}-{extra.url_name}'
+                params = ACTION_PARAMS.get(name, dict)()
+                query = f'?{urlencode(params)}' if params else ''
+                yield name, ('get', f'/api/{prefix}/{extra.url_path}/{query}', None)
+
+        if options['include_writes']:
+            teams = max(Team.objects.count(), 1)
+            users = max(User.objects.count(), 1)
+            items = [
+                {
+                    'user_email': activity.user_email, 'user_name': activity.user_name, 'team': activity.team,
+                    'activity_type': activity.activity_type, 'duration_minutes': activity.duration_minutes,
+                    'points_earned': activity.points_earned, 'date': activity.date.isoformat(),
+                }
+                for activity in synthetic_activities(0, 100, users, teams, seed=options['seed'] + 1)
+            ]
+            yield 'activity-create', ('post', '/api/activities/', items[0])
+            yield 'activity-bulk', ('post', '/api/activities/bulk/', items)
+
+    def drive(self, method, path, body, requests, concurrency):
+        """Issue ``requests`` requests from ``concurrency`` threads and summarize them"""
+        def worker(count):
+            client = Client(SERVER_NAME='localhost')
+            send = getattr(client, method)
+            kwargs = {'data': body, 'content_type': 'application/json'} if body is not None else {}
+            samples, queries, errors = [], [], 0
+            try:
+                for _ in range(count):
+                    # Reads may be routed to a replica alias, so every connection is counted
+                    with ExitStack() as stack:
+                        captures = [stack.enter_context(CaptureQueriesContext(db)) for db in connections.all()]
+                        started = time.perf_counter()
+                        response = send(path, **kwargs)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                        samples.append(time.perf_counter() - started)
+                    queries.append(sum(len(captured.captured_queries) for captured in captures))
+                    errors += response.status_code >= 400
+            finally:
+                connections.close_all()
+            return samples, queries, errors
+
+        worker(1)  # warm up caches and connections
+        concurrency = max(1, min(concurrency, requests))
+        shares = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(worker, shares))
+        elapsed = time.perf_counter() - started
+
+        samples = [sample for outcome in outcomes for sample in outcome[0]]
+        queries = [count for outcome in outcomes for count in outcome[1]]
+        return {
+            **summarize(samples),
+            'throughput_rps': round(len(samples) / elapsed, 1),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+            'errors': sum(outcome[2] for outcome in outcomes),
+        }
+
+    def metadata(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'vendor': connection.vendor,
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'dataset': {
+                'users': User.objects.count(),
+                'teams': Team.objects.count(),
+                'activities': Activity.objects.count(),
+            },
+        }
+
+    def print_table(self, results):
+        self.stdout.write(
+            f'\n{"endpoint":<28}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}{"queries":>9}{"errors":>8}'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<28}{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}{result["p99_ms"]:>10.2f}'
+                f'{result["throughput_rps"]:>10.1f}{result["queries_mean"]:>9.1f}{result["errors"]:>8}'
+            )
+
+    def compare(self, results, baseline_path, max_regression):
+        with open(baseline_path) as handle:
+            baseline = json.load(handle)['endpoints']
+        self.stdout.write(f'\n{"endpoint":<28}{"base p95":>10}{"p95":>10}{"change":>10}')
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before or not before['p95_ms']:
+                continue
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+            self.stdout.write(f'{name:<28}{before["p95_ms"]:>10.2f}{result["p95_ms"]:>10.2f}{change:>+9.1f}%')
+            if max_regression is not None and change > max_regression:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f'p95 regressed by more than {max_regression}% for: {", ".join(regressions)}')
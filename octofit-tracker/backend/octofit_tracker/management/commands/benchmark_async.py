@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from octofit_tracker.benchmarking import add_drops_data_argument, summarize
+from octofit_tracker.seeding import user_email
+
+from .benchmark_api import Command as ApiBenchmark
+
+# Async endpoint and the equivalent viewset action it is compared with
+ENDPOINTS = {
+    'activity-by-user': ('/api/async/activities/by_user/', '/api/activities/by_user/'),
+    'leaderboard-users': ('/api/async/leaderboard/users/', '/api/leaderboard/users/'),
+    'leaderboard-teams': ('/api/async/leaderboard/teams/', '/api/leaderboard/teams/'),
+    'teams': ('/api/async/teams/', '/api/teams/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the async read endpoints under ASGI with the viewsets driven by a thread per '
+        'client, at increasing numbers of concurrent clients'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument('--teams', type=int, default=10)
+        parser.add_argument('--activities', type=int, default=100_000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to seed activities')
+        parser.add_argument('--skip-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per endpoint and level')
+        parser.add_argument('--concurrency', default='1,16,64',
+                            help='Comma-separated numbers of concurrent clients')
+        parser.add_argument('--only', help='Comma-separated endpoint names to run')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        add_drops_data_argument(parser)
+
+    def handle(self, *args, **options):
+        api = ApiBenchmark(stdout=self.stdout, stderr=self.stderr)
+        if not options['skip_seed']:
+            api.seed(options)
+
+        endpoints = ENDPOINTS
+        if options['only']:
+            wanted = set(options['only'].split(','))
+            endpoints = {name: paths for name, paths in endpoints.items() if name in wanted}
+        query = f'?{urlencode({"user_email": user_email(0)})}'
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        results = {}
+        for name, (async_path, sync_path) in endpoints.items():
+            if name == 'activity-by-user':
+                async_path, sync_path = async_path + query, sync_path + query
+            for concurrency in levels:
+                self.stdout.write(f'Benchmarking {name} with {concurrency} clients...')
+                results[f'{name}@{concurrency}'] = {
+                    'wsgi': api.drive('get', sync_path, None, options['requests'], concurrency),
+                    'asgi': self.drive_async(async_path, options['requests'], concurrency),
+                }
+
+        self.print_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump({'meta': api.metadata(options), 'endpoints': results}, handle, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}')
+
+    def drive_async(self, path, requests, concurrency):
+        # AsyncClient always sends Host: testserver on this Django version
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            return asyncio.run(self.drive(path, requests, concurrency))
+
+    async def drive(self, path, requests, concurrency):
+        """Issue ``requests`` requests from ``concurrency`` coroutines on one event loop"""
+        client = AsyncClient()
+
+        async def worker(count):
+            samples, errors = [], 0
+            for _ in range(count):
+                started = time.perf_counter()
+                response = await client.get(path)
+                samples.append(time.perf_counter() - started)
+                errors += response.status_code >= 400
+            return samples, errors
+
+        await worker(1)  # warm up caches and connections
+        concurrency = max(1, min(concurrency, requests))
+        shares = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(worker(share) for share in shares))
+        elapsed = time.perf_counter() - started
+
+        samples = [sample for outcome in outcomes for sample in outcome[0]]
+        return {
+            **summarize(samples),
+            'throughput_rps': round(len(samples) / elapsed, 1),
+            'errors': sum(outcome[1] for outcome in outcomes),
+        }
+
+    def print_table(self, results):
+        self.stdout.write(
+            f'\n{"endpoint":<26}{"wsgi p95":>10}{"asgi p95":>10}{"wsgi req/s":>12}{"asgi req/s":>12}{"errors":>8}'
+        )
+        for name, result in results.items():
+            wsgi, asgi = result['wsgi'], result['asgi']
+            self.stdout.write(
+                f'{name:<26}{wsgi["p95_ms"]:>10.2f}{asgi["p95_ms"]:>10.2f}'
+                f'{wsgi["throughput_rps"]:>12.1f}{asgi["throughput_rps"]:>12.1f}'
+                f'{wsgi["errors"] + asgi["errors"]:>8}'
+            )
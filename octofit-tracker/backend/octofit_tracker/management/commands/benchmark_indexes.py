@@ -0,0 +1,131 @@
+import json
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import NotSupportedError, connection
+from octofit_tracker.benchmarking import add_drops_data_argument, ensure_disposable_database, measure, summarize
+from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.seeding import (
+    insert_in_chunks, synthetic_activities, synthetic_teams, synthetic_users, team_name, user_email,
+)
+
+INDEXED_MODELS = (User, Activity, Leaderboard, Workout)
+
+
+class Command(BaseCommand):
+    help = 'Compare hot query latency with and without the lookup indexes on a seeded dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activities', type=int, default=1_000_000,
+                            help='Minimum number of activities in the dataset (default: 1,000,000)')
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--teams', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--explain', action='store_true', help='Print the query plans as well')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+        add_drops_data_argument(parser)
+
+    def handle(self, *args, **options):
+        ensure_disposable_database(options, 'seed rows and drop indexes')
+        self.ensure_dataset(options)
+        queries = self.hot_queries(options)
+
+        self.stdout.write('Timing queries with indexes...')
+        indexed = self.run(queries, options)
+        self.stdout.write('Timing queries without indexes...')
+        with self.indexes_removed():
+            unindexed = self.run(queries, options)
+
+        results = {
+            name: {'indexed': indexed[name], 'unindexed': unindexed[name]}
+            for name in queries
+        }
+        self.report(results)
+        if options['json_path']:
+            document = {
+                'vendor': connection.vendor,
+                'dataset': {
+                    'activities': Activity.objects.count(),
+                    'users': User.objects.count(),
+                    'teams': Team.objects.count(),
+                },
+                'results': results,
+            }
+            with open(options['json_path'], 'w') as handle:
+                json.dump(document, handle, indent=2)
+            self.stdout.write(f'Results written to {options["json_path"]}')
+
+    def ensure_dataset(self, options):
+        """Top the database up to the requested volume with synthetic rows"""
+        users, teams = options['users'], options['teams']
+        existing_teams = set(Team.objects.values_list('name', flat=True))
+        insert_in_chunks(Team, [team for team in synthetic_teams(teams) if team.name not in existing_teams])
+        existing_users = set(User.objects.values_list('email', flat=True))
+        insert_in_chunks(User, [
+            user for user in synthetic_users(0, users, teams) if user.email not in existing_users
+        ])
+
+        missing = options['activities'] - Activity.objects.count()
+        chunk = 10_000
+        for start in range(0, max(missing, 0), chunk):
+            count = min(chunk, missing - start)
+            insert_in_chunks(Activity, synthetic_activities(start, count, users, teams, seed=options['seed']))
+            self.stdout.write(f'Seeded {start + count:,} / {missing:,} activities', ending='\r')
+        if missing > 0:
+            self.stdout.write('')
+
+    def hot_queries(self, options):
+        """Return {name: queryset factory} mirroring the API's hot paths"""
+        email = user_email(0)
+        team = team_name(0)
+        recent = ('-date', '-created_at', 'id')
+        return {
+            'activities_recent_page': lambda: Activity.objects.order_by(*recent)[:100],
+            'activities_by_user': lambda: Activity.objects.filter(user_email=email).order_by(*recent)[:100],
+            'activities_by_team': lambda: Activity.objects.filter(team=team).order_by('-date')[:100],
+            'users_by_team': lambda: User.objects.filter(team=team).order_by('id')[:100],
+            'leaderboard_users': lambda: (
+                Leaderboard.objects.filter(entity_type='user').order_by('-total_points', 'entity_name')[:100]
+            ),
+            'workouts_by_difficulty': lambda: Workout.objects.filter(difficulty_level='advanced').order_by('id')[:100],
+        }
+
+    def run(self, queries, options):
+        results = {}
+        for name, factory in queries.items():
+            if options['explain']:
+                self.explain(name, factory())
+            results[name] = summarize(measure(lambda: list(factory()), options['repeat']))
+        return results
+
+    def explain(self, name, queryset):
+        try:
+            plan = queryset.explain()
+        except NotSupportedError:
+            plan = 'EXPLAIN is not supported by this database backend'
+        self.stdout.write(f'-- {name}\n{plan}')
+
+    @contextmanager
+    def indexes_removed(self):
+        """Temporarily drop the Meta.indexes of the benchmarked models"""
+        with connection.schema_editor() as editor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+        try:
+            yield
+        finally:
+            self.stdout.write('Restoring indexes...')
+            with connection.schema_editor() as editor:
+                for model in INDEXED_MODELS:
+                    for index in model._meta.indexes:
+                        editor.add_index(model, index)
+
+    def report(self, results):
+        self.stdout.write(f'\n{"query":<26}{"indexed p50":>14}{"unindexed p50":>16}{"speedup":>10}')
+        for name, result in results.items():
+            indexed = result['indexed']['p50_ms']
+            unindexed = result['unindexed']['p50_ms']
+            speedup = unindexed / indexed if indexed else float('inf')
+            self.stdout.write(f'{name:<26}{indexed:>11.3f} ms{unindexed:>13.3f} ms{speedup:>9.1f}x')
@@ -0,0 +1,103 @@
+import json
+
+from django.core.management.base import BaseCommand
+from octofit_tracker.benchmarking import add_drops_data_argument
+from octofit_tracker.mongo.pool import listeners
+from octofit_tracker.seeding import team_name, user_email
+
+from .benchmark_api import Command as ApiBenchmark
+
+# Read endpoints that check out a connection per query
+ENDPOINTS = {
+    'activity-by-user': lambda: f'/api/activities/by_user/?user_email={user_email(0)}',
+    'leaderboard-users': lambda: '/api/leaderboard/users/',
+    'user-by-team': lambda: f'/api/users/by_team/?team={team_name(0).replace(" ", "+")}',
+    'workouts': lambda: '/api/workouts/',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure read throughput as the number of worker threads grows, with MongoDB connection pool '
+        'utilization for each level'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument('--teams', type=int, default=10)
+        parser.add_argument('--activities', type=int, default=100_000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to seed activities')
+        parser.add_argument('--skip-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per endpoint and level')
+        parser.add_argument('--threads', default='1,4,16,64', help='Comma-separated numbers of worker threads')
+        parser.add_argument('--only', help='Comma-separated endpoint names to run')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        add_drops_data_argument(parser)
+
+    def handle(self, *args, **options):
+        api = ApiBenchmark(stdout=self.stdout, stderr=self.stderr)
+        if not options['skip_seed']:
+            api.seed(options)
+
+        endpoints = ENDPOINTS
+        if options['only']:
+            wanted = set(options['only'].split(','))
+            endpoints = {name: path for name, path in endpoints.items() if name in wanted}
+        levels = [int(level) for level in options['threads'].split(',')]
+
+        results = {}
+        for name, path in endpoints.items():
+            for threads in levels:
+                self.stdout.write(f'Benchmarking {name} with {threads} threads...')
+                before = self.pool_snapshot(reset=True)
+                result = api.drive('get', path(), None, options['requests'], threads)
+                result['pool'] = self.pool_usage(before, self.pool_snapshot())
+                results[f'{name}@{threads}'] = result
+
+        self.print_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump({'meta': api.metadata(options), 'endpoints': results}, handle, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}')
+
+    def pool_snapshot(self, reset=False):
+        snapshots = {}
+        for alias, listener in list(listeners.items()):
+            if reset:
+                listener.reset_peak()
+            snapshots[alias] = listener.snapshot()
+        return snapshots
+
+    def pool_usage(self, before, after):
+        """Peak connections in use, connections opened and failed check-outs during one run, per alias"""
+        usage = {}
+        for alias, snapshot in after.items():
+            previous = before.get(alias, {})
+            usage[alias] = {
+                'max_size': snapshot['max_size'],
+                'peak_checked_out': sum(snapshot['peak_checked_out'].values()),
+                'connections_created': (
+                    sum(snapshot['created'].values()) - sum(previous.get('created', {}).values())
+                ),
+                'checkout_failures': (
+                    sum(snapshot['checkout_failures'].values())
+                    - sum(previous.get('checkout_failures', {}).values())
+                ),
+            }
+        return usage
+
+    def print_table(self, results):
+        self.stdout.write(
+            f'\n{"endpoint":<26}{"p95 ms":>9}{"req/s":>10}{"errors":>8}{"peak in use":>13}'
+            f'{"opened":>8}{"failed":>8}'
+        )
+        for name, result in results.items():
+            pool = result['pool']
+            peak = sum(usage['peak_checked_out'] for usage in pool.values())
+            opened = sum(usage['connections_created'] for usage in pool.values())
+            failed = sum(usage['checkout_failures'] for usage in pool.values())
+            columns = f'{peak:>13}{opened:>8}{failed:>8}' if pool else f'{"-":>13}{"-":>8}{"-":>8}'
+            self.stdout.write(
+                f'{name:<26}{result["p95_ms"]:>9.2f}{result["throughput_rps"]:>10.1f}{result["errors"]:>8}{columns}'
+            )
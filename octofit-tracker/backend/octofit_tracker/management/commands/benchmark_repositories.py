@@ -0,0 +1,118 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from octofit_tracker.benchmarking import add_drops_data_argument, measure, summarize
+from octofit_tracker.models import Activity, Leaderboard, Team
+from octofit_tracker.pagination import ActivityPagination, LeaderboardPagination
+from octofit_tracker.repositories import Repository, is_native, read_connection
+from octofit_tracker.seeding import user_email
+from octofit_tracker.serializers import (
+    ActivitySerializer, LeaderboardSerializer, LeanListSerializer, count_members_by_team,
+)
+
+from .benchmark_api import Command as ApiBenchmark
+
+
+class Command(BaseCommand):
+    help = ('Measure the CPU time per request of the hot read paths through the ORM and model serializers '
+            'against the repository path, native on MongoDB')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument('--teams', type=int, default=10)
+        parser.add_argument('--activities', type=int, default=100_000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to seed activities')
+        parser.add_argument('--skip-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--page-size', type=int, default=50, help='Rows per page read')
+        parser.add_argument('--repeat', type=int, default=200, help='Timed requests per case and path')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        add_drops_data_argument(parser)
+
+    def handle(self, *args, **options):
+        if not options['skip_seed']:
+            ApiBenchmark(stdout=self.stdout, stderr=self.stderr).seed(options)
+
+        native = is_native(Activity)
+        vendor = read_connection(Activity).vendor
+        if not native:
+            self.stdout.write(self.style.WARNING(
+                f'The {vendor} engine has no native path; the repository path runs through the ORM'
+            ))
+
+        results = {}
+        for name, (orm_path, repository_path) in self.cases(options).items():
+            self.stdout.write(f'Reading {name}...')
+            results[name] = {
+                'orm': self.time(orm_path, options['repeat'], native=False),
+                'repository': self.time(repository_path, options['repeat'], native=True),
+            }
+
+        self.print_table(results)
+        if options['output']:
+            report = {'meta': {'vendor': vendor, 'native': native, 'page_size': options['page_size']},
+                      'cases': results}
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}')
+
+    def cases(self, options):
+        """Return {case: (orm path, repository path)}, each rendering one page of the API output"""
+        size = options['page_size']
+        email = user_email(0)
+        activity_ordering = ActivityPagination.ordering
+        leaderboard_ordering = LeaderboardPagination.ordering
+        team_names = list(Team.objects.order_by('id').values_list('name', flat=True)[:size])
+
+        def orm_activities():
+            activities = (
+                Activity.objects.select_related('user', 'team_ref')
+                .filter(user_email=email).order_by(*activity_ordering)[:size + 1]
+            )
+            return ActivitySerializer(list(activities)[:size], many=True).data
+
+        def repository_activities():
+            rows = Repository(ActivitySerializer).page(
+                {'user_email': email}, ActivitySerializer.Meta.fields, activity_ordering, limit=size + 1,
+            )
+            return LeanListSerializer(ActivitySerializer, rows[:size]).data
+
+        def orm_leaderboard():
+            entries = Leaderboard.objects.filter(entity_type='user').order_by(*leaderboard_ordering)[:size + 1]
+            return LeaderboardSerializer(list(entries)[:size], many=True).data
+
+        def repository_leaderboard():
+            rows = Repository(LeaderboardSerializer).page(
+                {'entity_type': 'user'}, LeaderboardSerializer.Meta.fields, leaderboard_ordering, limit=size + 1,
+            )
+            return LeanListSerializer(LeaderboardSerializer, rows[:size]).data
+
+        def team_counts():
+            return count_members_by_team(team_names)
+
+        return {
+            'activity-by-user': (orm_activities, repository_activities),
+            'leaderboard-users': (orm_leaderboard, repository_leaderboard),
+            'team-member-counts': (team_counts, team_counts),
+        }
+
+    def time(self, path, repeat, native):
+        """Return CPU and wall time summaries of ``path`` with native reads on or off"""
+        with override_settings(NATIVE_MONGO_READS=native):
+            cpu = summarize(measure(path, repeat, clock=time.thread_time))
+            wall = summarize(measure(path, repeat))
+        return {'cpu': cpu, 'wall': wall}
+
+    def print_table(self, results):
+        self.stdout.write(
+            f'\n{"case":<22}{"orm cpu ms":>12}{"repo cpu ms":>13}{"cpu saved":>11}{"orm p50 ms":>12}{"repo p50 ms":>13}'
+        )
+        for name, result in results.items():
+            orm, repository = result['orm'], result['repository']
+            saved = 1 - repository['cpu']['mean_ms'] / orm['cpu']['mean_ms'] if orm['cpu']['mean_ms'] else 0.0
+            self.stdout.write(
+                f'{name:<22}{orm["cpu"]["mean_ms"]:>12.3f}{repository["cpu"]["mean_ms"]:>13.3f}{saved:>10.0%}'
+                f'{orm["wall"]["p50_ms"]:>12.3f}{repository["wall"]["p50_ms"]:>13.3f}'
+            )
@@ -0,0 +1,83 @@
+import json
+
+from django.core.management.base import BaseCommand
+from octofit_tracker.benchmarking import add_drops_data_argument, measure, summarize
+from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.serializers import (
+    LeanListSerializer, UserSerializer, TeamSerializer, ActivitySerializer, LeaderboardSerializer, WorkoutSerializer,
+)
+
+from .benchmark_api import Command as ApiBenchmark
+
+# Model, its serializer and a typical narrow field set a mobile client asks for
+CASES = {
+    'activities': (Activity, ActivitySerializer, ['user_name', 'activity_type', 'points_earned', 'date']),
+    'users': (User, UserSerializer, ['name', 'team', 'total_points']),
+    'teams': (Team, TeamSerializer, ['name', 'total_points', 'member_count']),
+    'leaderboard': (Leaderboard, LeaderboardSerializer, ['entity_name', 'total_points', 'rank']),
+    'workouts': (Workout, WorkoutSerializer, ['name', 'difficulty_level', 'points_value']),
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-row cost of the model serializers against the lean path, with and without fields='
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument('--teams', type=int, default=10)
+        parser.add_argument('--activities', type=int, default=100_000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to seed activities')
+        parser.add_argument('--skip-seed', action='store_true', help='Benchmark the data already in the database')
+        parser.add_argument('--rows', type=int, default=1000, help='Rows serialized per run')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per case')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        add_drops_data_argument(parser)
+
+    def handle(self, *args, **options):
+        if not options['skip_seed']:
+            ApiBenchmark(stdout=self.stdout, stderr=self.stderr).seed(options)
+
+        results = {}
+        for name, (model, serializer_class, narrow) in CASES.items():
+            for label, fields in (('all', None), ('fields', narrow)):
+                self.stdout.write(f'Serializing {name} ({label})...')
+                results[f'{name}:{label}'] = self.compare(model, serializer_class, fields, options)
+
+        self.print_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}')
+
+    def compare(self, model, serializer_class, fields, options):
+        """Time both paths over the same rows, excluding the time spent fetching them"""
+        queryset = model.objects.order_by('id')
+        if fields is None:
+            instances = list(queryset.select_related()[:options['rows']])
+        else:
+            instances = list(serializer_class.narrow_queryset(queryset, fields)[:options['rows']])
+        rows = list(serializer_class.lean_values(queryset, fields or serializer_class.Meta.fields)[:options['rows']])
+        context = {'fields': fields}
+
+        def model_path():
+            return serializer_class(instances, many=True, context=dict(context)).data
+
+        def lean_path():
+            # lean_fill writes computed fields into the rows, so render fresh copies
+            return LeanListSerializer(serializer_class, [dict(row) for row in rows], fields, dict(context)).data
+
+        count = max(len(instances), 1)
+        result = {}
+        for path, render in (('serializer', model_path), ('lean', lean_path)):
+            summary = summarize(measure(render, options['repeat']))
+            result[path] = {**summary, 'us_per_row': round(summary['p50_ms'] * 1000 / count, 2)}
+        result['rows'] = len(instances)
+        return result
+
+    def print_table(self, results):
+        self.stdout.write(f'\n{"case":<22}{"rows":>7}{"serializer us/row":>19}{"lean us/row":>13}{"speedup":>9}')
+        for name, result in results.items():
+            full, lean = result['serializer']['us_per_row'], result['lean']['us_per_row']
+            speedup = full / lean if lean else float('inf')
+            self.stdout.write(f'{name:<22}{result["rows"]:>7}{full:>19.2f}{lean:>13.2f}{speedup:>8.1f}x')
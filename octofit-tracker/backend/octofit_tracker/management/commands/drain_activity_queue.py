@@ -0,0 +1,49 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from octofit_tracker.ingestion import activity_queue, drain
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Write queued activities to the database in batches, applying their point totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Activities claimed and written per batch')
+        parser.add_argument('--lease', type=float, default=60,
+                            help='Seconds before a claimed batch may be retried by another worker')
+        parser.add_argument('--poll-interval', type=float, default=0.5,
+                            help='Seconds to wait when the queue is empty or a write fails')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        queue = activity_queue()
+        written = rejected = 0
+        self.stdout.write(f'Draining {queue.path}...')
+        try:
+            while True:
+                try:
+                    count, failed = drain(queue, options['batch_size'], options['lease'])
+                except Exception:
+                    logger.exception('Writing a batch of queued activities failed; retrying')
+                    close_old_connections()
+                    time.sleep(options['poll_interval'])
+                    continue
+                written += count
+                rejected += failed
+                if count or failed:
+                    stats = queue.stats()
+                    self.stdout.write(
+                        f'  wrote {written:,}, rejected {rejected:,}; '
+                        f'{stats["depth"]:,} waiting, lag {stats["lag_seconds"]:.1f}s'
+                    )
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written:,} activities, rejected {rejected:,}'))
@@ -1,21 +1,43 @@
+import os
+import time
+
 from django.core.management.base import BaseCommand
 from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker import scoring
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.seeding import reset_tables, seed_dataset
 from datetime import date, timedelta
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', action='store_true',
+                            help='Generate a large synthetic dataset instead of the superhero sample data')
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--teams', type=int, default=20)
+        parser.add_argument('--activities', type=int, default=1_000_000)
+        parser.add_argument('--workouts', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes generating and writing activities (default: CPU count)')
+        parser.add_argument('--chunk-size', type=int, default=10_000, help='Rows per bulk insert')
+
     def handle(self, *args, **kwargs):
+        if kwargs.get('synthetic'):
+            return self.populate_synthetic(kwargs)
+
         self.stdout.write(self.style.SUCCESS('Starting database population...'))
 
         # Clear existing data
         self.stdout.write('Clearing existing data...')
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        Workout.objects.all().delete()
+        with scoring.suspended():
+            User.objects.all().delete()
+            Team.objects.all().delete()
+            Activity.objects.all().delete()
+            Leaderboard.objects.all().delete()
+            Workout.objects.all().delete()
 
         # Create Teams
         self.stdout.write('Creating teams...')
@@ -142,41 +164,41 @@ class Command(BaseCommand):
             ('aquaman@dc.com', 'Aquaman (Arthur Curry)', 'Team DC', 'Trident Training', 60, 50),
         ]
 
-        for i, (email, name, team, activity_type, duration, points) in enumerate(activities_data):
-            Activity.objects.create(
-                user_email=email,
-                user_name=name,
-                team=team,
-                activity_type=activity_type,
-                duration_minutes=duration,
-                points_earned=points,
-                date=today - timedelta(days=i % 7),
-                notes=f'Training session for {activity_type.lower()}'
-            )
+        # Seeded totals are set explicitly above, so don't score these activities
+        with scoring.suspended():
+            for i, (email, name, team, activity_type, duration, points) in enumerate(activities_data):
+                Activity.objects.create(
+                    user_email=email,
+                    user_name=name,
+                    team=team,
+                    activity_type=activity_type,
+                    duration_minutes=duration,
+                    points_earned=points,
+                    date=today - timedelta(days=i % 7),
+                    notes=f'Training session for {activity_type.lower()}'
+                )
+
+        self.stdout.write('Building activity rollups...')
+        rebuild_rollups()
 
         # Create Leaderboard entries
         self.stdout.write('Creating leaderboard entries...')
         
-        # Sort users by points
-        sorted_users = sorted(all_users, key=lambda u: u.total_points, reverse=True)
-        for rank, user in enumerate(sorted_users, start=1):
+        # Ranks are counted from the totals as the entries are saved
+        for user in all_users:
             Leaderboard.objects.create(
                 entity_type='user',
                 entity_name=user.name,
                 total_points=user.total_points,
-                rank=rank,
                 team=user.team
             )
 
         # Team leaderboard
-        teams = [team_dc, team_marvel]
-        sorted_teams = sorted(teams, key=lambda t: t.total_points, reverse=True)
-        for rank, team in enumerate(sorted_teams, start=1):
+        for team in [team_dc, team_marvel]:
             Leaderboard.objects.create(
                 entity_type='team',
                 entity_name=team.name,
-                total_points=team.total_points,
-                rank=rank
+                total_points=team.total_points
             )
 
         # Create Workouts
@@ -267,3 +289,37 @@ class Command(BaseCommand):
             f'Leaderboard entries: {Leaderboard.objects.count()}\n'
             f'Workouts: {Workout.objects.count()}'
         ))
+
+    def populate_synthetic(self, options):
+        """Drop and recreate the collections, then bulk load generated data"""
+        self.stdout.write(self.style.SUCCESS(
+            f'Generating {options["users"]:,} users, {options["teams"]:,} teams and '
+            f'{options["activities"]:,} activities with {options["workers"]} worker(s), seed {options["seed"]}...'
+        ))
+        self.stdout.write('Dropping and recreating collections...')
+        reset_tables()
+
+        started = time.perf_counter()
+
+        def progress(model, written):
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(
+                f'  {model._meta.verbose_name_plural}: {written:,} rows ({written / elapsed:,.0f} rows/s)',
+                ending='\r' if model is Activity else '\n',
+            )
+
+        seed_dataset(
+            options['users'], options['teams'], options['activities'],
+            seed=options['seed'], workouts=options['workouts'],
+            chunk_size=options['chunk_size'], workers=options['workers'], progress=progress,
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'\nDatabase populated in {elapsed:.1f}s '
+            f'({options["activities"] / max(elapsed, 1e-9):,.0f} activities/s)\n'
+            f'Users: {User.objects.count()}\n'
+            f'Teams: {Team.objects.count()}\n'
+            f'Activities: {Activity.objects.count()}\n'
+            f'Leaderboard entries: {Leaderboard.objects.count()}\n'
+            f'Workouts: {Workout.objects.count()}'
+        ))
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from octofit_tracker.models import ActivityTombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete activity tombstones older than the delta sync retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ACTIVITY_TOMBSTONE_RETENTION_DAYS,
+                            help='Keep tombstones from this many days')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = ActivityTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted:,} tombstones older than {cutoff:%Y-%m-%d %H:%M}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily, weekly and monthly activity rollups from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rollup rows per bulk insert')
+
+    def handle(self, *args, **options):
+        def progress(period, entity_type, written):
+            self.stdout.write(f'  {period}/{entity_type}: {written:,} buckets written', ending='\r')
+
+        self.stdout.write('Rebuilding activity rollups...')
+        total = rebuild_rollups(options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'\nRebuilt {total:,} rollup buckets'))
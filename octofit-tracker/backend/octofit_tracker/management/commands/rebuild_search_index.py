@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index over users, workouts and activity notes from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Documents read per batch')
+
+    def handle(self, *args, **options):
+        def progress(doc_type, written):
+            self.stdout.write(f'  {doc_type}: {written:,} terms written', ending='\r')
+
+        self.stdout.write('Rebuilding the search index...')
+        total = rebuild_search_index(options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'\nIndexed {total:,} search terms'))
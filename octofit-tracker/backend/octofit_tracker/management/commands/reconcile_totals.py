@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from octofit_tracker.models import User, Team, Activity, ActivityTombstone
+from octofit_tracker.repositories import increment
+
+
+class Command(BaseCommand):
+    help = 'Recompute user and team point totals from their activities in chunks and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Users or teams checked per batch (default: 1000)')
+        parser.add_argument('--fix', action='store_true', help='Correct the totals that drifted')
+        parser.add_argument('--show', type=int, default=10, help='Drifted rows to list per model')
+        parser.add_argument('--settle', type=int, default=60,
+                            help='Leave totals whose activities changed in the last N seconds (default: 60)')
+
+    def handle(self, *args, **options):
+        drifted = 0
+        drifted += self.reconcile(User, 'email', 'user_email', options)
+        drifted += self.reconcile(Team, 'name', 'team', options)
+        if drifted and not options['fix']:
+            self.stdout.write(self.style.WARNING('Run again with --fix to correct the totals'))
+
+    def reconcile(self, model, key_field, activity_field, options):
+        """Walk ``model`` in primary key order comparing totals with summed activities"""
+        label = model._meta.verbose_name_plural
+        scanned = 0
+        drift = []
+        skipped = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                chunk = model.objects.filter(pk__gt=last_pk).order_by('pk')
+                if options['fix']:
+                    # Where rows can be locked, an activity written while the chunk
+                    # is summed commits with its increment after the correction
+                    chunk = chunk.select_for_update()
+                rows = list(chunk.values_list('pk', key_field, 'total_points')[:options['chunk_size']])
+                if not rows:
+                    break
+                sums = dict(
+                    Activity.objects.filter(**{f'{activity_field}__in': [key for _, key, _ in rows]})
+                    .order_by()
+                    .values_list(activity_field)
+                    .annotate(points=Sum('points_earned'))
+                )
+                chunk_drift = [
+                    (pk, key, stored, sums.get(key, 0) - stored)
+                    for pk, key, stored in rows
+                    if sums.get(key, 0) != stored
+                ]
+                if options['fix'] and chunk_drift:
+                    # The difference is added rather than the sum stored, so increments
+                    # landing meanwhile are kept. Totals with recent activity changes
+                    # are left alone: their increments may still be on the way (djongo
+                    # and sqlite cannot hold them back with a lock), and the sum
+                    # would count them twice.
+                    now = timezone.now()
+                    settling = self.recently_changed(
+                        activity_field, [key for _, key, _, _ in chunk_drift], now - timedelta(seconds=options['settle'])
+                    )
+                    for pk, key, _, difference in chunk_drift:
+                        if key in settling:
+                            skipped += 1
+                            continue
+                        increment(model, {'pk': pk}, {'total_points': difference}, {'updated_at': now})
+            drift.extend(chunk_drift)
+            scanned += len(rows)
+            last_pk = rows[-1][0]
+            self.stdout.write(f'{label}: checked {scanned:,}, drifted {len(drift):,}', ending='\r')
+
+        absolute = sum(abs(difference) for *_, difference in drift)
+        summary = f'{label}: checked {scanned:,}, drifted {len(drift):,} ({absolute:,} points)'
+        if options['fix'] and drift:
+            summary += ', fixed' if not skipped else f', fixed all but {skipped:,} with recent activity changes'
+        self.stdout.write((self.style.WARNING if drift else self.style.SUCCESS)(summary))
+        for _, key, stored, difference in sorted(drift, key=lambda row: -abs(row[3]))[:options['show']]:
+            self.stdout.write(f'  {key}: stored {stored:,}, activities {stored + difference:,} ({difference:+,})')
+        return len(drift)
+
+    @staticmethod
+    def recently_changed(activity_field, keys, since):
+        """Return the keys with activities written or deleted since ``since``"""
+        written = Activity.objects.filter(**{f'{activity_field}__in': keys, 'updated_at__gte': since})
+        deleted = ActivityTombstone.objects.filter(**{f'{activity_field}__in': keys, 'deleted_at__gte': since})
+        return (
+            set(written.order_by().values_list(activity_field, flat=True))
+            | set(deleted.order_by().values_list(activity_field, flat=True))
+        )
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0003_activity_user_team_relations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=10)),
+                ('bucket_start', models.DateField()),
+                ('entity_type', models.CharField(max_length=50)),
+                ('entity_key', models.CharField(max_length=255)),
+                ('activity_type', models.CharField(max_length=100)),
+                ('activity_count', models.IntegerField(default=0)),
+                ('total_points', models.IntegerField(default=0)),
+                ('total_minutes', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'activity_rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['entity_type', 'entity_key', 'period', 'bucket_start'], name='rollups_entity_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='activityrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket_start', 'entity_type', 'entity_key', 'activity_type'), name='activity_rollups_bucket_uniq'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+def start_from_created_at(apps, schema_editor):
+    # Existing rows have not changed since they were created
+    Activity = apps.get_model('octofit_tracker', 'Activity')
+    Activity.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0004_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_id', models.BigIntegerField()),
+                ('user_email', models.EmailField(max_length=255)),
+                ('team', models.CharField(blank=True, max_length=255, null=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'activity_tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(start_from_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user_email', 'updated_at', 'id'], name='activities_user_changes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitytombstone',
+            index=models.Index(fields=['user_email', 'deleted_at', 'id'], name='tombstones_user_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitytombstone',
+            index=models.Index(fields=['deleted_at'], name='tombstones_deleted_idx'),
+        ),
+    ]
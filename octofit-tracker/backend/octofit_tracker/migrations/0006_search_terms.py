@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0005_activity_change_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('doc_type', models.CharField(max_length=20)),
+                ('doc_id', models.BigIntegerField()),
+                ('weight', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'search_terms',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['term', 'doc_type'], name='search_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['doc_type', 'doc_id'], name='search_doc_idx'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:02
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def merge_duplicate_entries(apps, schema_editor):
+    # Concurrent first activities could insert an entry twice, each copy holding part of its points
+    Leaderboard = apps.get_model('octofit_tracker', 'Leaderboard')
+    copies = defaultdict(list)
+    for pk, entity_type, entity_name, points in Leaderboard.objects.order_by('id').values_list(
+        'id', 'entity_type', 'entity_name', 'total_points'
+    ):
+        copies[(entity_type, entity_name)].append((pk, points))
+    for entries in copies.values():
+        if len(entries) > 1:
+            Leaderboard.objects.filter(pk=entries[0][0]).update(total_points=sum(points for _, points in entries))
+            Leaderboard.objects.filter(pk__in=[pk for pk, _ in entries[1:]]).delete()
+
+
+def build_score_trees(apps, schema_editor):
+    from octofit_tracker.ranking import ScoreTree
+
+    Leaderboard = apps.get_model('octofit_tracker', 'Leaderboard')
+    LeaderboardScoreNode = apps.get_model('octofit_tracker', 'LeaderboardScoreNode')
+    counts = defaultdict(lambda: defaultdict(int))
+    for entity_type, points in Leaderboard.objects.values_list('entity_type', 'total_points'):
+        counts[entity_type][points] += 1
+    tree = ScoreTree()
+    LeaderboardScoreNode.objects.bulk_create([
+        LeaderboardScoreNode(entity_type=entity_type, node=node, entries=entries)
+        for entity_type, totals in counts.items()
+        for node, entries in tree.changes(totals).items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0006_search_terms'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_entries, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='LeaderboardScoreNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(max_length=50)),
+                ('node', models.BigIntegerField()),
+                ('entries', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'leaderboard_score_nodes',
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='leaderboard',
+            options={'ordering': ['entity_type', '-total_points', 'entity_name']},
+        ),
+        migrations.RemoveIndex(
+            model_name='leaderboard',
+            name='leaderboard_type_rank_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='leaderboard',
+            name='leaderboard_type_name_idx',
+        ),
+        migrations.RemoveField(
+            model_name='leaderboard',
+            name='rank',
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['entity_type', '-total_points', 'entity_name'], name='leaderboard_standings_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboard',
+            constraint=models.UniqueConstraint(fields=('entity_type', 'entity_name'), name='leaderboard_entry_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardscorenode',
+            constraint=models.UniqueConstraint(fields=('entity_type', 'node'), name='leaderboard_score_node_uniq'),
+        ),
+        migrations.RunPython(build_score_trees, migrations.RunPython.noop),
+    ]
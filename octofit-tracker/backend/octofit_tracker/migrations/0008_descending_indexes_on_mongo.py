@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def repair_descending_indexes(apps, schema_editor):
+    # Stock djongo created descending fields as ascending keys named e.g. 'date" DESC'
+    if schema_editor.connection.vendor != 'djongo':
+        return
+    for name in ('Activity', 'Leaderboard'):
+        model = apps.get_model('octofit_tracker', name)
+        for index in model._meta.indexes:
+            schema_editor.repair_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0007_leaderboard_score_tree'),
+    ]
+
+    operations = [
+        migrations.RunPython(repair_descending_indexes, migrations.RunPython.noop),
+    ]
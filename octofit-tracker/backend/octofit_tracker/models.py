@@ -4,12 +4,19 @@ class User(models.Model):
     email = models.EmailField(unique=True, max_length=255)
     name = models.CharField(max_length=255)
     team = models.CharField(max_length=255, blank=True, null=True)
+    team_ref = models.ForeignKey(
+        'Team', on_delete=models.SET_NULL, blank=True, null=True, related_name='members'
+    )
     total_points = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team'], name='users_team_idx'),
+            models.Index(fields=['name'], name='users_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -34,35 +41,79 @@ class Activity(models.Model):
     user_email = models.EmailField(max_length=255)
     user_name = models.CharField(max_length=255)
     team = models.CharField(max_length=255, blank=True, null=True)
+    # Relations resolved from the string fields above on save; the strings are
+    # kept as written for API compatibility until every row is backfilled.
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True, related_name='activities'
+    )
+    team_ref = models.ForeignKey(
+        Team, on_delete=models.SET_NULL, blank=True, null=True, related_name='activities'
+    )
     activity_type = models.CharField(max_length=100)
     duration_minutes = models.IntegerField()
     points_earned = models.IntegerField()
     date = models.DateField()
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Change marker for delta sync; deletions are recorded as ActivityTombstone rows
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'activities'
         ordering = ['-date', '-created_at']
+        indexes = [
+            # Default ordering and keyset pagination order
+            models.Index(fields=['-date', '-created_at', 'id'], name='activities_recent_idx'),
+            models.Index(fields=['user_email', '-date', '-created_at'], name='activities_user_recent_idx'),
+            models.Index(fields=['team', '-date'], name='activities_team_date_idx'),
+            models.Index(fields=['user_email', 'updated_at', 'id'], name='activities_user_changes_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user_name} - {self.activity_type} ({self.date})"
 
 
 class Leaderboard(models.Model):
+    """One entry of the user or team leaderboard.
+
+    Ranks are not stored: they are counted from ``LeaderboardScoreNode`` on
+    read (see ``ranking.LeaderboardEngine.ranks``), in the order of ``Meta.ordering``.
+    """
     entity_type = models.CharField(max_length=50)  # 'user' or 'team'
     entity_name = models.CharField(max_length=255)
     total_points = models.IntegerField()
-    rank = models.IntegerField()
     team = models.CharField(max_length=255, blank=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'leaderboard'
-        ordering = ['rank']
+        ordering = ['entity_type', '-total_points', 'entity_name']
+        constraints = [
+            models.UniqueConstraint(fields=['entity_type', 'entity_name'], name='leaderboard_entry_uniq'),
+        ]
+        indexes = [
+            # Rank order, and the entries tied on a total
+            models.Index(fields=['entity_type', '-total_points', 'entity_name'], name='leaderboard_standings_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.entity_name} - {self.total_points} points"
+
+
+class LeaderboardScoreNode(models.Model):
+    """One node of the Fenwick tree counting leaderboard entries per total (see ``ranking.ScoreTree``)."""
+    entity_type = models.CharField(max_length=50)
+    node = models.BigIntegerField()
+    entries = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'leaderboard_score_nodes'
+        constraints = [
+            models.UniqueConstraint(fields=['entity_type', 'node'], name='leaderboard_score_node_uniq'),
+        ]
 
     def __str__(self):
-        return f"{self.entity_name} - Rank {self.rank}"
+        return f"{self.entity_type} node {self.node}: {self.entries}"
 
 
 class Workout(models.Model):
@@ -78,6 +129,73 @@ class Workout(models.Model):
 
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['difficulty_level'], name='workouts_difficulty_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class ActivityRollup(models.Model):
+    period = models.CharField(max_length=10)  # 'day', 'week' or 'month'
+    bucket_start = models.DateField()
+    entity_type = models.CharField(max_length=50)  # 'user' or 'team'
+    entity_key = models.CharField(max_length=255)  # user email or team name
+    activity_type = models.CharField(max_length=100)
+    activity_count = models.IntegerField(default=0)
+    total_points = models.IntegerField(default=0)
+    total_minutes = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'activity_rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'bucket_start', 'entity_type', 'entity_key', 'activity_type'],
+                name='activity_rollups_bucket_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['entity_type', 'entity_key', 'period', 'bucket_start'], name='rollups_entity_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.entity_key} - {self.activity_type} ({self.period} of {self.bucket_start})"
+
+
+class ActivityTombstone(models.Model):
+    """Marks a deleted activity so delta sync clients can drop it."""
+    activity_id = models.BigIntegerField()
+    user_email = models.EmailField(max_length=255)
+    team = models.CharField(max_length=255, blank=True, null=True)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'activity_tombstones'
+        indexes = [
+            models.Index(fields=['user_email', 'deleted_at', 'id'], name='tombstones_user_deleted_idx'),
+            models.Index(fields=['deleted_at'], name='tombstones_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"Activity {self.activity_id} deleted at {self.deleted_at}"
+
+
+class SearchTerm(models.Model):
+    """One token of an indexed user, workout or activity, weighted by the fields it occurs in."""
+    term = models.CharField(max_length=64)
+    doc_type = models.CharField(max_length=20)  # 'user', 'workout' or 'activity'
+    doc_id = models.BigIntegerField()
+    weight = models.IntegerField()
+
+    class Meta:
+        db_table = 'search_terms'
+        indexes = [
+            # Prefix scans over term; doc lookups when a document is reindexed
+            models.Index(fields=['term', 'doc_type'], name='search_term_idx'),
+            models.Index(fields=['doc_type', 'doc_id'], name='search_doc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.doc_type} {self.doc_id}"
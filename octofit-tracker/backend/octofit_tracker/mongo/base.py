@@ -0,0 +1,59 @@
+"""djongo backend whose pooled MongoClient is shared by every thread and outlives requests.
+
+Stock djongo keeps one client per database name and closes it whenever a
+connection is closed, which Django does at the end of every request: each close
+drops the whole pool under every other thread, so workers keep reconnecting.
+Here each alias gets its own client, built from its ``CLIENT`` options with a
+pool listener attached, and closing a connection only drops this thread's
+handle on it. Aliases naming the same database, such as ``default`` and a
+``reads`` alias with another read preference, therefore keep separate pools.
+Model indexes are created natively, with their sort directions (see ``schema``).
+"""
+import threading
+from collections import OrderedDict
+
+from djongo import base
+from djongo.base import DjongoClient
+from pymongo import MongoClient
+
+from .pool import PoolListener, listeners
+from .schema import DatabaseSchemaEditor
+
+_clients = {}
+_client_options = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(alias, options):
+    """Return the process-wide client for ``alias``, creating it on first use.
+
+    A client built from other options, e.g. before the settings were
+    overridden, is closed and replaced rather than handed out.
+    """
+    with _clients_lock:
+        client = _clients.get(alias)
+        if client is not None and _client_options.get(alias) != options:
+            client.close()
+            client = None
+        if client is None:
+            listener = listeners[alias] = PoolListener(alias, options.get('maxPoolSize', 100))
+            client = _clients[alias] = MongoClient(**options, event_listeners=[listener], connect=False)
+            _client_options[alias] = dict(options)
+        return client
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    SchemaEditorClass = DatabaseSchemaEditor
+
+    def get_new_connection(self, connection_params):
+        name = connection_params.pop('name')
+        enforce_schema = connection_params.pop('enforce_schema')
+        connection_params['document_class'] = OrderedDict
+        self.client_connection = shared_client(self.alias, connection_params)
+        database = self.client_connection[name]
+        self.djongo_connection = DjongoClient(database, enforce_schema)
+        return database
+
+    def _close(self):
+        # The pool serves every thread using this alias and lives as long as the process
+        pass
@@ -0,0 +1,130 @@
+"""Connection pool metrics for the MongoDB clients, collected from pymongo pool events."""
+import threading
+import time
+from collections import Counter
+
+from pymongo import monitoring
+
+from ..instrumentation import registry, sample_lines
+
+checkout_wait = registry.histogram(
+    'octofit_mongo_pool_checkout_wait_seconds', 'Time spent waiting for a pooled MongoDB connection.', ('alias',),
+)
+
+# Client alias -> PoolListener, filled in as the clients are created
+listeners = {}
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Counts open, checked-out and newly created connections per server for one client."""
+
+    def __init__(self, alias, max_size):
+        self.alias = alias
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._open = Counter()
+        self._checked_out = Counter()
+        self._peak = Counter()
+        self._created = Counter()
+        self._failures = Counter()
+        # Check-outs on one thread are sequential, so one start time per thread suffices
+        self._waiting = threading.local()
+
+    def _address(self, event):
+        host, port = event.address
+        return f'{host}:{port}'
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = self._address(event)
+        with self._lock:
+            self._open.pop(address, None)
+            self._checked_out.pop(address, None)
+
+    def connection_created(self, event):
+        address = self._address(event)
+        with self._lock:
+            self._open[address] += 1
+            self._created[address] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._open[self._address(event)] -= 1
+
+    def connection_check_out_started(self, event):
+        self._waiting.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._observe_wait()
+        with self._lock:
+            self._failures[event.reason] += 1
+
+    def connection_checked_out(self, event):
+        self._observe_wait()
+        address = self._address(event)
+        with self._lock:
+            self._checked_out[address] += 1
+            self._peak[address] = max(self._peak[address], self._checked_out[address])
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._checked_out[self._address(event)] -= 1
+
+    def _observe_wait(self):
+        started = getattr(self._waiting, 'started', None)
+        if started is not None:
+            checkout_wait.observe(time.perf_counter() - started, self.alias)
+            self._waiting.started = None
+
+    def reset_peak(self):
+        with self._lock:
+            self._peak = Counter(self._checked_out)
+
+    def snapshot(self):
+        """Return the current counts, per server address where they are tracked per server"""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'open': dict(self._open),
+                'checked_out': dict(self._checked_out),
+                'peak_checked_out': dict(self._peak),
+                'created': dict(self._created),
+                'checkout_failures': dict(self._failures),
+            }
+
+
+@registry.register_collector
+def pool_metrics():
+    snapshots = {alias: listener.snapshot() for alias, listener in list(listeners.items())}
+    per_server = {
+        'open': ('octofit_mongo_pool_connections', 'Open connections in the pool.', 'gauge'),
+        'checked_out': ('octofit_mongo_pool_checked_out', 'Connections currently checked out.', 'gauge'),
+        'created': ('octofit_mongo_pool_connections_created_total', 'Connections opened since start.', 'counter'),
+    }
+    lines = sample_lines(
+        'octofit_mongo_pool_max_size', 'Configured maximum pool size per server.', 'gauge',
+        [({'alias': alias}, snapshot['max_size']) for alias, snapshot in snapshots.items()],
+    )
+    for key, (name, documentation, kind) in per_server.items():
+        lines += sample_lines(name, documentation, kind, [
+            ({'alias': alias, 'address': address}, value)
+            for alias, snapshot in snapshots.items()
+            for address, value in sorted(snapshot[key].items())
+        ])
+    lines += sample_lines(
+        'octofit_mongo_pool_checkout_failures_total', 'Failed connection check-outs by reason.', 'counter',
+        [
+            ({'alias': alias, 'reason': reason}, value)
+            for alias, snapshot in snapshots.items()
+            for reason, value in sorted(snapshot['checkout_failures'].items())
+        ],
+    )
+    return lines
@@ -0,0 +1,48 @@
+"""Schema editor that creates ``Meta.indexes`` with their sort directions.
+
+djongo translates index SQL by splitting the column list on commas, so a
+descending field such as ``-date`` becomes an ascending index on a field
+literally named ``date" DESC``. Model indexes are created here with
+``create_index`` and each field's direction instead.
+"""
+from djongo.schema import DatabaseSchemaEditor as BaseSchemaEditor
+
+
+def index_keys(model, index):
+    """Return the ``create_index`` key list of ``index``, e.g. ``[('date', -1), ('id', 1)]``"""
+    return [
+        (model._meta.get_field(name).column, -1 if order == 'DESC' else 1)
+        for name, order in index.fields_orders
+    ]
+
+
+class DatabaseSchemaEditor(BaseSchemaEditor):
+
+    def collection(self, model):
+        self.connection.ensure_connection()
+        return self.connection.connection[model._meta.db_table]
+
+    def create_model(self, model):
+        super().create_model(model)
+        for index in model._meta.indexes:
+            self.add_index(model, index)
+
+    def _model_indexes_sql(self, model):
+        # Meta.indexes are created natively by create_model
+        names = {self.quote_name(index.name) for index in model._meta.indexes}
+        return [
+            statement for statement in super()._model_indexes_sql(model)
+            if str(statement.parts.get('name')) not in names
+        ]
+
+    def add_index(self, model, index):
+        self.collection(model).create_index(index_keys(model, index), name=index.name)
+
+    def repair_index(self, model, index):
+        """Recreate ``index`` if it exists with other keys, e.g. as created by stock djongo"""
+        collection = self.collection(model)
+        keys = index_keys(model, index)
+        existing = collection.index_information().get(index.name)
+        if existing is not None and [tuple(key) for key in existing['key']] != keys:
+            collection.drop_index(index.name)
+            collection.create_index(keys, name=index.name)
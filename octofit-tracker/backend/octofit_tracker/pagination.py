@@ -0,0 +1,156 @@
+"""Keyset (cursor) pagination for the API viewsets."""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination that filters on every field of a unique ordering.
+
+    DRF's CursorPagination positions on the first ordering field and skips ties
+    with an offset, which degrades on fields such as ``date``. Here the cursor
+    holds the values of the whole ordering tuple, so every page is a single
+    range query that costs the same at any depth and is unaffected by rows
+    inserted before the cursor.
+    """
+    ordering = ('id',)
+    page_size = api_settings.PAGE_SIZE or 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    def get_page_queryset(self, queryset, request):
+        """Return the unevaluated queryset for the requested page"""
+        ordering, values = self.start_page(request, queryset.model)
+        if values is not None:
+            queryset = queryset.filter(self._after(ordering, values))
+        return queryset.order_by(*ordering)[:self.page_size + 1]
+
+    def paginate_rows(self, fetch, model, request):
+        """Paginate rows from ``fetch(ordering, after, limit)``, for pages not read through a queryset"""
+        ordering, values = self.start_page(request, model)
+        return self.set_page(list(fetch(ordering, values, self.page_size + 1)))
+
+    def start_page(self, request, model):
+        """Read the page size and cursor, returning the ordering to fetch in and the values to start after"""
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.model = model
+        self.cursor = self.decode_cursor(request)
+        self.reverse = False
+        if self.cursor is None:
+            return self.ordering, None
+        values, self.reverse = self.cursor
+        if self.reverse:
+            return [self._flip(field) for field in self.ordering], values
+        return self.ordering, values
+
+    def set_page(self, rows):
+        """Trim the fetched rows to a page and work out the neighbouring cursors"""
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            raw_values, reverse = payload['v'], bool(payload.get('r'))
+            if len(raw_values) != len(self.ordering):
+                raise ValueError(encoded)
+            values = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, raw_values)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, row, reverse):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = {'v': values, 'r': 1} if reverse else {'v': values}
+        encoded = urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('ascii'))
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.decode('ascii'))
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _after(ordering, values):
+        """Build ``(a, b, c) > (x, y, z)`` for the given ordering as a Q object"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+
+class ActivityPagination(KeysetPagination):
+    ordering = ('-date', '-created_at', 'id')
+
+
+class LeaderboardPagination(KeysetPagination):
+    # Rank order: ranks are counted rather than stored (see ranking.LeaderboardEngine)
+    ordering = ('entity_type', '-total_points', 'entity_name')
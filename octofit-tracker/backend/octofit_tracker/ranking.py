@@ -0,0 +1,399 @@
+"""Ranking engines for the all-time and windowed leaderboards."""
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, router, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .live import rank_broker
+from .models import ActivityRollup, Leaderboard, LeaderboardScoreNode
+from .repositories import accumulate, increment_each, is_duplicate
+
+
+class RankingBoard:
+    """Entities sorted by points (descending) and then by name.
+
+    Ranks are ordinal positions, matching the ``rank`` values written by
+    ``populate_db``: ties are broken by name so every entity has a distinct rank.
+    Lookups are a binary search and moving an entity only shifts the slice of the
+    list between its old and new position, so the population is never re-sorted.
+    """
+
+    def __init__(self, entries=()):
+        self._points = dict(entries)
+        self._keys = sorted((-points, name) for name, points in self._points.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, name):
+        return name in self._points
+
+    def points(self, name):
+        """Return the total for ``name``, or None if it is not ranked"""
+        return self._points.get(name)
+
+    def rank(self, name):
+        """Return the 1-based rank of ``name``, or None if it is not ranked"""
+        points = self._points.get(name)
+        if points is None:
+            return None
+        return bisect_left(self._keys, (-points, name)) + 1
+
+    def set(self, name, points):
+        """Set the total for ``name`` and return its ``(old_rank, new_rank)``"""
+        old_rank = self.rank(name)
+        if old_rank is not None:
+            del self._keys[old_rank - 1]
+        self._points[name] = points
+        key = (-points, name)
+        index = bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        return old_rank, index + 1
+
+    def add(self, name, delta):
+        """Add ``delta`` points to ``name`` and return its ``(old_rank, new_rank)``"""
+        return self.set(name, self._points.get(name, 0) + delta)
+
+    def around(self, name, radius):
+        """Return ``(rank, name, points)`` for ``name`` and up to ``radius`` entries either side"""
+        rank = self.rank(name)
+        if rank is None:
+            return []
+        start = max(rank - radius, 1)
+        return self.top(rank + radius - start + 1, start)
+
+    def top(self, count, start=1):
+        """Return ``(rank, name, points)`` for ``count`` entries from rank ``start``"""
+        begin = max(start, 1) - 1
+        return [
+            (begin + offset + 1, name, -negated)
+            for offset, (negated, name) in enumerate(self._keys[begin:begin + count])
+        ]
+
+
+class ScoreTree:
+    """Number of leaderboard entries per total, as a Fenwick tree in ``LeaderboardScoreNode`` rows.
+
+    Totals map to indexes ``1..size`` and node ``i`` counts the entries whose
+    index falls in ``(i - lowbit(i), i]``. Adding or removing an entry touches
+    at most 33 nodes, and the entries above a total are counted from at most
+    that many, whatever the size of the leaderboard. Nodes only ever have
+    counts added to them, so concurrent writers cannot overwrite each other,
+    and a move by a few points only changes the nodes below where the two
+    paths meet.
+    """
+    size = 1 << 32
+    offset = 1 << 31
+
+    def index(self, points):
+        return points + self.offset + 1
+
+    def changes(self, counts):
+        """Return {node: entries} for adding ``counts`` ({total: entries}) to the tree"""
+        nodes = Counter()
+        for points, entries in counts.items():
+            index = self.index(points)
+            while index <= self.size:
+                nodes[index] += entries
+                index += index & -index
+        return {node: entries for node, entries in nodes.items() if entries}
+
+    def lookups(self, totals):
+        """Return the nodes ``standings`` reads for ``totals``"""
+        nodes = {self.size}
+        for points in totals:
+            for index in (self.index(points), self.index(points) - 1):
+                while index > 0:
+                    nodes.add(index)
+                    index -= index & -index
+        return nodes
+
+    def standings(self, counts, totals):
+        """Return {total: (entries above it, entries on it)} from node ``counts``"""
+        def prefix(index):
+            entries = 0
+            while index > 0:
+                entries += counts.get(index, 0)
+                index -= index & -index
+            return entries
+        everyone = counts.get(self.size, 0)
+        standings = {}
+        for points in totals:
+            below = prefix(self.index(points) - 1)
+            through = prefix(self.index(points))
+            standings[points] = (everyone - through, through - below)
+        return standings
+
+    def read(self, entity_type, totals, using=None):
+        """Return ``standings`` of ``totals`` for one entity type, with one query"""
+        counts = dict(
+            LeaderboardScoreNode.objects.using(using)
+            .filter(entity_type=entity_type, node__in=sorted(self.lookups(totals)))
+            .values_list('node', 'entries')
+        )
+        return self.standings(counts, totals)
+
+    def add(self, entity_type, counts):
+        """Add ``counts`` ({total: entries}, negative to remove) to the tree of one entity type"""
+        accumulate(LeaderboardScoreNode, ('entity_type', 'node'), {
+            (entity_type, node): {'entries': entries} for node, entries in self.changes(counts).items()
+        })
+
+    def rebuild(self):
+        """Recount every tree from the leaderboard entries"""
+        counts = defaultdict(dict)
+        for entity_type, points, entries in (
+            Leaderboard.objects.order_by().values('entity_type', 'total_points')
+            .annotate(entries=Count('id')).values_list('entity_type', 'total_points', 'entries')
+        ):
+            counts[entity_type][points] = entries
+        LeaderboardScoreNode.objects.all().delete()
+        LeaderboardScoreNode.objects.bulk_create([
+            LeaderboardScoreNode(entity_type=entity_type, node=node, entries=entries)
+            for entity_type, totals in counts.items()
+            for node, entries in self.changes(totals).items()
+        ], batch_size=1000)
+
+
+class LeaderboardEngine:
+    """Applies point deltas to the user and team leaderboards and reports the ranks they move to.
+
+    Totals are added in the database (``F()``, or ``$inc`` on djongo) and
+    entries are counted per total in a ``ScoreTree``, so every process
+    writing activities (web workers, the queue drainer) works on the same
+    state and none overwrites another's increments. Ranks are never stored:
+    an entry's rank is the number of entries above its total plus the
+    entries tied with it that sort first by name, so a batch writes its own
+    entries and a few tree nodes instead of renumbering the entries in
+    between. Entries are unique per entity type and name; a name seen for
+    the first time is inserted once, whichever writer gets there first.
+    The entries a batch moved are published to the live stream as one event
+    once the write commits.
+    """
+
+    def __init__(self):
+        self.tree = ScoreTree()
+
+    def invalidate(self, entity_type=None):
+        """Tell stream clients to reload, after changes the rank events cannot describe"""
+        rank_broker.publish('resync', entity_type=entity_type)
+
+    def apply(self, entity_type, deltas, teams=None):
+        """Add ``deltas`` ({entity_name: points}) to the totals of ``entity_type``"""
+        teams = teams or {}
+        deltas = {name: delta for name, delta in deltas.items() if name}
+        if not deltas:
+            return
+        with transaction.atomic():
+            moves = self._persist(entity_type, deltas, teams)
+        # New ranks are final for the whole batch, so the batch is one event (see live.py)
+        entries = sorted((
+            {'entity_name': name, 'total_points': points, 'old_rank': old_rank, 'new_rank': new_rank,
+             'team': teams.get(name)}
+            for name, (points, old_rank, new_rank) in moves.items()
+        ), key=lambda entry: entry['new_rank'])
+        transaction.on_commit(lambda: rank_broker.publish('ranks', entity_type=entity_type, entries=entries))
+
+    def ranks(self, entries, using=None):
+        """Return {(entity_type, entity_name): rank} for ``(entity_type, entity_name, total_points)`` entries.
+
+        One tree read per entity type gives the entries above each total and
+        the number tied on it. Ties are only counted in the table when some of
+        the tied entries are not among ``entries``, which for a page in rank
+        order is at most its first and last total.
+        """
+        names = defaultdict(set)
+        for entity_type, name, points in entries:
+            names[(entity_type, points)].add(name)
+        totals = defaultdict(set)
+        for entity_type, points in names:
+            totals[entity_type].add(points)
+        ranks = {}
+        for entity_type, points_set in totals.items():
+            standings = self.tree.read(entity_type, points_set, using)
+            for points in points_set:
+                above, tied = standings[points]
+                group = sorted(names[(entity_type, points)])
+                offsets = self._tie_offsets(entity_type, points, group, tied, using)
+                for name, offset in zip(group, offsets):
+                    ranks[(entity_type, name)] = above + offset + 1
+        return ranks
+
+    def track(self, before, after):
+        """Count an entry saved or deleted outside the engine in the score tree.
+
+        ``before`` and ``after`` are its ``(entity_type, total_points)`` before
+        and after the change, or None when it did not or no longer exists.
+        """
+        if before == after:
+            return
+        counts = defaultdict(Counter)
+        if before is not None:
+            counts[before[0]][before[1]] -= 1
+        if after is not None:
+            counts[after[0]][after[1]] += 1
+        for entity_type, changes in counts.items():
+            self.tree.add(entity_type, changes)
+
+    def rebuild(self):
+        """Recount the score tree from the leaderboard, e.g. after entries were bulk inserted"""
+        self.tree.rebuild()
+
+    def rename(self, entity_type, old_name, new_name):
+        """Move an entry to a new name, merging it into an entry that already has that name"""
+        with transaction.atomic():
+            rows = Leaderboard.objects.filter(entity_type=entity_type)
+            points = (
+                rows.filter(entity_name=old_name).select_for_update().values_list('total_points', flat=True).first()
+            )
+            if points is None:
+                return
+            now = timezone.now()
+            if not rows.filter(entity_name=new_name).exists():
+                rows.filter(entity_name=old_name).update(entity_name=new_name, updated_at=now)
+            else:
+                # Entries are keyed by name, so users who now share one share an entry.
+                # The post_delete hook takes the old entry out of the score tree.
+                previous = increment_each(
+                    Leaderboard, {'entity_type': entity_type}, 'entity_name', 'total_points', {new_name: points},
+                    {'updated_at': now},
+                )
+                if new_name in previous:
+                    self.tree.add(entity_type, self._move(previous[new_name], points))
+                rows.filter(entity_name=old_name).delete()
+        transaction.on_commit(lambda: self.invalidate(entity_type))
+
+    def _persist(self, entity_type, deltas, teams):
+        """Write the batch and return {name: (points, old_rank, new_rank)} for the entries that moved"""
+        using = router.db_for_write(Leaderboard)
+        rows = Leaderboard.objects.filter(entity_type=entity_type)
+        existing = dict(
+            rows.filter(entity_name__in=list(deltas)).select_for_update().values_list('entity_name', 'total_points')
+        )
+        old_ranks = self.ranks([(entity_type, name, points) for name, points in existing.items()], using)
+        created = self._create(entity_type, sorted(set(deltas) - set(existing)), teams)
+
+        now = timezone.now()
+        previous = increment_each(
+            Leaderboard, {'entity_type': entity_type}, 'entity_name', 'total_points', deltas, {'updated_at': now},
+        )
+        names_by_team = defaultdict(list)
+        for name in deltas:
+            if name not in created and teams.get(name) is not None:
+                names_by_team[teams[name]].append(name)
+        for team, names in names_by_team.items():
+            rows.filter(entity_name__in=names).exclude(team=team).update(team=team, updated_at=now)
+
+        counts = Counter({0: len(created)})
+        for name, points in previous.items():
+            counts.update(self._move(points, deltas[name]))
+        self.tree.add(entity_type, counts)
+
+        totals = {name: previous[name] + deltas[name] for name in previous}
+        totals.update((name, deltas[name]) for name in created if name not in totals)
+        new_ranks = self.ranks([(entity_type, name, points) for name, points in totals.items()], using)
+        return {
+            name: (points, old_ranks.get((entity_type, name)), new_ranks[(entity_type, name)])
+            for name, points in totals.items()
+        }
+
+    @staticmethod
+    def _move(points, delta):
+        """Return the score tree counts for an entry moving from ``points`` by ``delta``"""
+        counts = Counter({points: -1})
+        counts[points + delta] += 1
+        return counts
+
+    @staticmethod
+    def _create(entity_type, names, teams):
+        """Insert entries at zero points and return the names this call inserted.
+
+        The unique constraint settles concurrent first activities: an insert
+        that loses the race fails and the other writer's entry is added to.
+        """
+        created = []
+        for name in names:
+            try:
+                with transaction.atomic():
+                    # bulk_create skips the post_save hook that resyncs stream clients and
+                    # counts the entry in the score tree; the caller counts it.
+                    Leaderboard.objects.bulk_create([Leaderboard(
+                        entity_type=entity_type, entity_name=name, total_points=0, team=teams.get(name),
+                    )])
+            except DatabaseError as error:
+                if not is_duplicate(error):
+                    raise
+            else:
+                created.append(name)
+        return created
+
+    @staticmethod
+    def _tie_offsets(entity_type, points, names, tied, using):
+        """Return how many of the ``tied`` entries on ``points`` sort before each of ``names``"""
+        if len(names) >= tied:
+            return range(len(names))
+        rows = Leaderboard.objects.using(using).filter(entity_type=entity_type, total_points=points)
+        first = rows.filter(entity_name__lt=names[0]).count()
+        if len(names) == 1 or rows.filter(entity_name__gte=names[0], entity_name__lte=names[-1]).count() == len(names):
+            return range(first, first + len(names))
+        return [first] + [rows.filter(entity_name__lt=name).count() for name in names[1:]]
+
+
+leaderboard_engine = LeaderboardEngine()
+
+
+class WindowedRankings:
+    """Per-window boards built from the day, week and month activity rollups.
+
+    A board is keyed by ``(entity_type, period, bucket_start)`` and ranks rollup
+    entity keys (user emails or team names). It is loaded with one grouped query
+    over the bucket's rows, then kept current from the bucket deltas returned by
+    ``apply_rollup_changes``. Boards are dropped after ``LEADERBOARD_WINDOW_TTL``
+    seconds so processes that did not see a write catch up, and only the most
+    recently used ``max_boards`` are kept.
+    """
+
+    def __init__(self, max_boards=64):
+        self._lock = threading.RLock()
+        self._boards = OrderedDict()
+        self.max_boards = max_boards
+
+    def board(self, entity_type, period, start):
+        """Return the board for one window, loading it if needed"""
+        key = (entity_type, period, start)
+        with self._lock:
+            entry = self._boards.get(key)
+            if entry is None or time.monotonic() - entry[0] > settings.LEADERBOARD_WINDOW_TTL:
+                rows = (
+                    ActivityRollup.objects.filter(entity_type=entity_type, period=period, bucket_start=start)
+                    .values('entity_key')
+                    .annotate(points=Sum('total_points'))
+                    .values_list('entity_key', 'points')
+                )
+                entry = (time.monotonic(), RankingBoard(rows))
+                self._boards[key] = entry
+                while len(self._boards) > self.max_boards:
+                    self._boards.popitem(last=False)
+            self._boards.move_to_end(key)
+            return entry[1]
+
+    def invalidate(self):
+        """Drop every cached board so they are reloaded from the rollups"""
+        with self._lock:
+            self._boards.clear()
+
+    def apply(self, deltas):
+        """Add rollup bucket deltas to the boards that are already loaded"""
+        with self._lock:
+            for (period, start, entity_type, key, _), (_, points, _) in deltas.items():
+                entry = self._boards.get((entity_type, period, start))
+                if entry is not None and (points or key not in entry[1]):
+                    entry[1].add(key, points)
+
+
+window_rankings = WindowedRankings()
@@ -0,0 +1,59 @@
+"""Resolve the copied user/team strings on activities and users to real relations.
+
+The strings stay the keys that filters, counts and rollups are read by, so a
+rename saved through the model is copied onto every row that holds them.
+"""
+from django.utils import timezone
+
+from .models import Activity, ActivityRollup, ActivityTombstone, Leaderboard, Team, User
+
+
+def link_activities(activities):
+    """Point ``activities`` at the User and Team rows named by their string fields"""
+    _link(activities, Activity.user.field, User, 'email', lambda activity: activity.user_email)
+    _link(activities, Activity.team_ref.field, Team, 'name', lambda activity: activity.team)
+
+
+def link_users(users):
+    """Point ``users`` at the Team rows named by their ``team`` field"""
+    _link(users, User.team_ref.field, Team, 'name', lambda user: user.team)
+
+
+def rename_team(old_name, new_name):
+    """Copy a team's new name onto the users, activities and rollups that hold the old one"""
+    now = timezone.now()
+    User.objects.filter(team=old_name).update(team=new_name, updated_at=now)
+    Activity.objects.filter(team=old_name).update(team=new_name, updated_at=now)
+    ActivityTombstone.objects.filter(team=old_name).update(team=new_name)
+    ActivityRollup.objects.filter(entity_type='team', entity_key=old_name).update(entity_key=new_name)
+    Leaderboard.objects.filter(entity_type='user', team=old_name).update(team=new_name, updated_at=now)
+
+
+def rename_user(old_email, email, old_name, name):
+    """Copy a user's new email and name onto their activities and rollups"""
+    now = timezone.now()
+    if old_email != email:
+        Activity.objects.filter(user_email=old_email).update(user_email=email, updated_at=now)
+        ActivityTombstone.objects.filter(user_email=old_email).update(user_email=email)
+        ActivityRollup.objects.filter(entity_type='user', entity_key=old_email).update(entity_key=email)
+    if old_name != name:
+        Activity.objects.filter(user_email=email, user_name=old_name).update(user_name=name, updated_at=now)
+
+
+def _link(objects, field, model, key, value_of):
+    """Set ``field`` on each object with one lookup for all objects that need it.
+
+    Objects whose cached relation already matches the string are left alone, so
+    re-saving an object loaded with select_related costs no extra query.
+    """
+    pending = [obj for obj in objects if not _is_linked(obj, field, key, value_of(obj))]
+    values = {value_of(obj) for obj in pending if value_of(obj)}
+    related = model.objects.in_bulk(values, field_name=key) if values else {}
+    for obj in pending:
+        setattr(obj, field.name, related.get(value_of(obj)))
+
+
+def _is_linked(obj, field, key, value):
+    if getattr(obj, field.attname) is None:
+        return not value
+    return field.is_cached(obj) and getattr(field.get_cached_value(obj), key, None) == value
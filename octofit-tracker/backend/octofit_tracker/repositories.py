@@ -0,0 +1,395 @@
+"""Hot read paths issued as native MongoDB queries instead of translated SQL.
+
+djongo serves every ORM query by rendering it to SQL, parsing that SQL back
+and translating it to a MongoDB command, which costs more CPU than the query
+itself on small keyset pages. ``Repository`` runs the activity feed and
+leaderboard pages as ``find()`` calls with a projection, and ``grouped_counts``
+runs the member and activity counts as one ``aggregate()``. Both return the
+same plain dicts as ``values()``, ready for ``LeanListSerializer``.
+
+Values are converted with the connection's own adapters and converters, so
+dates and datetimes come back exactly as the ORM returns them. On any other
+engine, or with ``NATIVE_MONGO_READS`` off, the same calls run through the ORM.
+
+Some writes have no translation at all: djongo renders an UPDATE as ``$set``
+of the query parameters, so ``F()`` arithmetic fails. ``increment`` adds to
+stored values with ``$inc`` on djongo and with ``F()`` everywhere else, and
+``increment_each`` and ``accumulate`` build on it for keyed counters.
+``update_each`` stands in for ``bulk_update``, whose ``CASE`` expressions
+djongo cannot translate either.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections, router, transaction
+from django.db.models import Case, Count, F, Value, When
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .pagination import KeysetPagination
+
+
+def read_connection(model):
+    """Return the connection the router picks for reading ``model``"""
+    return connections[router.db_for_read(model) or DEFAULT_DB_ALIAS]
+
+
+def is_native(model):
+    """Whether reads of ``model`` are issued to MongoDB directly"""
+    return settings.NATIVE_MONGO_READS and read_connection(model).vendor == 'djongo'
+
+
+def write_connection(model):
+    """Return the connection the router picks for writing ``model``"""
+    return connections[router.db_for_write(model) or DEFAULT_DB_ALIAS]
+
+
+def writes_natively(model):
+    """Whether writes of ``model`` that djongo cannot translate are issued to MongoDB directly"""
+    return write_connection(model).vendor == 'djongo'
+
+
+def _collection(connection, model):
+    connection.ensure_connection()
+    return connection.connection[model._meta.db_table]
+
+
+def _adapt(connection, field, value):
+    return field.get_db_prep_value(value, connection)
+
+
+def _converters(connection, model, fields):
+    """Return {column: (field, converters)} as the ORM applies them to values read from ``connection``"""
+    converters = {}
+    for field in fields:
+        col = field.get_col(model._meta.db_table)
+        converters[field.column] = (
+            col, connection.ops.get_db_converters(col) + field.get_db_converters(connection),
+        )
+    return converters
+
+
+def _convert(connection, converters, document):
+    row = {}
+    for column, (col, functions) in converters.items():
+        value = document.get(column)
+        for function in functions:
+            value = function(value, col, connection)
+        row[col.target.name] = value
+    return row
+
+
+def _match(connection, model, filters):
+    """Translate exact and ``__in`` lookups ({lookup: value}) to a MongoDB filter"""
+    query = {}
+    for lookup, value in filters.items():
+        name, _, operator = lookup.partition('__')
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        if operator == 'in':
+            query[field.column] = {'$in': [_adapt(connection, field, item) for item in value]}
+        else:
+            query[field.column] = _adapt(connection, field, value)
+    return query
+
+
+def _columns(connection, model, values):
+    """Return ``values`` ({field: value}) keyed by column with database values"""
+    fields = [model._meta.get_field(name) for name in values]
+    return {field.column: _adapt(connection, field, values[field.name]) for field in fields}
+
+
+def increment(model, filters, increments, values=None):
+    """Add ``increments`` ({field: amount}) to the rows matching ``filters`` and set ``values``.
+
+    The addition happens in the database, so concurrent writers never overwrite
+    each other's changes. ``filters`` takes exact and ``__in`` lookups.
+    """
+    values = values or {}
+    if not writes_natively(model):
+        model.objects.filter(**filters).update(
+            **{name: F(name) + amount for name, amount in increments.items()}, **values
+        )
+        return
+    connection = write_connection(model)
+    update = {'$inc': {model._meta.get_field(name).column: amount for name, amount in increments.items()}}
+    if values:
+        update['$set'] = _columns(connection, model, values)
+    _collection(connection, model).update_many(_match(connection, model, filters), update)
+
+
+def increment_each(model, filters, key_field, field, deltas, values=None):
+    """Add {key: amount} to ``field`` of the rows matching ``filters`` and return {key: previous value}.
+
+    The previous values are exact under concurrent writers: the rows are locked
+    before they are read on SQL engines, and each one is read and incremented
+    in a single ``find_one_and_update`` on djongo. Keys without a row are left
+    out of the result.
+    """
+    deltas = {key: amount for key, amount in deltas.items() if amount}
+    if not deltas:
+        return {}
+    values = values or {}
+    if not writes_natively(model):
+        rows = model.objects.filter(**filters, **{f'{key_field}__in': list(deltas)})
+        previous = dict(rows.select_for_update().values_list(key_field, field))
+        keys_by_delta = defaultdict(list)
+        for key, amount in deltas.items():
+            keys_by_delta[amount].append(key)
+        rows.update(**{field: F(field) + Case(
+            *(When(**{f'{key_field}__in': keys}, then=Value(amount)) for amount, keys in keys_by_delta.items()),
+            default=Value(0),
+        )}, **values)
+        return previous
+    connection = write_connection(model)
+    collection = _collection(connection, model)
+    match = _match(connection, model, filters)
+    key = model._meta.get_field(key_field)
+    column = model._meta.get_field(field).column
+    update = {'$set': _columns(connection, model, values)} if values else {}
+    previous = {}
+    for name, amount in deltas.items():
+        document = collection.find_one_and_update(
+            {**match, key.column: _adapt(connection, key, name)}, {'$inc': {column: amount}, **update},
+            projection={'_id': 0, column: 1}, return_document=ReturnDocument.BEFORE,
+        )
+        if document is not None:
+            previous[name] = document[column]
+    return previous
+
+
+def is_duplicate(error):
+    """Whether ``error`` is a unique constraint violation, which djongo raises as a plain DatabaseError"""
+    while error is not None:
+        if isinstance(error, (IntegrityError, DuplicateKeyError)):
+            return True
+        if isinstance(error, BulkWriteError):
+            return all(failure['code'] == 11000 for failure in error.details.get('writeErrors', ()))
+        error = error.__cause__
+    return False
+
+
+def existing_rows(model, fields, keys, using=None):
+    """Return {key: pk} for the rows whose ``fields`` values are one of ``keys``, with one query"""
+    candidates = model.objects.using(using).filter(**{
+        f'{field}__in': list({key[index] for key in keys}) for index, field in enumerate(fields)
+    })
+    return {tuple(key): pk for pk, *key in candidates.values_list('pk', *fields) if tuple(key) in keys}
+
+
+def accumulate(model, fields, changes, values=None):
+    """Add ``changes`` ({key: {field: amount}}) to the rows whose ``fields`` equal each key.
+
+    Missing rows are created at zero first, relying on a unique constraint over
+    ``fields``: rows another writer creates meanwhile are added to instead.
+    The rows are read in one query and all the amounts added in one write:
+    an UPDATE picking each row's amount with ``CASE`` on SQL engines, and a
+    ``bulk_write`` of ``$inc`` updates on djongo, which cannot translate ``CASE``.
+    """
+    changes = {key: amounts for key, amounts in changes.items() if any(amounts.values())}
+    if not changes:
+        return
+    values = values or {}
+    alias = router.db_for_write(model)
+    existing = existing_rows(model, fields, changes, alias)
+    if len(existing) < len(changes):
+        zeros = {name: 0 for amounts in changes.values() for name in amounts}
+
+        def create():
+            model.objects.using(alias).bulk_create([
+                model(**dict(zip(fields, key)), **zeros) for key in changes if key not in existing
+            ])
+        try:
+            with transaction.atomic(using=alias):
+                create()
+        except DatabaseError as error:
+            if not is_duplicate(error):
+                raise
+            # Another writer created some of the rows first
+            existing = existing_rows(model, fields, changes, alias)
+            create()
+        # Not every engine returns the ids of bulk-created rows
+        existing = existing_rows(model, fields, changes, alias)
+
+    if not writes_natively(model):
+        pks_by_amount = defaultdict(lambda: defaultdict(list))
+        for key, amounts in changes.items():
+            for name, amount in amounts.items():
+                if amount:
+                    pks_by_amount[name][amount].append(existing[key])
+        model.objects.using(alias).filter(pk__in=[existing[key] for key in changes]).update(**{
+            name: F(name) + Case(
+                *(When(pk__in=pks, then=Value(amount)) for amount, pks in amounts.items()), default=Value(0),
+            )
+            for name, amounts in pks_by_amount.items()
+        }, **values)
+        return
+    connection = write_connection(model)
+    update = {'$set': _columns(connection, model, values)} if values else {}
+    _collection(connection, model).bulk_write([
+        UpdateOne({model._meta.pk.column: existing[key]}, {'$inc': {
+            model._meta.get_field(name).column: amount for name, amount in amounts.items() if amount
+        }, **update})
+        for key, amounts in changes.items()
+    ], ordered=False)
+
+
+def update_each(model, objs, fields, batch_size=None):
+    """Save ``fields`` of ``objs`` with one write per ``batch_size`` rows.
+
+    ``bulk_update`` on SQL engines, and an unordered ``bulk_write`` of ``$set``
+    updates by primary key on djongo.
+    """
+    objs = list(objs)
+    if not writes_natively(model):
+        model.objects.bulk_update(objs, fields, batch_size=batch_size)
+        return
+    connection = write_connection(model)
+    collection = _collection(connection, model)
+    pk = model._meta.pk
+    batch_size = batch_size or len(objs) or 1
+    for start in range(0, len(objs), batch_size):
+        collection.bulk_write([
+            UpdateOne({pk.column: _adapt(connection, pk, obj.pk)}, {
+                '$set': _columns(connection, model, {name: getattr(obj, name) for name in fields}),
+            })
+            for obj in objs[start:start + batch_size]
+        ], ordered=False)
+
+
+def grouped_counts(model, field, values):
+    """Return {value: row count} of ``model`` rows whose ``field`` is one of ``values``"""
+    values = list(set(values))
+    if not values:
+        return {}
+    if not is_native(model):
+        counts = (
+            model.objects.filter(**{f'{field}__in': values})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+        )
+        return {row[field]: row['count'] for row in counts}
+    connection = read_connection(model)
+    column = model._meta.get_field(field).column
+    counts = _collection(connection, model).aggregate([
+        {'$match': {column: {'$in': values}}},
+        {'$group': {'_id': f'${column}', 'count': {'$sum': 1}}},
+    ])
+    return {row['_id']: row['count'] for row in counts}
+
+
+def lookup(model, field, values, columns):
+    """Return ``(*columns)`` tuples of ``model`` rows whose ``field`` is one of ``values``"""
+    values = list(set(values))
+    if not values:
+        return []
+    if not is_native(model):
+        return list(model.objects.filter(**{f'{field}__in': values}).order_by().values_list(*columns))
+    connection = read_connection(model)
+    fields = [model._meta.get_field(name) for name in columns]
+    converters = _converters(connection, model, fields)
+    documents = _collection(connection, model).find(
+        {model._meta.get_field(field).column: {'$in': values}},
+        {'_id': 0, **{column: 1 for column in converters}},
+    )
+    return [tuple(row[name] for name in columns) for row in (_convert(connection, converters, document)
+                                                            for document in documents)]
+
+
+class Repository:
+    """Keyset pages of one serializer's model as the rows its lean path renders.
+
+    ``page`` takes the ordering and cursor values of ``KeysetPagination`` and
+    returns ``values()``-style dicts: the columns ``fields`` read, including
+    both sources of ``lean_columns``, and the ordering fields. Natively, the
+    relation paths of the lean columns are read with one ``$in`` query per
+    relation.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+
+    def page(self, filters, fields, ordering, after=None, limit=100):
+        """Return up to ``limit`` rows matching ``filters`` in ``ordering``, after the ``after`` values"""
+        if not is_native(self.model):
+            queryset = self.model.objects.filter(**filters)
+            if after is not None:
+                queryset = queryset.filter(KeysetPagination._after(ordering, after))
+            required = [field.lstrip('-') for field in ordering]
+            return list(self.serializer_class.lean_values(queryset.order_by(*ordering), fields, required)[:limit])
+        return self.native_page(filters, fields, ordering, after, limit)
+
+    def columns(self, fields, ordering):
+        """Return the model fields read from each document and the relations of the lean columns"""
+        names = {'id', *(field.lstrip('-') for field in ordering)}
+        relations = {}
+        for name in fields:
+            sources = self.serializer_class.field_sources.get(name, (name,))
+            if name in self.serializer_class.lean_columns:
+                own, path = sources
+                relation, attr = path.split('__')
+                relations.setdefault(relation, set()).add(attr)
+                names.add(own)
+            else:
+                names.update(source for source in sources if '__' not in source)
+        meta = self.model._meta
+        return [meta.get_field(name) for name in sorted(names)], relations
+
+    def native_page(self, filters, fields, ordering, after, limit):
+        connection = read_connection(self.model)
+        model_fields, relations = self.columns(fields, ordering)
+        converters = _converters(connection, self.model, model_fields)
+        relation_fields = {relation: self.model._meta.get_field(relation) for relation in relations}
+        projection = {'_id': 0, **{column: 1 for column in converters}}
+        projection.update((field.column, 1) for field in relation_fields.values())
+
+        query = {self.column(name): self.adapt(connection, name, value) for name, value in filters.items()}
+        if after is not None:
+            query = {'$and': [query, self.after(connection, ordering, after)]}
+        sort = [(self.column(field.lstrip('-')), -1 if field.startswith('-') else 1) for field in ordering]
+        documents = list(_collection(connection, self.model).find(query, projection, sort=sort, limit=limit))
+
+        rows = [_convert(connection, converters, document) for document in documents]
+        for relation, field in relation_fields.items():
+            targets = self.related(field, relations[relation], [document.get(field.column) for document in documents])
+            for row, document in zip(rows, documents):
+                row[f'__{relation}'] = targets.get(document.get(field.column))
+        for name in fields:
+            if name in self.serializer_class.lean_columns:
+                _, path = self.serializer_class.field_sources[name]
+                relation, attr = path.split('__')
+                for row in rows:
+                    target = row[f'__{relation}']
+                    row[path] = target.get(attr) if target else None
+        for row in rows:
+            for relation in relations:
+                del row[f'__{relation}']
+        return rows
+
+    def related(self, field, attrs, ids):
+        """Return {id: {attr: value}} of the rows ``field`` points to"""
+        model = field.related_model
+        ids = {pk for pk in ids if pk is not None}
+        if not ids:
+            return {}
+        names = ['id', *sorted(attrs)]
+        return {values[0]: dict(zip(names, values)) for values in lookup(model, 'id', ids, names)}
+
+    def column(self, name):
+        return self.model._meta.get_field(name).column
+
+    def adapt(self, connection, name, value):
+        return _adapt(connection, self.model._meta.get_field(name), value)
+
+    def after(self, connection, ordering, values):
+        """Build ``(a, b, c) > (x, y, z)`` for the given ordering as a MongoDB filter"""
+        branches = []
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            column = self.column(name)
+            value = self.adapt(connection, name, value)
+            branches.append({**equal, column: {'$lt' if field.startswith('-') else '$gt': value}})
+            equal[column] = value
+        return {'$or': branches}
@@ -0,0 +1,127 @@
+"""Daily, weekly and monthly activity totals per user, team and activity type."""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import Activity, ActivityRollup
+from .ranking import window_rankings
+from .repositories import accumulate
+
+PERIODS = ('day', 'week', 'month')
+
+# Fields of a bucket key, in the order ``bucket_changes`` builds them
+BUCKET_FIELDS = ('period', 'bucket_start', 'entity_type', 'entity_key', 'activity_type')
+
+# Activity field holding the key of each entity type
+ENTITY_FIELDS = {'user': 'user_email', 'team': 'team'}
+
+
+def bucket_start(day, period):
+    """Return the first day of the ``period`` bucket containing ``day``"""
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    raise ValueError(f'Unknown period: {period}')
+
+
+def previous_bucket(start, period):
+    """Return the start of the bucket before the one starting at ``start``"""
+    if period == 'day':
+        return start - timedelta(days=1)
+    if period == 'week':
+        return start - timedelta(weeks=1)
+    return (start - timedelta(days=1)).replace(day=1)
+
+
+def bucket_changes(changes):
+    """Fold ``(activity, sign)`` pairs into {bucket lookup: [count, points, minutes]}"""
+    date_field = Activity._meta.get_field('date')
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for activity, sign in changes:
+        day = date_field.to_python(activity.date)
+        for entity_type, field in ENTITY_FIELDS.items():
+            key = getattr(activity, field)
+            if not key:
+                continue
+            for period in PERIODS:
+                delta = deltas[(period, bucket_start(day, period), entity_type, key, activity.activity_type)]
+                delta[0] += sign
+                delta[1] += sign * activity.points_earned
+                delta[2] += sign * activity.duration_minutes
+    return deltas
+
+
+def apply_rollup_changes(changes):
+    """Add ``(activity, sign)`` pairs to their buckets and return the bucket deltas.
+
+    The buckets of the whole batch are added to with ``accumulate``: one read,
+    one ``bulk_create`` for the buckets seen for the first time, and one write
+    of all the increments (``$inc`` on djongo, which cannot translate ``F()``).
+    """
+    deltas = bucket_changes(changes)
+    accumulate(ActivityRollup, BUCKET_FIELDS, {
+        key: {'activity_count': count, 'total_points': points, 'total_minutes': minutes}
+        for key, (count, points, minutes) in deltas.items()
+    }, {'updated_at': timezone.now()})
+    return deltas
+
+
+def rebuild_rollups(chunk_size=5000, progress=None):
+    """Recompute every bucket from the activities with one grouped query per entity type.
+
+    The database groups activities by day only; week and month buckets are
+    folded from the day rows with ``bucket_start``, since not every engine
+    can truncate dates (djongo has no ``TruncWeek`` or ``TruncMonth``).
+    """
+    progress = progress or (lambda period, entity_type, written: None)
+    date_field = Activity._meta.get_field('date')
+    ActivityRollup.objects.all().delete()
+    total = 0
+    for entity_type, field in ENTITY_FIELDS.items():
+        rows = (
+            Activity.objects.order_by()
+            .exclude(**{f'{field}__isnull': True})
+            .exclude(**{field: ''})
+            .values('date', field, 'activity_type')
+            .annotate(count=Count('id'), points=Sum('points_earned'), minutes=Sum('duration_minutes'))
+        )
+        folded = {period: defaultdict(lambda: [0, 0, 0]) for period in PERIODS if period != 'day'}
+
+        def days():
+            for row in rows.iterator(chunk_size=chunk_size):
+                day = date_field.to_python(row['date'])
+                totals = (row['count'], row['points'], row['minutes'])
+                for period, buckets in folded.items():
+                    bucket = buckets[(bucket_start(day, period), row[field], row['activity_type'])]
+                    for index, value in enumerate(totals):
+                        bucket[index] += value
+                yield (day, row[field], row['activity_type']), totals
+
+        # The day rows are written first, which fills the week and month buckets
+        total = _write_buckets('day', entity_type, days(), chunk_size, total, progress)
+        for period, buckets in folded.items():
+            total = _write_buckets(period, entity_type, buckets.items(), chunk_size, total, progress)
+    window_rankings.invalidate()
+    return total
+
+
+def _write_buckets(period, entity_type, buckets, chunk_size, total, progress):
+    """Insert ``((bucket_start, entity_key, activity_type), totals)`` pairs in chunks and return the new total"""
+    batch = []
+    for (start, key, activity_type), (count, points, minutes) in buckets:
+        batch.append(ActivityRollup(
+            period=period, bucket_start=start, entity_type=entity_type, entity_key=key,
+            activity_type=activity_type, activity_count=count, total_points=points, total_minutes=minutes,
+        ))
+        if len(batch) >= chunk_size:
+            total += len(ActivityRollup.objects.bulk_create(batch))
+            batch = []
+            progress(period, entity_type, total)
+    total += len(ActivityRollup.objects.bulk_create(batch))
+    progress(period, entity_type, total)
+    return total
@@ -0,0 +1,76 @@
+"""Database routing of read-only API requests to the read alias.
+
+Read-only viewset actions run inside ``replica_reads()``, and while it is
+active ``ReadReplicaRouter`` sends every read to ``READ_DATABASE_ALIAS``.
+Writes always go to the default database. A client that has just written is
+pinned to the default database for ``READ_YOUR_WRITES_SECONDS`` by a cookie,
+so it does not read a replica that has not caught up with its own write.
+Code that must see the latest writes whoever the client is, such as filling a
+shared cache, reads inside ``primary_reads()``.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'octofit_primary_until'
+
+_replica_reads = ContextVar('octofit_replica_reads', default=False)
+
+
+def read_alias():
+    """The database alias serving read-only actions, or the default one if it is not configured"""
+    alias = settings.READ_DATABASE_ALIAS
+    return alias if alias in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    """Route the reads made in this context, including in coroutines it awaits, to the read alias"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Route the reads made in this context to the default database, even inside ``replica_reads()``"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pinned_to_primary(request):
+    """Whether ``request`` comes from a client that wrote within ``READ_YOUR_WRITES_SECONDS``"""
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_to_primary(response):
+    """Pin the client of ``response`` to the default database after a write, if stickiness is on"""
+    seconds = settings.READ_YOUR_WRITES_SECONDS
+    if seconds > 0:
+        response.set_cookie(PIN_COOKIE, f'{time.time() + seconds:.3f}', max_age=seconds, samesite='Lax')
+    return response
+
+
+class ReadReplicaRouter:
+    """Sends reads to the read alias inside ``replica_reads()`` and every write to the default database."""
+
+    def db_for_read(self, model, **hints):
+        return read_alias() if _replica_reads.get() else None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the default database
+        return True
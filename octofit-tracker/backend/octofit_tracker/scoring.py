@@ -0,0 +1,73 @@
+"""Side effects of Activity writes on point totals, rankings and rollups."""
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching
+from .models import Team, User
+from .ranking import leaderboard_engine, window_rankings
+from .repositories import increment
+from .rollups import apply_rollup_changes
+
+_state = threading.local()
+
+
+@contextmanager
+def suspended():
+    """Skip scoring side effects, e.g. while seeding data with precomputed totals"""
+    previous = is_suspended()
+    _state.suspended = True
+    try:
+        yield
+    finally:
+        _state.suspended = previous
+
+
+def is_suspended():
+    return getattr(_state, 'suspended', False)
+
+
+def increment_totals(model, key_field, deltas):
+    """Add ``deltas`` ({key: points}) to ``model.total_points`` in the database.
+
+    Each update adds to the stored value server-side (``F()``, or ``$inc`` on
+    djongo), so concurrent writers never overwrite each other, and keys sharing
+    a delta are updated together.
+    """
+    keys_by_delta = defaultdict(list)
+    for key, delta in deltas.items():
+        if key and delta:
+            keys_by_delta[delta].append(key)
+    now = timezone.now()
+    with transaction.atomic():
+        for delta, keys in keys_by_delta.items():
+            increment(model, {f'{key_field}__in': keys}, {'total_points': delta}, {'updated_at': now})
+
+
+def apply_activity_changes(changes):
+    """Apply ``(activity, sign)`` pairs to the leaderboard and rollups in one pass.
+
+    ``sign`` is 1 for an activity being added and -1 for one being removed, so an
+    update is the previous version with -1 followed by the new one with 1.
+    """
+    if is_suspended():
+        return
+    user_deltas = Counter()
+    email_deltas = Counter()
+    team_deltas = Counter()
+    user_teams = {}
+    for activity, sign in changes:
+        user_deltas[activity.user_name] += sign * activity.points_earned
+        email_deltas[activity.user_email] += sign * activity.points_earned
+        user_teams[activity.user_name] = activity.team
+        if activity.team:
+            team_deltas[activity.team] += sign * activity.points_earned
+    increment_totals(User, 'email', email_deltas)
+    increment_totals(Team, 'name', team_deltas)
+    leaderboard_engine.apply('user', user_deltas, teams=user_teams)
+    leaderboard_engine.apply('team', team_deltas)
+    window_rankings.apply(apply_rollup_changes(changes))
+    caching.invalidate('leaderboard')
@@ -0,0 +1,152 @@
+"""Inverted index for ranked prefix search over users, workouts and activity notes.
+
+Every indexed document is stored as one ``SearchTerm`` row per distinct token,
+weighted by the fields it occurs in. A query matches documents holding every
+query token, the last ones as prefixes so the index also serves autocomplete,
+and ranks them by the summed weights with a boost for whole-word matches. The
+rows are kept current from the model signals and bulk write paths;
+``rebuild_search_index`` recreates them from scratch.
+"""
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Activity, SearchTerm, User, Workout
+
+# Document type: model and the weight of a token found in each indexed field
+DOCUMENTS = {
+    'user': (User, {'name': 4, 'email': 2}),
+    'workout': (Workout, {'name': 4, 'category': 2, 'description': 1}),
+    'activity': (Activity, {'notes': 1}),
+}
+
+TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+EXACT_MATCH_BOOST = 2
+
+_token = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """Lowercase ``text``, strip accents and split it into alphanumeric tokens"""
+    if not text:
+        return []
+    folded = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii').lower()
+    return [token[:TERM_LENGTH] for token in _token.findall(folded)]
+
+
+def document_terms(values, weights):
+    """Return {term: weight} for one document given its field ``values``"""
+    terms = Counter()
+    for field, weight in weights.items():
+        for token in tokenize(values.get(field)):
+            terms[token] += weight
+    return terms
+
+
+def _rows(doc_type, values_list):
+    weights = DOCUMENTS[doc_type][1]
+    return [
+        SearchTerm(term=term, doc_type=doc_type, doc_id=values['id'], weight=weight)
+        for values in values_list
+        for term, weight in document_terms(values, weights).items()
+    ]
+
+
+def index_documents(doc_type, objects, replace=True):
+    """(Re)index ``objects`` of ``doc_type``; ``replace=False`` skips the delete for new objects"""
+    fields = DOCUMENTS[doc_type][1]
+    rows = _rows(doc_type, [
+        {'id': obj.pk, **{field: getattr(obj, field) for field in fields}} for obj in objects
+    ])
+    with transaction.atomic():
+        if replace:
+            remove_documents(doc_type, [obj.pk for obj in objects])
+        SearchTerm.objects.bulk_create(rows, batch_size=1000)
+
+
+def remove_documents(doc_type, ids):
+    SearchTerm.objects.filter(doc_type=doc_type, doc_id__in=list(ids)).delete()
+
+
+def indexed_fields_changed(doc_type, previous, current):
+    """Whether saving ``current`` over ``previous`` changes what is indexed"""
+    return previous is None or any(
+        getattr(previous, field) != getattr(current, field) for field in DOCUMENTS[doc_type][1]
+    )
+
+
+def rebuild_search_index(chunk_size=5000, progress=None):
+    """Reindex every document, reading and writing ``chunk_size`` rows at a time"""
+    progress = progress or (lambda doc_type, written: None)
+    SearchTerm.objects.all().delete()
+    total = 0
+    for doc_type, (model, weights) in DOCUMENTS.items():
+        documents = model.objects.order_by()
+        if doc_type == 'activity':
+            documents = documents.exclude(notes__isnull=True).exclude(notes='')
+        batch = []
+        for values in documents.values('id', *weights).iterator(chunk_size=chunk_size):
+            batch.append(values)
+            if len(batch) >= chunk_size:
+                total += len(SearchTerm.objects.bulk_create(_rows(doc_type, batch)))
+                batch = []
+                progress(doc_type, total)
+        total += len(SearchTerm.objects.bulk_create(_rows(doc_type, batch)))
+        progress(doc_type, total)
+    return total
+
+
+def _term_matches(token, doc_types):
+    exact = len(token) < settings.SEARCH_MIN_PREFIX
+    lookup = {'term': token} if exact else {'term__startswith': token}
+    return SearchTerm.objects.filter(doc_type__in=doc_types, **lookup)
+
+
+def _within(matches, keys):
+    """Narrow ``matches`` to the ``(doc_type, doc_id)`` documents in ``keys``"""
+    ids_by_type = defaultdict(list)
+    for doc_type, doc_id in keys:
+        ids_by_type[doc_type].append(doc_id)
+    condition = Q()
+    for doc_type, ids in ids_by_type.items():
+        condition |= Q(doc_type=doc_type, doc_id__in=ids)
+    return matches.filter(condition)
+
+
+def search(query, doc_types=None):
+    """Return ``[(doc_type, doc_id, score)]`` for documents matching every token of ``query``, best first.
+
+    Tokens shorter than ``SEARCH_MIN_PREFIX`` only match whole words, so a
+    one-letter query does not scan half the index. Tokens are read rarest
+    first: the first reads at most ``SEARCH_MAX_MATCHES`` index rows, the
+    heaviest first, and each later one only the rows of documents still in
+    the running, so a common token cannot crowd out a rarer token's documents.
+    """
+    tokens = list(dict.fromkeys(tokenize(query)))
+    doc_types = list(doc_types or DOCUMENTS)
+    if not tokens:
+        return []
+    matches = {token: _term_matches(token, doc_types) for token in tokens}
+    scores = None
+    for token in sorted(tokens, key=lambda token: matches[token].count()):
+        rows = matches[token].order_by('-weight').values_list('doc_type', 'doc_id', 'term', 'weight')
+        rows = rows[:settings.SEARCH_MAX_MATCHES] if scores is None else _within(rows, scores)
+        token_scores = defaultdict(int)
+        for doc_type, doc_id, term, weight in rows:
+            score = weight * EXACT_MATCH_BOOST if term == token else weight
+            key = (doc_type, doc_id)
+            token_scores[key] = max(token_scores[key], score)
+        if scores is None:
+            scores = token_scores
+        else:
+            scores = {key: score + token_scores[key] for key, score in scores.items() if key in token_scores}
+        if not scores:
+            return []
+    return sorted(
+        ((doc_type, doc_id, score) for (doc_type, doc_id), score in scores.items()),
+        key=lambda hit: (-hit[2], hit[0], hit[1]),
+    )
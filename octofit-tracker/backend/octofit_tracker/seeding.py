@@ -0,0 +1,235 @@
+"""Synthetic OctoFit data for benchmarks and load tests."""
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import django
+from django.apps import apps
+from django.db import connection, connections
+
+from . import caching
+from .models import (
+    Activity, ActivityRollup, ActivityTombstone, Leaderboard, LeaderboardScoreNode, SearchTerm, Team, User, Workout,
+)
+from .ranking import leaderboard_engine
+from .repositories import update_each
+from .rollups import rebuild_rollups
+from .search import rebuild_search_index
+
+# (activity type, points per minute)
+ACTIVITY_TYPES = (
+    ('Running', 1.0),
+    ('Cycling', 0.8),
+    ('Swimming', 1.1),
+    ('Strength Training', 0.9),
+    ('Yoga', 0.5),
+    ('Combat Training', 1.0),
+    ('Walking', 0.4),
+    ('Rowing', 0.9),
+)
+
+
+# Models in the order their tables can be dropped; they are recreated in reverse
+SEEDED_MODELS = (
+    SearchTerm, ActivityRollup, ActivityTombstone, Activity, LeaderboardScoreNode, Leaderboard, User, Team, Workout,
+)
+
+WORKOUT_TEMPLATES = (
+    ('Super Soldier Serum Training', 'strength', 'advanced', 90),
+    ('Speedster Sprint Challenge', 'cardio', 'intermediate', 45),
+    ('Amazonian Warrior Workout', 'strength', 'advanced', 75),
+    ('Web-Slinger Flexibility', 'flexibility', 'beginner', 30),
+    ('Aquatic Endurance', 'cardio', 'intermediate', 60),
+    ('Spy Agility Training', 'flexibility', 'intermediate', 50),
+)
+
+
+def team_name(number):
+    return f'Team {number:03d}'
+
+
+def user_email(number):
+    return f'athlete{number}@octofit.test'
+
+
+def user_name(number):
+    return f'Athlete {number}'
+
+
+def synthetic_teams(count):
+    return [Team(name=team_name(number), description=f'Synthetic team {number}') for number in range(count)]
+
+
+def synthetic_users(start, count, teams):
+    """Return users ``start``..``start + count - 1`` spread round-robin over ``teams`` teams"""
+    return [
+        User(email=user_email(number), name=user_name(number), team=team_name(number % teams))
+        for number in range(start, start + count)
+    ]
+
+
+def synthetic_activities(start, count, users, teams, seed=0, days=365, today=None):
+    """Return ``count`` activities for the chunk beginning at ``start``.
+
+    Every chunk has its own random stream derived from ``seed`` and ``start``, so
+    chunks can be generated independently and the dataset is reproducible.
+    Users are skewed so that a small share of athletes log most activities.
+    """
+    rng = random.Random(f'{seed}:{start}')
+    today = today or date.today()
+    activities = []
+    for _ in range(count):
+        number = int(users * rng.random() ** 2)
+        activity_type, rate = ACTIVITY_TYPES[rng.randrange(len(ACTIVITY_TYPES))]
+        duration = rng.randint(15, 120)
+        activities.append(Activity(
+            user_email=user_email(number),
+            user_name=user_name(number),
+            team=team_name(number % teams),
+            activity_type=activity_type,
+            duration_minutes=duration,
+            points_earned=round(duration * rate),
+            date=today - timedelta(days=min(int(rng.expovariate(1 / 60)), days - 1)),
+        ))
+    return activities
+
+
+def insert_in_chunks(model, objects, chunk_size=5000):
+    """bulk_create ``objects`` in chunks and return the number of rows written"""
+    written = 0
+    for offset in range(0, len(objects), chunk_size):
+        written += len(model.objects.bulk_create(objects[offset:offset + chunk_size]))
+    return written
+
+
+def synthetic_workouts(count):
+    workouts = []
+    for number in range(count):
+        name, category, difficulty, minutes = WORKOUT_TEMPLATES[number % len(WORKOUT_TEMPLATES)]
+        workouts.append(Workout(
+            name=f'{name} #{number}',
+            description=f'{name} ({category}, {difficulty})',
+            difficulty_level=difficulty,
+            estimated_duration_minutes=minutes,
+            points_value=minutes,
+            category=category,
+            equipment_needed='Yoga mat',
+        ))
+    return workouts
+
+
+def reset_tables(models=SEEDED_MODELS):
+    """Drop and recreate the tables of ``models`` instead of deleting row by row"""
+    with connection.schema_editor() as editor:
+        for model in models:
+            editor.delete_model(model)
+        for model in reversed(models):
+            editor.create_model(model)
+
+
+def seed_dataset(users, teams, activities, seed=0, workouts=50, chunk_size=10_000, workers=1, progress=None):
+    """Write a synthetic dataset with consistent totals, ranks and relations.
+
+    Activities are generated and inserted one chunk at a time, so memory use
+    does not grow with ``activities``. With ``workers`` > 1 the chunks are
+    generated and written by a process pool, each worker on its own database
+    connection. SQLite allows a single writer, so there the chunks are always
+    written in-process. ``progress`` is called with ``(model, rows_written)``.
+    """
+    progress = progress or (lambda model, written: None)
+    insert_in_chunks(Team, synthetic_teams(teams), chunk_size)
+    team_ids = dict(Team.objects.values_list('name', 'id'))
+    user_rows = synthetic_users(0, users, teams)
+    for user in user_rows:
+        user.team_ref_id = team_ids[user.team]
+    insert_in_chunks(User, user_rows, chunk_size)
+    user_ids = dict(User.objects.values_list('email', 'id'))
+    progress(User, users)
+
+    context = {
+        'users': users, 'teams': teams, 'seed': seed, 'today': date.today(),
+        'user_ids': user_ids, 'team_ids': team_ids,
+    }
+    jobs = [(start, min(chunk_size, activities - start)) for start in range(0, activities, chunk_size)]
+    user_points = Counter()
+    written = 0
+    if workers > 1 and len(jobs) > 1 and connection.vendor != 'sqlite':
+        # Children must not share the parent's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(context,)) as pool:
+            for count, points in pool.map(_write_activity_chunk, jobs):
+                written += count
+                user_points.update(points)
+                progress(Activity, written)
+    else:
+        _init_worker(context)
+        for job in jobs:
+            count, points = _write_activity_chunk(job)
+            written += count
+            user_points.update(points)
+            progress(Activity, written)
+
+    write_totals(user_points, chunk_size)
+    progress(ActivityRollup, rebuild_rollups(chunk_size))
+    insert_in_chunks(Workout, synthetic_workouts(workouts), chunk_size)
+    progress(SearchTerm, rebuild_search_index(chunk_size))
+    # Bulk writes skip the model signals, so drop anything derived from the old data
+    leaderboard_engine.invalidate()
+    caching.invalidate('leaderboard', 'workouts')
+
+
+_worker_context = {}
+
+
+def _init_worker(context):
+    if not apps.ready:
+        django.setup()
+    _worker_context.update(context)
+
+
+def _write_activity_chunk(job):
+    """Generate and insert one chunk, returning its row count and points per user"""
+    start, count = job
+    context = _worker_context
+    chunk = synthetic_activities(
+        start, count, context['users'], context['teams'], seed=context['seed'], today=context['today']
+    )
+    points = Counter()
+    for activity in chunk:
+        activity.user_id = context['user_ids'][activity.user_email]
+        activity.team_ref_id = context['team_ids'][activity.team]
+        points[activity.user_email] += activity.points_earned
+    Activity.objects.bulk_create(chunk)
+    return len(chunk), points
+
+
+def write_totals(user_points, chunk_size=10_000):
+    """Store user and team totals and enter them into the (empty) Leaderboard table and its score tree"""
+    user_rows = list(User.objects.only('id', 'email', 'name', 'team'))
+    team_points = Counter()
+    team_members = Counter()
+    for user in user_rows:
+        user.total_points = user_points.get(user.email, 0)
+        team_points[user.team] += user.total_points
+        team_members[user.team] += 1
+    update_each(User, user_rows, ['total_points'], batch_size=chunk_size)
+    team_rows = list(Team.objects.only('id', 'name'))
+    for team in team_rows:
+        team.total_points = team_points[team.name]
+        team.member_count = team_members[team.name]
+    update_each(Team, team_rows, ['total_points', 'member_count'], batch_size=chunk_size)
+
+    # Users sharing a name share an entry
+    user_entries = {}
+    for user in user_rows:
+        entry = user_entries.setdefault(user.name, Leaderboard(
+            entity_type='user', entity_name=user.name, total_points=0, team=user.team
+        ))
+        entry.total_points += user.total_points
+    entries = list(user_entries.values()) + [
+        Leaderboard(entity_type='team', entity_name=team.name, total_points=team.total_points)
+        for team in team_rows
+    ]
+    insert_in_chunks(Leaderboard, entries, chunk_size)
+    leaderboard_engine.rebuild()
@@ -1,54 +1,301 @@
+from collections import Counter, OrderedDict
+from functools import cached_property
+
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from .models import User, Team, Activity, Leaderboard, Workout
+from .ranking import leaderboard_engine
+from .repositories import grouped_counts, lookup
+
+
+def count_members_by_team(names):
+    """Return {team name: member count} using one grouped count"""
+    return grouped_counts(User, 'team', names)
+
+
+def count_activities_by_user_name(names):
+    """Return {user name: activity count} using one lookup and one grouped count.
+
+    Users sharing a name share a leaderboard entry, so their counts are summed.
+    """
+    emails = {email: name for name, email in lookup(User, 'name', names, ('name', 'email'))}
+    if not emails:
+        return {}
+    totals = Counter()
+    for email, count in grouped_counts(Activity, 'user_email', emails).items():
+        totals[emails[email]] += count
+    return dict(totals)
+
+
+class SparseFieldsMixin:
+    """Narrows a model serializer to the ``fields`` in its context and serves lean rows.
+
+    ``field_sources`` lists the model fields an output field reads when they are
+    not just its own name, so views can load only those columns. ``lean_columns``
+    names the fields whose sources are ``(own column, relation path)``: the lean
+    path loads both and uses the relation's value when it is set, in Python
+    since djongo cannot translate ``Coalesce``. ``lean_fill`` computes the
+    method fields of a page of rows.
+    """
+    field_sources = {}
+    lean_columns = ()
+    computed_fields = ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context.get('fields')
+        if requested:
+            fields = OrderedDict((name, field) for name, field in fields.items() if name in requested)
+        return fields
+
+    @classmethod
+    def sources(cls, fields):
+        """Return the model field paths needed to render ``fields``"""
+        paths = set()
+        for name in fields:
+            paths.update(cls.field_sources.get(name, (name,)))
+        return paths
+
+    @classmethod
+    def narrow_queryset(cls, queryset, fields, required=()):
+        """Load only the columns and relations that ``fields`` and ``required`` need"""
+        paths = cls.sources(fields) | {'id', *required}
+        relations = sorted({path.split('__')[0] for path in paths if '__' in path})
+        queryset = queryset.select_related(None)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset.only(*paths)
+
+    @classmethod
+    def lean_values(cls, queryset, fields, required=()):
+        """Return ``queryset`` as ``values()`` dicts with the columns the lean path needs"""
+        columns = {'id', *required}
+        for name in fields:
+            sources = cls.field_sources.get(name, (name,))
+            if name not in cls.lean_columns:
+                sources = [source for source in sources if '__' not in source]
+            columns.update(sources)
+        return queryset.select_related(None).values(*columns)
+
+    @classmethod
+    def lean_fill(cls, rows, fields):
+        """Add the values of computed ``fields`` to ``rows`` in place"""
+
+
+class LeanListSerializer:
+    """Read-only list output rendered straight from ``values()`` dicts.
+
+    Column converters are resolved once per list instead of walking the DRF
+    field objects for every row; the output matches the model serializer's.
+    """
+
+    def __init__(self, serializer_class, rows, fields=None, context=None):
+        self.serializer_class = serializer_class
+        self.rows = list(rows)
+        self.fields = fields or list(serializer_class.Meta.fields)
+        self.context = context or {}
+
+    def converters(self):
+        """Return ``(name, key, fallback, convert)`` per output field.
+
+        ``fallback`` is the row's own column for lean columns, read when the
+        relation's ``key`` is None, and ``convert`` is None for passthrough.
+        """
+        fields = self.serializer_class(context=self.context).fields
+        converters = []
+        for name in self.fields:
+            if name in self.serializer_class.computed_fields:
+                continue
+            field = fields[name]
+            key, fallback = name, None
+            if name in self.serializer_class.lean_columns:
+                fallback, key = self.serializer_class.field_sources[name]
+            if isinstance(field, (serializers.CharField, serializers.IntegerField, serializers.BooleanField)):
+                convert = None
+            elif isinstance(field, serializers.DateField) and getattr(
+                field, 'format', api_settings.DATE_FORMAT
+            ).lower() == 'iso-8601':
+                convert = _isoformat
+            else:
+                convert = field.to_representation
+            converters.append((name, key, fallback, convert))
+        return converters
 
+    @cached_property
+    def data(self):
+        rows = self.rows
+        self.serializer_class.lean_fill(rows, self.fields)
+        converters = self.converters()
+        computed = [name for name in self.fields if name in self.serializer_class.computed_fields]
+        data = []
+        for row in rows:
+            item = {}
+            for name, key, fallback, convert in converters:
+                value = row[key]
+                if value is None and fallback is not None:
+                    value = row[fallback]
+                item[name] = value if convert is None or value is None else convert(value)
+            for name in computed:
+                item[name] = row[name]
+            data.append(item)
+        return data
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    field_sources = {'team': ('team', 'team_ref__name')}
+    lean_columns = ('team',)
 
-class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'name', 'team', 'total_points', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def to_representation(self, instance):
+        """Report the current team name through the relation when it is linked"""
+        data = super().to_representation(instance)
+        if 'team' in data and instance.team_ref_id:
+            data['team'] = instance.team_ref.name
+        return data
+
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamListSerializer(serializers.ListSerializer):
+    """Counts members for every team in one grouped query instead of one per team"""
+
+    def to_representation(self, data):
+        teams = list(data.all() if isinstance(data, BaseManager) else data)
+        if 'member_count' in self.child.fields:
+            self.context['member_counts'] = count_members_by_team(team.name for team in teams)
+        return super().to_representation(teams)
+
+
+class TeamSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     member_count = serializers.SerializerMethodField()
+    field_sources = {'member_count': ('name',)}
+    computed_fields = ('member_count',)
     
     class Meta:
         model = Team
         fields = ['id', 'name', 'description', 'total_points', 'member_count', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = TeamListSerializer
     
     def get_member_count(self, obj):
         """Dynamically calculate member count from User model"""
-        return User.objects.filter(team=obj.name).count()
+        counts = self.context.get('member_counts')
+        if counts is None:
+            counts = count_members_by_team([obj.name])
+        return counts.get(obj.name, 0)
+
+    @classmethod
+    def lean_fill(cls, rows, fields):
+        if 'member_count' in fields:
+            counts = count_members_by_team(row['name'] for row in rows)
+            for row in rows:
+                row['member_count'] = counts.get(row['name'], 0)
+
 
+class ActivitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    field_sources = {
+        'user_email': ('user_email', 'user__email'),
+        'user_name': ('user_name', 'user__name'),
+        'team': ('team', 'team_ref__name'),
+    }
+    lean_columns = ('user_email', 'user_name', 'team')
 
-class ActivitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Activity
         fields = ['id', 'user_email', 'user_name', 'team', 'activity_type', 'duration_minutes', 
-                  'points_earned', 'date', 'notes', 'created_at']
-        read_only_fields = ['id', 'created_at']
+                  'points_earned', 'date', 'notes', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def to_representation(self, instance):
+        """Report current user and team names through the relations when they are linked"""
+        data = super().to_representation(instance)
+        if ('user_email' in data or 'user_name' in data) and instance.user_id:
+            data.update(
+                (field, getattr(instance.user, attr))
+                for field, attr in (('user_email', 'email'), ('user_name', 'name'))
+                if field in data
+            )
+        if 'team' in data and instance.team_ref_id:
+            data['team'] = instance.team_ref.name
+        return data
+
+
+def rank_entries(entries):
+    """Return {(entity_type, entity_name): rank} for leaderboard instances or ``values()`` rows"""
+    return leaderboard_engine.ranks(
+        (entry['entity_type'], entry['entity_name'], entry['total_points']) if isinstance(entry, dict)
+        else (entry.entity_type, entry.entity_name, entry.total_points)
+        for entry in entries
+    )
+
 
+class LeaderboardListSerializer(serializers.ListSerializer):
+    """Counts activities and ranks for a whole page of entries at once instead of per row"""
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+    def to_representation(self, data):
+        entries = list(data.all() if isinstance(data, BaseManager) else data)
+        if 'rank' in self.child.fields:
+            self.context['ranks'] = rank_entries(entries)
+        if 'activities_count' in self.child.fields:
+            self.context['activities_counts'] = count_activities_by_user_name(
+                entry.entity_name for entry in entries if entry.entity_type == 'user'
+            )
+        return super().to_representation(entries)
+
+
+class LeaderboardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    rank = serializers.SerializerMethodField()
     activities_count = serializers.SerializerMethodField()
+    field_sources = {
+        'rank': ('entity_type', 'entity_name', 'total_points'),
+        'activities_count': ('entity_type', 'entity_name'),
+    }
+    computed_fields = ('rank', 'activities_count')
     
     class Meta:
         model = Leaderboard
         fields = ['id', 'entity_type', 'entity_name', 'total_points', 'rank', 'team', 'activities_count', 'updated_at']
         read_only_fields = ['id', 'updated_at']
+        list_serializer_class = LeaderboardListSerializer
     
+    def get_rank(self, obj):
+        """Get the rank counted from the entry's total (see ``ranking.LeaderboardEngine.ranks``)"""
+        ranks = self.context.get('ranks')
+        if ranks is None or (obj.entity_type, obj.entity_name) not in ranks:
+            ranks = rank_entries([obj])
+        return ranks[(obj.entity_type, obj.entity_name)]
+
     def get_activities_count(self, obj):
         """Get the count of activities for this user"""
-        if obj.entity_type == 'user':
-            # Find user by name and get their activity count
-            user = User.objects.filter(name=obj.entity_name).first()
-            if user:
-                return Activity.objects.filter(user_email=user.email).count()
-        return 0
+        if obj.entity_type != 'user':
+            return 0
+        counts = self.context.get('activities_counts')
+        if counts is None:
+            counts = count_activities_by_user_name([obj.entity_name])
+        return counts.get(obj.entity_name, 0)
+
+    @classmethod
+    def lean_fill(cls, rows, fields):
+        if 'rank' in fields:
+            ranks = rank_entries(rows)
+            for row in rows:
+                row['rank'] = ranks[(row['entity_type'], row['entity_name'])]
+        if 'activities_count' in fields:
+            counts = count_activities_by_user_name(
+                row['entity_name'] for row in rows if row['entity_type'] == 'user'
+            )
+            for row in rows:
+                row['activities_count'] = counts.get(row['entity_name'], 0) if row['entity_type'] == 'user' else 0
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['id', 'name', 'description', 'difficulty_level', 'estimated_duration_minutes', 
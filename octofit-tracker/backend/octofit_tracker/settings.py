@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -35,6 +38,9 @@ if CODESPACE_NAME:
 
 # Application definition
 
+# Storage engine: 'mongo' (djongo), 'postgresql' or 'sqlite'; see Database below
+DB_ENGINE = os.getenv('OCTOFIT_DB_ENGINE', 'mongo')
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -44,11 +50,12 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'corsheaders',
-    'djongo',
+    *(['djongo'] if DB_ENGINE == 'mongo' else []),
     'octofit_tracker',
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -83,16 +90,165 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'djongo',
-        'NAME': 'octofit_db',
-        'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+# OCTOFIT_DB_ENGINE picks the storage engine. Models, migrations and the API
+# behave the same on each; only connection settings differ.
+#
+# mongo: the octofit_tracker.mongo engine is djongo with one pooled MongoClient
+# per alias shared across threads. Pool options are pymongo's; an empty timeout
+# or idle time means no limit. The 'reads' alias serves the read-only API
+# actions with its own pool and read preference (secondaryPreferred by default).
+#
+# postgresql: OCTOFIT_DB_NAME/USER/PASSWORD/HOST/PORT, with connections kept
+# for OCTOFIT_DB_CONN_MAX_AGE seconds. Setting OCTOFIT_DB_READ_HOST adds a
+# 'reads' alias on that host, e.g. a streaming replica.
+#
+# sqlite: a single file at OCTOFIT_DB_NAME (db.sqlite3 next to manage.py).
+#
+# Tests: mongo is the default, so plain settings need a reachable MongoDB
+# server; without one the suite fails with ServerSelectionTimeoutError. Run
+# `OCTOFIT_DB_ENGINE=sqlite python manage.py test` instead. There,
+# DjongoTranslationTest still checks that the SQL of the write and export
+# paths translates on djongo.
+
+if DB_ENGINE == 'mongo':
+    MONGO_CLIENT = {
+        'host': os.getenv('OCTOFIT_MONGO_HOST', 'localhost'),
+        'port': int(os.getenv('OCTOFIT_MONGO_PORT', '27017')),
+        'maxPoolSize': int(os.getenv('OCTOFIT_MONGO_MAX_POOL_SIZE', '100')),
+        'minPoolSize': int(os.getenv('OCTOFIT_MONGO_MIN_POOL_SIZE', '0')),
+        'maxIdleTimeMS': int(os.getenv('OCTOFIT_MONGO_MAX_IDLE_TIME_MS', '') or 0) or None,
+        'waitQueueTimeoutMS': int(os.getenv('OCTOFIT_MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000') or 0) or None,
+        'serverSelectionTimeoutMS': int(os.getenv('OCTOFIT_MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        'connectTimeoutMS': int(os.getenv('OCTOFIT_MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    }
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'octofit_tracker.mongo',
+            'NAME': os.getenv('OCTOFIT_DB_NAME', 'octofit_db'),
+            'CLIENT': MONGO_CLIENT,
+        },
+        'reads': {
+            'ENGINE': 'octofit_tracker.mongo',
+            'NAME': os.getenv('OCTOFIT_DB_NAME', 'octofit_db'),
+            'CLIENT': {
+                **MONGO_CLIENT, 'readPreference': os.getenv('OCTOFIT_MONGO_READ_PREFERENCE', 'secondaryPreferred'),
+            },
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+elif DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('OCTOFIT_DB_NAME', 'octofit_db'),
+            'USER': os.getenv('OCTOFIT_DB_USER', 'octofit'),
+            'PASSWORD': os.getenv('OCTOFIT_DB_PASSWORD', ''),
+            'HOST': os.getenv('OCTOFIT_DB_HOST', 'localhost'),
+            'PORT': os.getenv('OCTOFIT_DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('OCTOFIT_DB_CONN_MAX_AGE', '60')),
+        },
+    }
+    if os.getenv('OCTOFIT_DB_READ_HOST'):
+        DATABASES['reads'] = {
+            **DATABASES['default'],
+            'HOST': os.getenv('OCTOFIT_DB_READ_HOST'),
+            'TEST': {'MIRROR': 'default'},
         }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('OCTOFIT_DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': {
+                'timeout': 30,
+            },
+        },
     }
+else:
+    raise ImproperlyConfigured(f"OCTOFIT_DB_ENGINE must be 'mongo', 'postgresql' or 'sqlite', not {DB_ENGINE!r}")
+
+# Reads of GET API actions go to READ_DATABASE_ALIAS when it is configured;
+# for READ_YOUR_WRITES_SECONDS after a write a client reads the default
+# database instead (0 turns this off)
+DATABASE_ROUTERS = ['octofit_tracker.routers.ReadReplicaRouter']
+READ_DATABASE_ALIAS = 'reads'
+READ_YOUR_WRITES_SECONDS = float(os.getenv('OCTOFIT_READ_YOUR_WRITES_SECONDS', '5'))
+# How far the read alias may lag behind: cached responses filled within this
+# many seconds of an invalidation read the default database (see caching.py)
+REPLICA_LAG_SECONDS = float(os.getenv('OCTOFIT_REPLICA_LAG_SECONDS', '5'))
+
+# On the Mongo engine the activity feed, leaderboard pages and member/activity
+# counts are read with native find() and aggregate() calls instead of through
+# djongo's SQL translation (see repositories.py); 0 reads them through the ORM
+NATIVE_MONGO_READS = os.getenv('OCTOFIT_NATIVE_MONGO_READS', '1') == '1'
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# OCTOFIT_CACHE_BACKEND is 'locmem', 'file', 'redis', 'dummy' or a dotted backend
+# path. The local memory cache is per process, so it is only correct with a
+# single worker: an invalidation never reaches the other workers, which keep
+# serving stale responses (check --deploy warns about it). Use 'file' to share
+# entries and their invalidation between workers on one host, 'redis' (with
+# OCTOFIT_CACHE_LOCATION=redis://...) across hosts, or 'dummy' to turn it off.
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
 }
+CACHE_BACKEND = os.getenv('OCTOFIT_CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS.get(CACHE_BACKEND, CACHE_BACKEND),
+        'LOCATION': os.getenv(
+            'OCTOFIT_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'octofit_cache') if CACHE_BACKEND == 'file' else 'octofit',
+        ),
+    }
+}
+
+# Cached leaderboard and workout catalog responses
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('OCTOFIT_RESPONSE_CACHE_TIMEOUT', '300'))
+
+# Seconds an in-memory daily/weekly/monthly leaderboard is trusted before it is
+# reloaded from the activity rollups
+LEADERBOARD_WINDOW_TTL = int(os.getenv('OCTOFIT_LEADERBOARD_WINDOW_TTL', '60'))
+
+# Live leaderboard stream: idle keepalive interval and client reconnect delay
+LIVE_HEARTBEAT_SECONDS = int(os.getenv('OCTOFIT_LIVE_HEARTBEAT_SECONDS', '15'))
+LIVE_RETRY_MILLISECONDS = int(os.getenv('OCTOFIT_LIVE_RETRY_MILLISECONDS', '3000'))
+
+# Request metrics served at /metrics/: share of requests measured, and the
+# latency above which a request is logged with its slowest queries (set it
+# to an empty value to turn the log off)
+REQUEST_METRICS_ENABLED = os.getenv('OCTOFIT_REQUEST_METRICS', '1') == '1'
+REQUEST_METRICS_SAMPLE_RATE = float(os.getenv('OCTOFIT_REQUEST_METRICS_SAMPLE_RATE', '1.0'))
+REQUEST_METRICS_SLOW_MS = float(os.getenv('OCTOFIT_REQUEST_METRICS_SLOW_MS', '500') or 0) or None
+REQUEST_METRICS_EXCLUDED_PATHS = ('/metrics/',)
+
+# Activity feed delta sync: how long recent changes are held back so that
+# concurrent writes are not skipped, and how long deletions are remembered
+ACTIVITY_SYNC_SETTLE_SECONDS = int(os.getenv('OCTOFIT_ACTIVITY_SYNC_SETTLE_SECONDS', '1'))
+ACTIVITY_TOMBSTONE_RETENTION_DAYS = int(os.getenv('OCTOFIT_ACTIVITY_TOMBSTONE_RETENTION_DAYS', '30'))
+
+# Search index: shortest query token matched as a prefix, and the most index
+# rows read per query token
+SEARCH_MIN_PREFIX = int(os.getenv('OCTOFIT_SEARCH_MIN_PREFIX', '2'))
+SEARCH_MAX_MATCHES = int(os.getenv('OCTOFIT_SEARCH_MAX_MATCHES', '10000'))
+
+# Activity creation: 'direct' writes in the request, 'queued' appends to a local
+# queue that the drain_activity_queue worker writes in batches. The default
+# queue file lives in the temp directory; point it at persistent storage in
+# production so queued activities survive a reboot
+ACTIVITY_INGEST_MODE = os.getenv('OCTOFIT_ACTIVITY_INGEST_MODE', 'direct')
+ACTIVITY_INGEST_QUEUE_PATH = os.getenv(
+    'OCTOFIT_ACTIVITY_INGEST_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'octofit_activity_queue.sqlite3')
+)
 
 
 # Password validation
@@ -136,6 +292,12 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST Framework
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = ['*']
@@ -0,0 +1,37 @@
+"""
+Settings for running the benchmark suite. Without OCTOFIT_DB_ENGINE a local
+SQLite stand-in database is used, so no MongoDB or other external service is
+needed; with it, the chosen engine is benchmarked as configured, e.g. to
+compare engines on the same dataset:
+
+    DJANGO_SETTINGS_MODULE=octofit_tracker.settings_benchmark python manage.py benchmark_api
+    OCTOFIT_DB_ENGINE=postgresql DJANGO_SETTINGS_MODULE=octofit_tracker.settings_benchmark python manage.py benchmark_api
+
+The benchmarks wipe and reseed the database and drop indexes while they run,
+so they refuse to start under any other settings unless passed
+``--i-know-this-drops-data``. With OCTOFIT_DB_ENGINE, point OCTOFIT_DB_NAME at
+a scratch database.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, os, tempfile
+
+DEBUG = False
+
+# The benchmark commands may replace the data of this database
+BENCHMARK_DATABASE = True
+
+if 'OCTOFIT_DB_ENGINE' not in os.environ:
+    DB_ENGINE = 'sqlite'
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'djongo']
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv(
+                'OCTOFIT_BENCHMARK_DB', os.path.join(tempfile.gettempdir(), 'octofit_benchmark.sqlite3')
+            ),
+            'OPTIONS': {
+                'timeout': 30,
+            },
+        }
+    }
@@ -0,0 +1,23 @@
+"""
+Settings with two local SQLite databases, a primary and a separate replica,
+for checking the read routing without a MongoDB replica set:
+
+    DJANGO_SETTINGS_MODULE=octofit_tracker.settings_replica python manage.py test octofit_tracker.tests.ReplicaRoutingTest
+
+Nothing copies rows from the primary to the replica, so only the routing tests
+are meaningful against it.
+"""
+
+from .settings_benchmark import *  # noqa: F401,F403
+from .settings_benchmark import os, tempfile
+
+DATABASES = {
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), f'octofit_{alias}.sqlite3'),
+        'OPTIONS': {
+            'timeout': 30,
+        },
+    }
+    for alias in ('default', 'reads')
+}
@@ -0,0 +1,134 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import caching, search
+from .models import Activity, ActivityTombstone, Leaderboard, Team, User, Workout
+from .ranking import leaderboard_engine, window_rankings
+from .relations import link_activities, link_users, rename_team, rename_user
+from .scoring import apply_activity_changes, is_suspended
+
+SEARCH_DOC_TYPES = {User: 'user', Workout: 'workout'}
+
+# Fields copied onto other rows, by model
+COPIED_FIELDS = {User: ('email', 'name'), Team: ('name',)}
+
+
+@receiver(pre_save, sender=Activity)
+def remember_previous_activity(sender, instance, **kwargs):
+    """Keep the stored version of an activity so an update can be applied as a delta"""
+    instance._previous_version = None
+    if instance.pk and not is_suspended():
+        instance._previous_version = Activity.objects.filter(pk=instance.pk).first()
+
+
+@receiver(pre_save, sender=Activity)
+def link_activity(sender, instance, **kwargs):
+    link_activities([instance])
+
+
+@receiver(pre_save, sender=User)
+def link_user(sender, instance, **kwargs):
+    link_users([instance])
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=Team)
+def remember_copied_fields(sender, instance, **kwargs):
+    """Keep the stored values of the fields other rows copy, so a rename can be carried over"""
+    instance._copied_fields = None
+    if instance.pk:
+        instance._copied_fields = sender.objects.filter(pk=instance.pk).values(*COPIED_FIELDS[sender]).first()
+
+
+@receiver(post_save, sender=Team)
+def team_renamed(sender, instance, **kwargs):
+    previous = getattr(instance, '_copied_fields', None)
+    if previous and previous['name'] != instance.name:
+        rename_team(previous['name'], instance.name)
+        leaderboard_engine.rename('team', previous['name'], instance.name)
+        window_rankings.invalidate()
+        caching.invalidate('leaderboard')
+
+
+@receiver(post_save, sender=User)
+def user_renamed(sender, instance, **kwargs):
+    previous = getattr(instance, '_copied_fields', None)
+    if previous and (previous['email'], previous['name']) != (instance.email, instance.name):
+        rename_user(previous['email'], instance.email, previous['name'], instance.name)
+        if previous['name'] != instance.name:
+            leaderboard_engine.rename('user', previous['name'], instance.name)
+        window_rankings.invalidate()
+
+
+@receiver(post_save, sender=Activity)
+def activity_saved(sender, instance, created, **kwargs):
+    changes = []
+    previous = getattr(instance, '_previous_version', None)
+    if previous is not None:
+        changes.append((previous, -1))
+    changes.append((instance, 1))
+    apply_activity_changes(changes)
+    if created:
+        if instance.notes:
+            search.index_documents('activity', [instance], replace=False)
+    elif search.indexed_fields_changed('activity', previous, instance):
+        search.index_documents('activity', [instance])
+
+
+@receiver(post_delete, sender=Activity)
+def activity_deleted(sender, instance, **kwargs):
+    apply_activity_changes([(instance, -1)])
+    if not is_suspended():
+        ActivityTombstone.objects.create(
+            activity_id=instance.pk, user_email=instance.user_email, team=instance.team
+        )
+    if instance.notes:
+        search.remove_documents('activity', [instance.pk])
+
+
+@receiver(pre_save, sender=Leaderboard)
+def remember_previous_standing(sender, instance, **kwargs):
+    """Keep the stored entity type and total of an entry, to move it in the score tree"""
+    instance._previous_standing = None
+    if instance.pk:
+        instance._previous_standing = (
+            Leaderboard.objects.filter(pk=instance.pk).values_list('entity_type', 'total_points').first()
+        )
+
+
+@receiver(post_save, sender=Leaderboard)
+@receiver(post_delete, sender=Leaderboard)
+def leaderboard_edited(sender, instance, **kwargs):
+    """Count edits made outside the engine in the score tree and resync stream clients"""
+    standing = (instance.entity_type, instance.total_points)
+    if kwargs['signal'] is post_delete:
+        leaderboard_engine.track(standing, None)
+    else:
+        leaderboard_engine.track(getattr(instance, '_previous_standing', None), standing)
+    leaderboard_engine.invalidate(instance.entity_type)
+    caching.invalidate('leaderboard')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_edited(sender, instance, **kwargs):
+    # Leaderboard activity counts are resolved through the user's name
+    caching.invalidate('leaderboard')
+
+
+@receiver(post_save, sender=Workout)
+@receiver(post_delete, sender=Workout)
+def workout_edited(sender, instance, **kwargs):
+    caching.invalidate('workouts')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Workout)
+def reindex_document(sender, instance, created, **kwargs):
+    search.index_documents(SEARCH_DOC_TYPES[sender], [instance], replace=not created)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Workout)
+def unindex_document(sender, instance, **kwargs):
+    search.remove_documents(SEARCH_DOC_TYPES[sender], [instance.pk])
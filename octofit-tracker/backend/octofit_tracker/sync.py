@@ -0,0 +1,104 @@
+"""Delta sync of activity feeds from opaque change tokens.
+
+A token holds one keyset cursor over ``Activity.updated_at`` and one over
+``ActivityTombstone.deleted_at``, so a client receives every activity created
+or edited and every id deleted after its last sync. Changes newer than
+``ACTIVITY_SYNC_SETTLE_SECONDS`` are held back for the next sync: a write
+committed just after the read could carry an earlier timestamp than rows that
+were already returned.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+class InvalidToken(ValueError):
+    """Raised for a ``since`` value that is neither a token nor a timestamp."""
+
+
+class ExpiredToken(ValueError):
+    """Raised when deletions after ``since`` may already have been pruned."""
+
+
+def encode_token(changed, deleted):
+    """Encode the two ``(timestamp, id or None)`` cursors as an opaque token"""
+    payload = {key: [when.isoformat(), pk] for key, (when, pk) in (('a', changed), ('d', deleted))}
+    return urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode('ascii')
+
+
+def decode_since(value):
+    """Return the two cursors for a token or an ISO 8601 timestamp or date"""
+    try:
+        when = parse_datetime(value)
+        if when is None and parse_date(value) is not None:
+            when = datetime.combine(parse_date(value), time.min)
+    except ValueError:
+        # Well formed but impossible, like 2024-02-30
+        raise InvalidToken(value)
+    if when is not None:
+        if timezone.is_naive(when):
+            when = timezone.make_aware(when, dt_timezone.utc)
+        return (when, None), (when, None)
+    try:
+        payload = json.loads(urlsafe_b64decode(value.encode('ascii')))
+        cursors = []
+        for key in ('a', 'd'):
+            raw_when, pk = payload[key]
+            when = parse_datetime(raw_when)
+            if when is None or not (pk is None or isinstance(pk, int)):
+                raise ValueError(value)
+            cursors.append((when, pk))
+    except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+        raise InvalidToken(value)
+    return tuple(cursors)
+
+
+def _after(field, cursor):
+    when, pk = cursor
+    if pk is None:
+        return Q(**{f'{field}__gt': when})
+    return Q(**{f'{field}__gt': when}) | Q(**{field: when, 'id__gt': pk})
+
+
+def _page(queryset, field, cursor, horizon, page_size):
+    """Return up to ``page_size`` rows after ``cursor``, the next cursor and whether more remain"""
+    rows = list(
+        queryset.filter(_after(field, cursor), **{f'{field}__lte': horizon})
+        .order_by(field, 'id')[:page_size + 1]
+    )
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, (getattr(rows[-1], field), rows[-1].id), True
+    return rows, (horizon, None), False
+
+
+def feed_changes(activities, tombstones, since, page_size):
+    """Return ``(changed, deleted, next_token, has_more)`` for the feed after ``since``"""
+    changed_cursor, deleted_cursor = decode_since(since)
+    now = timezone.now()
+    if deleted_cursor[0] < now - timedelta(days=settings.ACTIVITY_TOMBSTONE_RETENTION_DAYS):
+        raise ExpiredToken(since)
+    horizon = now - timedelta(seconds=settings.ACTIVITY_SYNC_SETTLE_SECONDS)
+    changed, changed_cursor, more_changed = _page(
+        activities, 'updated_at', changed_cursor, max(horizon, changed_cursor[0]), page_size
+    )
+    deleted, deleted_cursor, more_deleted = _page(
+        tombstones, 'deleted_at', deleted_cursor, max(horizon, deleted_cursor[0]), page_size
+    )
+    return changed, deleted, encode_token(changed_cursor, deleted_cursor), more_changed or more_deleted
+
+
+def feed_version(activities, tombstones):
+    """Return ``(token, last_modified)`` that changes whenever the feed does"""
+    from_activities = activities.order_by().aggregate(count=Count('id'), changed=Max('updated_at'))
+    deleted = tombstones.order_by().aggregate(deleted=Max('deleted_at'))['deleted']
+    changed = from_activities['changed']
+    stamps = [stamp for stamp in (changed, deleted) if stamp is not None]
+    last_modified = int(max(stamps).timestamp()) if stamps else 0
+    token = f'{from_activities["count"]}:{changed and changed.isoformat()}:{deleted and deleted.isoformat()}'
+    return token, last_modified
@@ -1,7 +1,100 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import logging
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet, MiddlewareNotUsed
+from django.core.management.base import CommandError
+from django.core.management import call_command
+from django.db.models import F, Sum
+from django.db.models.sql.compiler import SQLCompiler, SQLInsertCompiler
+from django.conf import settings
+from django.db import connections, router
+from django.db.utils import ConnectionHandler
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase as DjangoTestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from datetime import date
-from .models import User, Team, Activity, Leaderboard, Workout
+from datetime import date, timedelta
+from pymongo import monitoring
+from .models import User, Team, Activity, ActivityRollup, ActivityTombstone, Leaderboard, SearchTerm, Workout
+from .async_views import activities_counts
+from .benchmarking import ensure_disposable_database, summarize
+from .checks import check_shared_response_cache
+from .ingestion import IngestQueue, activity_queue
+from .instrumentation import RequestMetricsMiddleware, registry
+from .live import leaderboard_stream, rank_broker
+from .mongo.base import _clients as mongo_clients, shared_client
+from .mongo.pool import PoolListener, listeners as mongo_listeners
+from .pagination import ActivityPagination
+from .ranking import LeaderboardEngine, RankingBoard, ScoreTree, leaderboard_engine, window_rankings
+from .rollups import apply_rollup_changes, bucket_start, rebuild_rollups
+from .repositories import Repository, accumulate, increment, increment_each, is_native, update_each
+from .routers import PIN_COOKIE, pinned_to_primary, read_alias, replica_reads
+from .scoring import increment_totals
+from .search import rebuild_search_index, search, tokenize
+from .seeding import seed_dataset, synthetic_activities
+from .serializers import (
+    ActivitySerializer, LeanListSerializer, count_activities_by_user_name, count_members_by_team,
+)
+
+
+def djongo_connection():
+    """Return an unconnected djongo connection, to check the writes issued on MongoDB"""
+    return ConnectionHandler({'default': {'ENGINE': 'octofit_tracker.mongo', 'NAME': 'octofit_test'}})['default']
+
+
+def translate_for_djongo(query):
+    """Parse ``query`` as djongo would run it, raising on SQL djongo cannot translate"""
+    # Imported here: djongo's translator can only be imported after djongo.base
+    from djongo.sql2mongo.query import Query
+
+    try:
+        statements = query.get_compiler(connection=djongo_connection()).as_sql()
+    except EmptyResultSet:
+        return
+    for sql, params in statements if isinstance(statements, list) else [statements]:
+        # Writes are translated when parsed, selects when their results are read
+        properties = mock.Mock(enforce_schema=False, cached_collections=set())
+        list(Query(mock.MagicMock(), mock.MagicMock(), properties, sql, params))
+
+
+@contextmanager
+def translated_for_djongo():
+    """Check that every ORM statement run in the block translates on djongo, with native writes mocked.
+
+    Statements still run on the test database; each is also compiled for a
+    djongo connection and parsed by djongo's SQL translator, which raises on
+    ``F()`` arithmetic, ``CASE`` and other SQL it has no translation for.
+    Writes the repositories issue natively on djongo go to the yielded mock.
+    """
+    collection = mock.MagicMock()
+    collection.find_one_and_update.return_value = {'total_points': 0}
+
+    def translating(execute_sql):
+        def wrapper(compiler, *args, **kwargs):
+            translate_for_djongo(compiler.query)
+            return execute_sql(compiler, *args, **kwargs)
+        return wrapper
+    with mock.patch.object(SQLCompiler, 'execute_sql', translating(SQLCompiler.execute_sql)), \
+            mock.patch.object(SQLInsertCompiler, 'execute_sql', translating(SQLInsertCompiler.execute_sql)), \
+            mock.patch('octofit_tracker.repositories.write_connection', return_value=djongo_connection()), \
+            mock.patch('octofit_tracker.repositories._collection', return_value=collection):
+        yield collection
+
+
+class TestCase(DjangoTestCase):
+    """TestCase that may also query the reads alias GET endpoints are routed to"""
+    databases = '__all__'
 
 
 class UserModelTest(TestCase):
@@ -126,7 +219,6 @@ class LeaderboardModelTest(TestCase):
             entity_type='user',
             entity_name='Top User',
             total_points=1000,
-            rank=1,
             team='Team Delta'
         )
     
@@ -135,32 +227,38 @@ class LeaderboardModelTest(TestCase):
         self.assertEqual(self.leaderboard_entry.entity_type, 'user')
         self.assertEqual(self.leaderboard_entry.entity_name, 'Top User')
         self.assertEqual(self.leaderboard_entry.total_points, 1000)
-        self.assertEqual(self.leaderboard_entry.rank, 1)
         self.assertEqual(self.leaderboard_entry.team, 'Team Delta')
         self.assertIsNotNone(self.leaderboard_entry.updated_at)
     
     def test_leaderboard_str(self):
         """Test the string representation of a leaderboard entry"""
-        self.assertEqual(str(self.leaderboard_entry), 'Top User - Rank 1')
+        self.assertEqual(str(self.leaderboard_entry), 'Top User - 1000 points')
     
     def test_leaderboard_ordering(self):
         """Test that leaderboard entries are ordered by rank"""
         Leaderboard.objects.create(
             entity_type='user',
-            entity_name='Second User',
-            total_points=800,
-            rank=2
+            entity_name='Third User',
+            total_points=600
         )
         Leaderboard.objects.create(
             entity_type='user',
-            entity_name='Third User',
-            total_points=600,
-            rank=3
+            entity_name='Second User',
+            total_points=800
         )
         entries = Leaderboard.objects.all()
-        self.assertEqual(entries[0].rank, 1)
-        self.assertEqual(entries[1].rank, 2)
-        self.assertEqual(entries[2].rank, 3)
+        self.assertEqual([entry.entity_name for entry in entries], ['Top User', 'Second User', 'Third User'])
+        ranks = leaderboard_engine.ranks(
+            (entry.entity_type, entry.entity_name, entry.total_points) for entry in entries
+        )
+        self.assertEqual([ranks[('user', entry.entity_name)] for entry in entries], [1, 2, 3])
+
+    def test_entries_unique_per_name(self):
+        """Test that an entity has one entry per leaderboard"""
+        from django.db import IntegrityError, transaction
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Leaderboard.objects.create(entity_type='user', entity_name='Top User', total_points=5)
+        Leaderboard.objects.create(entity_type='team', entity_name='Top User', total_points=5)
 
 
 class WorkoutModelTest(TestCase):
@@ -204,3 +302,1845 @@ class WorkoutModelTest(TestCase):
             category='strength'
         )
         self.assertIsNone(workout.equipment_needed)
+
+
+class RankingBoardTest(SimpleTestCase):
+    """Test cases for the in-memory ranking structure"""
+
+    def setUp(self):
+        self.board = RankingBoard([('Thor', 380), ('Hulk', 290), ('Batman', 410)])
+
+    def test_ranks_follow_points(self):
+        """Test that ranks are ordered by points descending"""
+        self.assertEqual(self.board.rank('Batman'), 1)
+        self.assertEqual(self.board.rank('Thor'), 2)
+        self.assertEqual(self.board.rank('Hulk'), 3)
+        self.assertIsNone(self.board.rank('Nobody'))
+
+    def test_add_moves_entity(self):
+        """Test that adding points reports the old and new rank"""
+        self.assertEqual(self.board.add('Hulk', 200), (3, 1))
+        self.assertEqual(self.board.top(3), [(1, 'Hulk', 490), (2, 'Batman', 410), (3, 'Thor', 380)])
+
+    def test_add_new_entity(self):
+        """Test that an unranked entity is inserted at its position"""
+        self.assertEqual(self.board.add('Flash', 300), (None, 3))
+        self.assertEqual(len(self.board), 4)
+
+    def test_ties_broken_by_name(self):
+        """Test that entities with equal points get distinct ranks by name"""
+        self.board.set('Aquaman', 380)
+        self.assertEqual(self.board.rank('Aquaman'), 2)
+        self.assertEqual(self.board.rank('Thor'), 3)
+
+    def test_around(self):
+        """Test that neighbours are clamped at both ends of the board"""
+        self.assertEqual([name for _, name, _ in self.board.around('Thor', 5)], ['Batman', 'Thor', 'Hulk'])
+        self.assertEqual([rank for rank, _, _ in self.board.around('Hulk', 1)], [2, 3])
+        self.assertEqual(self.board.around('Flash', 5), [])
+
+
+class ScoreTreeTest(SimpleTestCase):
+    """Test cases for counting entries above a total with the score tree"""
+
+    def test_standings_match_a_full_count(self):
+        """Test that entries above and on each total match counting every entry"""
+        tree = ScoreTree()
+        totals = [0, 0, 5, 120, 120, 120, 999, -3, 2 ** 31 - 1]
+        counts = tree.changes(Counter(totals))
+        for points in {*totals, 1, 121, -2 ** 31}:
+            above = sum(1 for total in totals if total > points)
+            self.assertEqual(tree.standings(counts, [points]), {points: (above, totals.count(points))})
+
+    def test_moves_cancel_out(self):
+        """Test that adding and removing the same entries leaves every node at zero"""
+        tree = ScoreTree()
+        self.assertEqual(tree.changes({120: 0}), {})
+        nodes = Counter(tree.changes({120: 1}))
+        nodes.update(tree.changes({120: -1}))
+        self.assertFalse(+nodes)
+
+
+class LeaderboardEngineTest(TestCase):
+    """Test cases for incremental leaderboard updates from activity writes"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        for name, points, team in [
+            ('Batman', 410, 'Team DC'),
+            ('Thor', 380, 'Team Marvel'),
+            ('Hulk', 290, 'Team Marvel'),
+        ]:
+            Leaderboard.objects.create(entity_type='user', entity_name=name, total_points=points, team=team)
+        Leaderboard.objects.create(entity_type='team', entity_name='Team Marvel', total_points=670)
+        Leaderboard.objects.create(entity_type='team', entity_name='Team DC', total_points=410)
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def create_activity(self, name, team, points):
+        return Activity.objects.create(
+            user_email=f'{name.lower()}@example.com',
+            user_name=name,
+            team=team,
+            activity_type='Training',
+            duration_minutes=30,
+            points_earned=points,
+            date=date.today()
+        )
+
+    def ranks(self, entity_type):
+        rows = list(Leaderboard.objects.filter(entity_type=entity_type).values_list('entity_name', 'total_points'))
+        ranks = leaderboard_engine.ranks((entity_type, name, points) for name, points in rows)
+        self.assertEqual(sorted(ranks.values()), list(range(1, len(rows) + 1)))
+        return [(ranks[(entity_type, name)], name, points) for name, points in rows]
+
+    def test_activity_creation_updates_ranks(self):
+        """Test that a new activity moves the user and team up the leaderboard"""
+        self.create_activity('Hulk', 'Team Marvel', 150)
+        self.assertEqual(self.ranks('user'), [
+            (1, 'Hulk', 440), (2, 'Batman', 410), (3, 'Thor', 380),
+        ])
+        self.assertEqual(self.ranks('team'), [(1, 'Team Marvel', 820), (2, 'Team DC', 410)])
+
+    def test_activity_update_applies_difference(self):
+        """Test that editing an activity only applies the change in points"""
+        activity = self.create_activity('Thor', 'Team Marvel', 50)
+        activity.points_earned = 10
+        activity.save()
+        self.assertEqual(self.ranks('user')[:2], [(1, 'Batman', 410), (2, 'Thor', 390)])
+
+    def test_activity_deletion_reverts_points(self):
+        """Test that deleting an activity removes its points"""
+        activity = self.create_activity('Thor', 'Team Marvel', 50)
+        activity.delete()
+        self.assertEqual(self.ranks('user')[1], (2, 'Thor', 380))
+        self.assertEqual(self.ranks('team')[0], (1, 'Team Marvel', 670))
+
+    def test_engines_share_the_table(self):
+        """Test that two engines, like two worker processes, never overwrite each other"""
+        first, second = LeaderboardEngine(), LeaderboardEngine()
+        first.apply('user', {'Hulk': 100})
+        second.apply('user', {'Thor': 50, 'Hulk': 30})
+        first.apply('user', {'Batman': -200, 'Flash': 400, 'Hulk': 10})
+        self.assertEqual(self.ranks('user'), [
+            (1, 'Hulk', 430), (2, 'Thor', 430), (3, 'Flash', 400), (4, 'Batman', 210),
+        ])
+
+    def test_new_user_is_inserted(self):
+        """Test that a user without a leaderboard entry gets one"""
+        self.create_activity('Flash', 'Team DC', 300)
+        self.assertEqual(self.ranks('user'), [
+            (1, 'Batman', 410), (2, 'Thor', 380), (3, 'Flash', 300), (4, 'Hulk', 290),
+        ])
+        self.assertEqual(Leaderboard.objects.get(entity_name='Flash').team, 'Team DC')
+
+    def test_concurrent_first_activities_share_one_entry(self):
+        """Test that an entry inserted by another writer first is added to, not duplicated"""
+        engine = LeaderboardEngine()
+        create = LeaderboardEngine._create
+
+        def lose_race(entity_type, names, teams):
+            # The other writer creates the entry between our read and our insert
+            Leaderboard.objects.create(entity_type=entity_type, entity_name='Flash', total_points=100)
+            return create(entity_type, names, teams)
+        with mock.patch.object(engine, '_create', side_effect=lose_race):
+            engine.apply('user', {'Flash': 300}, teams={'Flash': 'Team DC'})
+        self.assertEqual(Leaderboard.objects.filter(entity_name='Flash').count(), 1)
+        self.assertEqual(self.ranks('user'), [
+            (1, 'Batman', 410), (2, 'Flash', 400), (3, 'Thor', 380), (4, 'Hulk', 290),
+        ])
+
+    def test_moves_leave_other_entries_alone(self):
+        """Test that overtaking many entries rewrites only the entry that moved"""
+        for number in range(50):
+            Leaderboard.objects.create(entity_type='user', entity_name=f'Hero {number:02}', total_points=300 + number)
+        before = dict(Leaderboard.objects.exclude(entity_name='Hulk').values_list('entity_name', 'updated_at'))
+        with CaptureQueriesContext(connections['default']) as queries:
+            leaderboard_engine.apply('user', {'Hulk': 200})
+        entry_writes = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "leaderboard"')
+        ]
+        self.assertEqual(len(entry_writes), 1)
+        self.assertEqual(
+            dict(Leaderboard.objects.exclude(entity_name='Hulk').values_list('entity_name', 'updated_at')), before,
+        )
+        self.assertEqual(self.ranks('user')[:2], [(1, 'Hulk', 490), (2, 'Batman', 410)])
+        self.assertEqual(dict((name, rank) for rank, name, _ in self.ranks('user'))['Hero 00'], 53)
+
+    def test_ranks_break_ties_by_name(self):
+        """Test that counted ranks match a full sort, for any subset of the entries"""
+        for number in range(12):
+            Leaderboard.objects.create(
+                entity_type='user', entity_name=f'Hero {number:02}', total_points=number % 3 * 100,
+            )
+        expected = RankingBoard(
+            Leaderboard.objects.filter(entity_type='user').values_list('entity_name', 'total_points')
+        )
+        entries = [('user', name, points) for _, name, points in expected.top(len(expected))]
+        for subset in (entries, entries[4:9], entries[::3], entries[10:11]):
+            ranks = leaderboard_engine.ranks(subset)
+            self.assertEqual(ranks, {('user', name): expected.rank(name) for _, name, _ in subset})
+
+    def test_rename_onto_taken_name_merges(self):
+        """Test that renaming an entry to a name already on the board merges the two"""
+        leaderboard_engine.rename('user', 'Hulk', 'Thor')
+        self.assertEqual(self.ranks('user'), [(1, 'Thor', 670), (2, 'Batman', 410)])
+
+    def test_edits_outside_the_engine_are_counted(self):
+        """Test that entries saved or deleted directly keep the counted ranks right"""
+        hulk = Leaderboard.objects.get(entity_name='Hulk')
+        hulk.total_points = 500
+        hulk.save()
+        Leaderboard.objects.filter(entity_name='Batman').delete()
+        self.assertEqual(self.ranks('user'), [(1, 'Hulk', 500), (2, 'Thor', 380)])
+
+
+class LeaderboardApiTest(TestCase):
+    """Test cases for the leaderboard API endpoints"""
+
+    def seed(self, count, start=1):
+        for rank in range(start, start + count):
+            email = f'hero{rank}@example.com'
+            User.objects.create(email=email, name=f'Hero {rank}', team='Team Marvel')
+            Leaderboard.objects.create(entity_type='user', entity_name=f'Hero {rank}', total_points=1000 - rank)
+            for _ in range(rank % 3):
+                Activity.objects.create(
+                    user_email=email, user_name=f'Hero {rank}', activity_type='Running',
+                    duration_minutes=30, points_earned=0, date=date.today()
+                )
+        leaderboard_engine.invalidate()
+
+    def test_activities_count(self):
+        """Test that each user entry reports its number of activities"""
+        self.seed(4)
+        response = self.client.get('/api/leaderboard/users/')
+        counts = {row['entity_name']: row['activities_count'] for row in response.json()['results']}
+        self.assertEqual(counts, {'Hero 1': 1, 'Hero 2': 2, 'Hero 3': 0, 'Hero 4': 1})
+
+    def test_activities_count_sums_shared_names(self):
+        """Test that users sharing a display name have their activities summed, not overwritten"""
+        self.seed(1)
+        User.objects.create(email='other.hero1@example.com', name='Hero 1', team='Team DC')
+        for _ in range(2):
+            Activity.objects.create(
+                user_email='other.hero1@example.com', user_name='Hero 1', activity_type='Running',
+                duration_minutes=30, points_earned=0, date=date.today()
+            )
+        self.assertEqual(count_activities_by_user_name(['Hero 1']), {'Hero 1': 3})
+        for params in ({}, {'lean': 'true'}):
+            row = self.client.get('/api/leaderboard/users/', params).json()['results'][0]
+            self.assertEqual(row['activities_count'], 3)
+        counts = async_to_sync(activities_counts)(list(Leaderboard.objects.all()))
+        self.assertEqual(counts, {'activities_counts': {'Hero 1': 3}})
+
+    def test_query_count_independent_of_size(self):
+        """Test that the user leaderboard issues a fixed number of queries"""
+        # The page, its score tree nodes, and the users and activities behind the counts
+        self.seed(3)
+        with self.assertNumQueries(4):
+            self.client.get('/api/leaderboard/users/')
+        self.seed(30, start=4)
+        with self.assertNumQueries(4):
+            self.client.get('/api/leaderboard/users/')
+
+
+class TeamApiTest(TestCase):
+    """Test cases for the team API endpoints"""
+
+    def seed(self, count, start=1):
+        for number in range(start, start + count):
+            Team.objects.create(name=f'Team {number}')
+            for member in range(number % 3):
+                User.objects.create(
+                    email=f'member{member}@team{number}.com', name=f'Member {member}', team=f'Team {number}'
+                )
+
+    def test_member_count(self):
+        """Test that each team reports the number of users on it"""
+        self.seed(3)
+        response = self.client.get('/api/teams/')
+        counts = {row['name']: row['member_count'] for row in response.json()['results']}
+        self.assertEqual(counts, {'Team 1': 1, 'Team 2': 2, 'Team 3': 0})
+
+    def test_query_count_independent_of_size(self):
+        """Test that the team list issues a fixed number of queries"""
+        self.seed(3)
+        with self.assertNumQueries(2):
+            self.client.get('/api/teams/')
+        self.seed(30, start=4)
+        with self.assertNumQueries(2):
+            self.client.get('/api/teams/')
+
+
+class ActivityPaginationTest(TestCase):
+    """Test cases for keyset pagination of the activity list"""
+
+    def setUp(self):
+        self.today = date.today()
+        for number in range(7):
+            self.create_activity(number, self.today - timedelta(days=number % 3))
+
+    def create_activity(self, number, day):
+        return Activity.objects.create(
+            user_email='runner@example.com', user_name='Runner', activity_type=f'Run {number}',
+            duration_minutes=30, points_earned=0, date=day
+        )
+
+    def collect(self, url):
+        """Follow next links from ``url`` and return the ids of every page"""
+        pages = []
+        while url:
+            body = self.client.get(url).json()
+            pages.append([row['id'] for row in body['results']])
+            url = body['next']
+        return pages
+
+    def test_pages_cover_ordering(self):
+        """Test that following next links walks the full ordering once"""
+        pages = self.collect('/api/activities/?page_size=3')
+        expected = list(Activity.objects.order_by('-date', '-created_at', 'id').values_list('id', flat=True))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_previous_link(self):
+        """Test that the previous link returns to the earlier page"""
+        first = self.client.get('/api/activities/?page_size=3').json()
+        second = self.client.get(first['next']).json()
+        self.assertIsNone(first['previous'])
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_stable_under_inserts(self):
+        """Test that rows inserted ahead of the cursor don't shift later pages"""
+        first = self.client.get('/api/activities/?page_size=3').json()
+        self.create_activity(99, self.today)
+        rest = self.collect(first['next'])
+        seen = [row['id'] for row in first['results']] + sum(rest, [])
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get('/api/activities/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_custom_action_paginates(self):
+        """Test that filtered actions are paginated too"""
+        body = self.client.get('/api/activities/by_user/?user_email=runner@example.com&page_size=5').json()
+        self.assertEqual(len(body['results']), 5)
+        self.assertIsNotNone(body['next'])
+
+
+class ActivityExportTest(TestCase):
+    """Test cases for the streaming activity export"""
+
+    def setUp(self):
+        self.today = date.today()
+        for number, team in enumerate(['Team Marvel', 'Team DC', 'Team Marvel']):
+            Activity.objects.create(
+                user_email='runner@example.com', user_name='Runner', team=team, activity_type='Running',
+                duration_minutes=30, points_earned=0, date=self.today - timedelta(days=number),
+                notes='Line one, "quoted"'
+            )
+
+    def export(self, query):
+        response = self.client.get(f'/api/activities/export/?{query}')
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        """Test that NDJSON export writes one object per activity"""
+        response, body = self.export('output=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['date'], self.today.isoformat())
+
+    def test_csv(self):
+        """Test that CSV export writes a header and quoted rows"""
+        response, body = self.export('output=csv')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0][:2], ['id', 'user_email'])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][8], 'Line one, "quoted"')
+
+    def test_filters(self):
+        """Test that date range and team filters narrow the export"""
+        since = (self.today - timedelta(days=1)).isoformat()
+        _, body = self.export(f'team=Team+Marvel&date_from={since}')
+        self.assertEqual(len(body.splitlines()), 1)
+
+    def test_invalid_parameters(self):
+        """Test that unknown formats and bad dates are rejected"""
+        self.assertEqual(self.client.get('/api/activities/export/?output=xml').status_code, 400)
+        self.assertEqual(self.client.get('/api/activities/export/?date_to=yesterday').status_code, 400)
+
+    def test_impossible_dates(self):
+        """Test that well-formed but impossible dates are rejected rather than failing"""
+        for path, params in (
+            ('/api/activities/export/', {'date_from': '2024-02-30'}),
+            ('/api/stats/users/', {'user_email': 'runner@example.com', 'date_to': '2024-02-30'}),
+            ('/api/leaderboard/users/', {'window': 'week', 'date': '2024-02-30'}),
+        ):
+            response = self.client.get(path, params)
+            self.assertEqual(response.status_code, 400, path)
+            self.assertIn('must be a YYYY-MM-DD date', response.json()['error'])
+
+
+class ActivityBulkCreateTest(TestCase):
+    """Test cases for bulk activity ingestion"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        Leaderboard.objects.create(entity_type='user', entity_name='Runner', total_points=0, team='Team DC')
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def item(self, points, **overrides):
+        data = {
+            'user_email': 'runner@example.com', 'user_name': 'Runner', 'team': 'Team DC',
+            'activity_type': 'Running', 'duration_minutes': 30, 'points_earned': points,
+            'date': date.today().isoformat(),
+        }
+        data.update(overrides)
+        return data
+
+    def post(self, items):
+        return self.client.post('/api/activities/bulk/', items, content_type='application/json')
+
+    def test_bulk_create(self):
+        """Test that every valid item is created and scored once"""
+        response = self.post([self.item(10), self.item(20), self.item(30)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['created']), 3)
+        self.assertEqual(Activity.objects.count(), 3)
+        self.assertEqual(Leaderboard.objects.get(entity_name='Runner').total_points, 60)
+        self.assertEqual(Leaderboard.objects.get(entity_name='Team DC').total_points, 60)
+
+    def test_query_count_is_bounded(self):
+        """Test that a batch costs a bounded number of queries, not a few per item"""
+        items = [
+            self.item(index % 7 + 1, user_email=f'user{index % 10}@example.com', user_name=f'User {index % 10}',
+                      team=f'Team {index % 3}', date=(date.today() - timedelta(days=index % 20)).isoformat())
+            for index in range(100)
+        ]
+        self.assertEqual(self.post(items).status_code, 201)
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.post(items)
+        self.assertEqual(response.status_code, 201)
+        # Grouped by distinct delta, not by item: 946 queries before batching
+        self.assertLessEqual(len(queries), 100)
+        self.assertEqual(Activity.objects.count(), 200)
+        self.assertEqual(
+            ActivityRollup.objects.filter(period='day', entity_type='user').aggregate(total=Sum('activity_count'))['total'],
+            200,
+        )
+
+    def test_engine_without_bulk_pks(self):
+        """Test that items get their ids when bulk_create cannot return them, as on djongo"""
+        features = connections['default'].features
+        with mock.patch.object(type(features), 'can_return_rows_from_bulk_insert', False):
+            response = self.post([self.item(10, notes='hill repeats'), self.item(20)])
+        self.assertEqual(response.status_code, 201)
+        ids = [activity['id'] for activity in response.json()['created']]
+        self.assertCountEqual(ids, Activity.objects.values_list('id', flat=True))
+        self.assertEqual(set(SearchTerm.objects.values_list('doc_id', flat=True)), {ids[0]})
+        self.assertEqual(Leaderboard.objects.get(entity_name='Runner').total_points, 30)
+
+    def test_errors_reported_per_item(self):
+        """Test that invalid items are reported by index without blocking the rest"""
+        response = self.post([self.item(10), self.item(20, duration_minutes='long'), self.item(5, date=None)])
+        self.assertEqual(response.status_code, 207)
+        errors = response.json()['errors']
+        self.assertEqual([error['index'] for error in errors], [1, 2])
+        self.assertIn('duration_minutes', errors[0]['errors'])
+        self.assertEqual(Activity.objects.count(), 1)
+
+    def test_rejects_non_list(self):
+        """Test that the body must be a non-empty list"""
+        self.assertEqual(self.post(self.item(10)).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([self.item(10, points_earned='x')]).status_code, 400)
+
+
+class RelationsTest(TestCase):
+    """Test cases for the user and team relations behind the string fields"""
+
+    def setUp(self):
+        self.team = Team.objects.create(name='Team Marvel')
+        self.user = User.objects.create(email='thor@marvel.com', name='Thor', team='Team Marvel')
+
+    def create_activity(self):
+        return Activity.objects.create(
+            user_email='thor@marvel.com', user_name='Thor', team='Team Marvel', activity_type='Hammer Training',
+            duration_minutes=60, points_earned=0, date=date.today()
+        )
+
+    def test_relations_linked_on_save(self):
+        """Test that saving resolves the string fields to relations"""
+        activity = self.create_activity()
+        self.assertEqual(activity.user, self.user)
+        self.assertEqual(activity.team_ref, self.team)
+        self.assertEqual(self.user.team_ref, self.team)
+
+    def test_renames_show_through_api(self):
+        """Test that renaming a user or team needs no activity rewrite"""
+        self.create_activity()
+        User.objects.filter(pk=self.user.pk).update(name='Thor Odinson')
+        Team.objects.filter(pk=self.team.pk).update(name='Avengers')
+        row = self.client.get('/api/activities/').json()['results'][0]
+        self.assertEqual((row['user_name'], row['team']), ('Thor Odinson', 'Avengers'))
+        self.assertEqual(self.client.get('/api/users/').json()['results'][0]['team'], 'Avengers')
+
+    def test_renames_show_through_export(self):
+        """Test that the export reads linked names through the relations and the row's copy otherwise"""
+        self.create_activity()
+        Activity.objects.create(
+            user_email='loki@asgard.com', user_name='Loki', team='Asgard', activity_type='Mischief',
+            duration_minutes=10, points_earned=0, date=date.today() - timedelta(days=1)
+        )
+        User.objects.filter(pk=self.user.pk).update(name='Thor Odinson')
+        Team.objects.filter(pk=self.team.pk).update(name='Avengers')
+        body = b''.join(self.client.get('/api/activities/export/').streaming_content).decode()
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(
+            [(row['user_email'], row['user_name'], row['team']) for row in rows],
+            [('thor@marvel.com', 'Thor Odinson', 'Avengers'), ('loki@asgard.com', 'Loki', 'Asgard')],
+        )
+        self.assertEqual(list(rows[0]), ActivitySerializer.Meta.fields)
+
+    def test_saved_renames_update_copies(self):
+        """Test that renames saved through the models reach the string keys filters and counts use"""
+        self.create_activity()
+        leaderboard_engine.apply('user', {'Thor': 10}, teams={'Thor': 'Team Marvel'})
+        leaderboard_engine.apply('team', {'Team Marvel': 10})
+        self.team.name = 'Avengers'
+        self.team.save()
+        self.user.refresh_from_db()
+        self.user.email, self.user.name = 'odinson@marvel.com', 'Thor Odinson'
+        self.user.save()
+
+        self.assertEqual(count_members_by_team(['Avengers', 'Team Marvel']), {'Avengers': 1})
+        response = self.client.get('/api/users/by_team/', {'team': 'Avengers'}).json()
+        self.assertEqual([user['email'] for user in response['results']], ['odinson@marvel.com'])
+        activity = Activity.objects.get()
+        self.assertEqual((activity.user_email, activity.user_name, activity.team),
+                         ('odinson@marvel.com', 'Thor Odinson', 'Avengers'))
+        self.assertEqual(
+            set(ActivityRollup.objects.values_list('entity_key', flat=True)), {'odinson@marvel.com', 'Avengers'}
+        )
+        self.assertEqual(
+            set(Leaderboard.objects.values_list('entity_name', 'team')),
+            {('Thor Odinson', 'Avengers'), ('Avengers', None)},
+        )
+
+    def test_activity_list_query_count(self):
+        """Test that related rows are joined rather than fetched per activity"""
+        for _ in range(5):
+            self.create_activity()
+        with self.assertNumQueries(1):
+            self.client.get('/api/activities/')
+
+    def test_backfill_command(self):
+        """Test that the backfill command links rows written before the relations existed"""
+        activity = self.create_activity()
+        Activity.objects.update(user=None, team_ref=None)
+        User.objects.update(team_ref=None)
+        call_command('backfill_relations', chunk_size=1, stdout=io.StringIO())
+        activity.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual((activity.user_id, activity.team_ref_id), (self.user.pk, self.team.pk))
+        self.assertEqual(self.user.team_ref_id, self.team.pk)
+
+
+class ResponseCacheTest(TestCase):
+    """Test cases for cached leaderboard and workout responses"""
+
+    def setUp(self):
+        caches['default'].clear()
+        Workout.objects.create(
+            name='Morning Cardio', description='Cardio', difficulty_level='beginner',
+            estimated_duration_minutes=30, points_value=40, category='cardio'
+        )
+
+    def test_repeat_request_served_from_cache(self):
+        """Test that an unchanged catalog is served without querying"""
+        first = self.client.get('/api/workouts/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/workouts/')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_conditional_get(self):
+        """Test that matching validators return 304 with no body"""
+        first = self.client.get('/api/workouts/')
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_if_modified_since_alone_is_not_trusted(self):
+        """Test that a change within the second of Last-Modified is not hidden behind a 304"""
+        first = self.client.get('/api/workouts/')
+        Workout.objects.create(
+            name='Evening Yoga', description='Yoga', difficulty_level='beginner',
+            estimated_duration_minutes=30, points_value=30, category='flexibility'
+        )
+        response = self.client.get('/api/workouts/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_deploy_check_warns_about_local_memory(self):
+        """Test that check --deploy flags a per-process response cache"""
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem):
+            self.assertEqual([warning.id for warning in check_shared_response_cache(None)], ['octofit_tracker.W001'])
+        filebased = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp'}}
+        with override_settings(CACHES=filebased):
+            self.assertEqual(check_shared_response_cache(None), [])
+
+    def test_save_invalidates(self):
+        """Test that saving a workout changes the ETag and the cached data"""
+        first = self.client.get('/api/workouts/')
+        Workout.objects.create(
+            name='Evening Yoga', description='Yoga', difficulty_level='beginner',
+            estimated_duration_minutes=30, points_value=30, category='flexibility'
+        )
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_activity_invalidates_leaderboard(self):
+        """Test that a new activity refreshes the cached leaderboard"""
+        leaderboard_engine.invalidate()
+        self.addCleanup(leaderboard_engine.invalidate)
+        first = self.client.get('/api/leaderboard/users/')
+        self.assertEqual(first.json()['results'], [])
+        Activity.objects.create(
+            user_email='runner@example.com', user_name='Runner', activity_type='Running',
+            duration_minutes=30, points_earned=40, date=date.today()
+        )
+        response = self.client.get('/api/leaderboard/users/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['total_points'], 40)
+
+
+class ActivityRollupTest(TestCase):
+    """Test cases for the time-bucketed activity rollups"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def log(self, points, day, activity_type='Running', email='runner@example.com'):
+        return Activity.objects.create(
+            user_email=email, user_name='Runner', team='Team DC', activity_type=activity_type,
+            duration_minutes=30, points_earned=points, date=day
+        )
+
+    def buckets(self):
+        return {
+            (row.period, row.bucket_start, row.entity_type, row.entity_key, row.activity_type):
+                (row.activity_count, row.total_points, row.total_minutes)
+            for row in ActivityRollup.objects.exclude(activity_count=0, total_points=0, total_minutes=0)
+        }
+
+    def test_incremental_buckets(self):
+        """Test that creates, edits and deletes move points between buckets"""
+        today = date.today()
+        activity = self.log(40, today)
+        self.log(10, today, activity_type='Cycling')
+        week = bucket_start(today, 'week')
+        user_week = ActivityRollup.objects.get(
+            period='week', bucket_start=week, entity_type='user',
+            entity_key='runner@example.com', activity_type='Running'
+        )
+        self.assertEqual((user_week.activity_count, user_week.total_points), (1, 40))
+
+        activity.points_earned = 25
+        activity.save()
+        team_day = ActivityRollup.objects.get(period='day', bucket_start=today, entity_type='team', activity_type='Running')
+        self.assertEqual(team_day.total_points, 25)
+
+        activity.delete()
+        team_day.refresh_from_db()
+        self.assertEqual((team_day.activity_count, team_day.total_points), (0, 0))
+
+    def test_rebuild_matches_incremental(self):
+        """Test that a full rebuild reproduces the incrementally maintained buckets"""
+        today = date.today()
+        for offset, points in enumerate([10, 20, 30, 40, 50]):
+            self.log(points, today - timedelta(days=offset * 9), email=f'user{offset % 2}@example.com')
+        incremental = self.buckets()
+        with CaptureQueriesContext(connections['default']) as queries:
+            rebuild_rollups(chunk_size=3)
+        self.assertEqual(self.buckets(), incremental)
+        # Weeks and months are folded in Python: djongo cannot truncate dates
+        self.assertFalse([query for query in queries.captured_queries if 'date_trunc' in query['sql']])
+
+    def test_buckets_added_to_natively_on_djongo(self):
+        """Test that bucket totals are added with one bulk $inc write on djongo"""
+        activity = Activity(
+            user_email='runner@example.com', user_name='Runner', team='Team DC', activity_type='Running',
+            duration_minutes=30, points_earned=40, date=date.today(),
+        )
+        collection = mock.Mock()
+        with mock.patch('octofit_tracker.repositories.write_connection', return_value=djongo_connection()), \
+                mock.patch('octofit_tracker.repositories._collection', return_value=collection):
+            apply_rollup_changes([(activity, 1)])
+        self.assertEqual(ActivityRollup.objects.filter(activity_count=0, total_points=0).count(), 6)
+        (requests,), options = collection.bulk_write.call_args
+        self.assertEqual(options, {'ordered': False})
+        self.assertEqual(len(requests), 6)
+        for request in requests:
+            self.assertEqual(request._doc['$inc'], {'activity_count': 1, 'total_points': 40, 'total_minutes': 30})
+            self.assertIn('updated_at', request._doc['$set'])
+
+    def test_stats_endpoint(self):
+        """Test per-period totals with a per-activity-type breakdown"""
+        today = date.today()
+        self.log(40, today)
+        self.log(10, today, activity_type='Cycling')
+        response = self.client.get('/api/stats/users/', {'user_email': 'runner@example.com', 'period': 'day'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['totals'], {'activity_count': 2, 'total_points': 50, 'total_minutes': 60})
+        self.assertEqual(data['buckets'][-1]['by_activity_type']['Cycling']['total_points'], 10)
+
+        response = self.client.get('/api/stats/teams/', {'team': 'Team DC', 'period': 'month'})
+        self.assertEqual(response.json()['totals']['total_points'], 50)
+        response = self.client.get('/api/stats/users/', {'user_email': 'runner@example.com', 'period': 'year'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_streak(self):
+        """Test current and longest runs of consecutive active days"""
+        today = date.today()
+        for offset in (0, 1, 5, 6, 7):
+            self.log(10, today - timedelta(days=offset))
+        response = self.client.get('/api/stats/streak/', {'user_email': 'runner@example.com'})
+        data = response.json()
+        self.assertEqual((data['current_streak'], data['longest_streak']), (2, 3))
+
+
+class WindowedLeaderboardTest(TestCase):
+    """Test cases for daily, weekly, monthly and around-me leaderboards"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        window_rankings.invalidate()
+        caches['default'].clear()
+        for index in range(5):
+            User.objects.create(name=f'User {index}', email=f'user{index}@example.com', team='Team DC')
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+        window_rankings.invalidate()
+
+    def log(self, index, points, day):
+        Activity.objects.create(
+            user_email=f'user{index}@example.com', user_name=f'User {index}', team='Team DC',
+            activity_type='Running', duration_minutes=30, points_earned=points, date=day
+        )
+
+    def test_weekly_window(self):
+        """Test that a window only counts activities inside its bucket"""
+        today = date.today()
+        self.log(0, 500, today - timedelta(days=40))
+        self.log(1, 30, today)
+        self.log(2, 20, today)
+        response = self.client.get('/api/leaderboard/users/', {'window': 'week'})
+        self.assertEqual(response.status_code, 200)
+        names = [(row['rank'], row['entity_name'], row['total_points']) for row in response.json()['results']]
+        self.assertEqual(names, [(1, 'User 1', 30), (2, 'User 2', 20)])
+
+        response = self.client.get('/api/leaderboard/users/')
+        self.assertEqual(response.json()['results'][0]['entity_name'], 'User 0')
+
+    def test_window_follows_new_activities(self):
+        """Test that loaded boards are updated in place by later activities"""
+        today = date.today()
+        self.log(1, 30, today)
+        self.log(2, 20, today)
+        self.client.get('/api/leaderboard/users/', {'window': 'day'})
+        self.log(2, 50, today)
+        results = self.client.get('/api/leaderboard/users/', {'window': 'day'}).json()['results']
+        self.assertEqual([row['user_email'] for row in results], ['user2@example.com', 'user1@example.com'])
+
+    def test_around(self):
+        """Test an entry with its neighbours, all-time and windowed"""
+        today = date.today()
+        for index in range(5):
+            self.log(index, (index + 1) * 10, today)
+        params = {'window': 'month', 'around': 'user2@example.com', 'radius': 1}
+        results = self.client.get('/api/leaderboard/users/', params).json()['results']
+        self.assertEqual([row['rank'] for row in results], [2, 3, 4])
+        self.assertEqual(results[1]['entity_name'], 'User 2')
+
+        params['window'] = 'all'
+        results = self.client.get('/api/leaderboard/users/', params).json()['results']
+        self.assertEqual([row['entity_name'] for row in results], ['User 3', 'User 2', 'User 1'])
+
+        results = self.client.get('/api/leaderboard/teams/', {'window': 'week', 'around': 'Team DC'}).json()['results']
+        self.assertEqual(results[0]['total_points'], 150)
+        response = self.client.get('/api/leaderboard/users/', {'window': 'week', 'around': 'nobody@example.com'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncEndpointTest(TestCase):
+    """Test cases for the async read endpoints"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        caches['default'].clear()
+        User.objects.create(name='Runner', email='runner@example.com', team='Team DC')
+        Team.objects.create(name='Team DC', description='DC heroes')
+        for points in (10, 20, 30):
+            Activity.objects.create(
+                user_email='runner@example.com', user_name='Runner', team='Team DC', activity_type='Running',
+                duration_minutes=30, points_earned=points, date=date.today()
+            )
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    async def test_activities_by_user(self):
+        """Test that the async feed pages like the viewset action"""
+        response = await self.async_client.get(
+            '/api/async/activities/by_user/', {'user_email': 'runner@example.com', 'page_size': 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next'])
+        response = await self.async_client.get(data['next'])
+        self.assertEqual(len(response.json()['results']), 1)
+
+        response = await self.async_client.get('/api/async/activities/by_user/')
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get('/api/async/activities/by_user/', {'cursor': 'bogus', 'user_email': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_leaderboard_and_teams(self):
+        """Test that the async leaderboard and team views include their per-page counts"""
+        response = await self.async_client.get('/api/async/leaderboard/users/')
+        results = response.json()['results']
+        self.assertEqual((results[0]['entity_name'], results[0]['total_points']), ('Runner', 60))
+        self.assertEqual(results[0]['activities_count'], 3)
+        # AsyncClient takes raw header names rather than WSGI environ keys
+        response = await self.async_client.get('/api/async/leaderboard/users/', **{'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        results = (await self.async_client.get('/api/async/teams/')).json()['results']
+        self.assertEqual(results[0]['member_count'], 1)
+        response = await self.async_client.post('/api/async/teams/')
+        self.assertEqual(response.status_code, 405)
+
+
+class LiveLeaderboardTest(TestCase):
+    """Test cases for the live leaderboard stream"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+        self.loop.close()
+
+    def received(self, subscription):
+        self.loop.run_until_complete(asyncio.sleep(0))
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        rank_broker.unsubscribe(subscription)
+        return events
+
+    def test_activity_publishes_rank_changes(self):
+        """Test that one activity publishes the moved user and team entries after commit"""
+        subscription = rank_broker.subscribe(self.loop, entity_type='user')
+        with self.captureOnCommitCallbacks(execute=True):
+            Activity.objects.create(
+                user_email='runner@example.com', user_name='Runner', team='Team DC', activity_type='Running',
+                duration_minutes=30, points_earned=40, date=date.today()
+            )
+        events = self.received(subscription)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(
+            [{key: entry[key] for key in ('entity_name', 'total_points', 'old_rank', 'new_rank')}
+             for entry in events[0]['entries']],
+            [{'entity_name': 'Runner', 'total_points': 40, 'old_rank': None, 'new_rank': 1}],
+        )
+
+    def test_batch_publishes_final_ranks(self):
+        """Test that a batch moving several entries publishes one event with their final ranks"""
+        for name, points in (('Hulk', 10), ('Thor', 20), ('Flash', 30)):
+            Leaderboard.objects.create(entity_type='user', entity_name=name, total_points=points)
+        subscription = rank_broker.subscribe(self.loop, entity_type='user')
+        with self.captureOnCommitCallbacks(execute=True):
+            leaderboard_engine.apply('user', {'Hulk': 25, 'Thor': 15})
+        events = self.received(subscription)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(
+            [(entry['entity_name'], entry['old_rank'], entry['new_rank']) for entry in events[0]['entries']],
+            [('Hulk', 3, 1), ('Thor', 2, 2)],
+        )
+        rows = Leaderboard.objects.filter(entity_type='user').values_list('entity_name', 'total_points')
+        ranks = leaderboard_engine.ranks(('user', name, points) for name, points in rows)
+        self.assertEqual(
+            {entry['entity_name']: entry['new_rank'] for entry in events[0]['entries']},
+            {name: ranks[('user', name)] for name in ('Hulk', 'Thor')},
+        )
+
+    def test_reconnect_replays_or_resyncs(self):
+        """Test that a reconnecting client gets missed events, or a resync when they are unknown"""
+        first = rank_broker.publish('ranks', entity_type='team', entries=[{'entity_name': 'Team DC', 'total_points': 10}])
+        second = rank_broker.publish('ranks', entity_type='team', entries=[{'entity_name': 'Team DC', 'total_points': 20}])
+        subscription = rank_broker.subscribe(self.loop, last_event_id=rank_broker.event_id(first))
+        self.assertEqual([event['id'] for event in self.received(subscription)], [second['id']])
+
+        subscription = rank_broker.subscribe(self.loop, last_event_id='stale-1')
+        self.assertEqual([event['type'] for event in self.received(subscription)], ['resync'])
+
+    async def test_stream(self):
+        """Test that the ASGI stream sends published events as SSE messages"""
+        sent = []
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if b'event: ranks' in message.get('body', b''):
+                disconnected.set()
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/leaderboard/stream/',
+                 'query_string': b'entity_type=user', 'headers': []}
+        stream = asyncio.ensure_future(leaderboard_stream(scope, receive, send))
+        while not sent:
+            await asyncio.sleep(0)
+        rank_broker.publish('ranks', entity_type='team', entries=[{'entity_name': 'Team DC', 'total_points': 5}])
+        rank_broker.publish('ranks', entity_type='user', entries=[{'entity_name': 'Runner', 'total_points': 5}])
+        await asyncio.wait_for(stream, timeout=5)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertIn(b'"entity_name": "Runner"', body)
+        self.assertNotIn(b'Team DC', body)
+        self.assertEqual(len(rank_broker), 0)
+
+
+    def test_stream_outside_asgi(self):
+        """Test that the stream paths explain themselves and are not advertised without the ASGI app"""
+        response = self.client.get('/api/leaderboard/stream/')
+        self.assertEqual(response.status_code, 501)
+        self.assertIn('ASGI', response.json()['error'])
+        self.assertNotIn('leaderboard_stream', self.client.get('/api/').json())
+        with mock.patch('octofit_tracker.live._serving', True):
+            self.assertIn('leaderboard_stream', self.client.get('/api/').json())
+
+
+class SparseFieldsetTest(TestCase):
+    """Test cases for ``fields=`` narrowing and lean list serialization"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        caches['default'].clear()
+        Team.objects.create(name='Team DC', description='DC heroes')
+        User.objects.create(name='Runner', email='runner@example.com', team='Team DC')
+        Workout.objects.create(
+            name='Sprint', description='Short intervals', difficulty_level='advanced',
+            estimated_duration_minutes=20, points_value=30, category='cardio', equipment_needed='None'
+        )
+        for points in (10, 20):
+            Activity.objects.create(
+                user_email='runner@example.com', user_name='Runner', team='Team DC', activity_type='Running',
+                duration_minutes=30, points_earned=points, date=date.today(), notes='Long notes'
+            )
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def test_fields_narrow_output(self):
+        """Test that only the requested fields are returned"""
+        response = self.client.get('/api/activities/', {'fields': 'user_name,points_earned'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]), {'user_name', 'points_earned'})
+
+        response = self.client.get('/api/activities/', {'fields': 'notes,bogus'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_fields_skip_unrequested_counts(self):
+        """Test that computed fields cost nothing when they are not requested"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/teams/', {'fields': 'name,total_points'})
+        self.assertEqual(response.json()['results'], [{'name': 'Team DC', 'total_points': 30}])
+
+    def test_lean_matches_model_serializer(self):
+        """Test that lean rows render exactly like the model serializers"""
+        requests = [
+            ('/api/users/', {}), ('/api/users/', {'fields': 'email,team'}),
+            ('/api/teams/', {}), ('/api/teams/', {'fields': 'member_count'}),
+            ('/api/activities/', {}), ('/api/activities/', {'fields': 'team,date'}),
+            ('/api/activities/by_user/', {'user_email': 'runner@example.com'}),
+            ('/api/leaderboard/', {}), ('/api/leaderboard/users/', {'fields': 'entity_name,activities_count'}),
+            ('/api/workouts/', {}), ('/api/workouts/by_difficulty/', {'difficulty': 'advanced', 'fields': 'name'}),
+        ]
+        for path, params in requests:
+            full = self.client.get(path, params).json()
+            lean = self.client.get(path, {**params, 'lean': 'true'}).json()
+            self.assertEqual(lean, full, path)
+            self.assertTrue(full['results'], path)
+
+    def test_lean_picks_relation_values_in_python(self):
+        """Test that lean rows prefer linked names without Coalesce, which djongo cannot translate"""
+        Activity.objects.create(
+            user_email='guest@example.com', user_name='Guest', team='Nobody', activity_type='Walking',
+            duration_minutes=10, points_earned=0, date=date.today() - timedelta(days=1)
+        )
+        Team.objects.filter(name='Team DC').update(name='Justice League')
+        with CaptureQueriesContext(connections['default']) as queries:
+            rows = self.client.get('/api/activities/', {'lean': 'true', 'fields': 'user_name,team'}).json()['results']
+        self.assertFalse([query for query in queries.captured_queries if 'COALESCE' in query['sql'].upper()])
+        self.assertEqual(
+            [(row['user_name'], row['team']) for row in rows],
+            [('Runner', 'Justice League'), ('Runner', 'Justice League'), ('Guest', 'Nobody')],
+        )
+
+    def test_lean_paginates(self):
+        """Test that lean pages carry working keyset cursors"""
+        first = self.client.get('/api/activities/', {'lean': '1', 'page_size': 1, 'fields': 'points_earned'}).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual([first['results'][0]['points_earned'], second['results'][0]['points_earned']], [20, 10])
+
+
+class RequestMetricsTest(TestCase):
+    """Test cases for the request metrics middleware"""
+
+    def setUp(self):
+        caches['default'].clear()
+        User.objects.create(name='Runner', email='runner@example.com', team='Team DC')
+
+    def test_metrics_per_view(self):
+        """Test that queries and latency are recorded under the viewset action"""
+        self.client.get('/api/users/by_team/', {'team': 'Team DC'})
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('octofit_request_duration_seconds_count{view="UserViewSet.by_team",method="GET",status="200"}', body)
+        self.assertIn('octofit_request_db_queries_bucket{view="UserViewSet.by_team",le="+Inf"}', body)
+        self.assertNotIn('view="metrics"', body)
+
+    @override_settings(REQUEST_METRICS_SLOW_MS=0)
+    def test_slow_request_log(self):
+        """Test that slow requests are logged with their queries"""
+        with self.assertLogs('octofit_tracker.instrumentation', 'WARNING') as logs:
+            self.client.get('/api/users/')
+        self.assertIn('UserViewSet.list', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_skipped(self):
+        """Test that requests outside the sample are not recorded"""
+        before = registry.expose()
+        self.client.get('/api/workouts/by_difficulty/', {'difficulty': 'unsampled'})
+        self.assertEqual(registry.expose(), before)
+
+    async def test_async_requests(self):
+        """Test that requests served asynchronously are recorded with their queries"""
+        await self.async_client.get('/api/async/teams/')
+        body = registry.expose()
+        self.assertIn('octofit_request_duration_seconds_count{view="async-teams",method="GET",status="200"}', body)
+        self.assertNotIn('octofit_request_db_queries_sum{view="async-teams"} 0', body)
+
+    @override_settings(DEBUG=True)
+    def test_asgi_chain_stays_async(self):
+        """Test that the ASGI handler does not adapt the middleware to sync"""
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            logging.getLogger('django.request').debug('Loading middleware')
+            ASGIHandler()
+        self.assertFalse([line for line in logs.output if 'RequestMetricsMiddleware' in line], logs.output)
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_disabled(self):
+        """Test that the middleware drops out of the stack when disabled"""
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestMetricsMiddleware(lambda request: None)
+
+
+class PointTotalsTest(TestCase):
+    """Test cases for user and team totals maintained from activity writes"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        self.team = Team.objects.create(name='Team DC', description='DC heroes')
+        self.user = User.objects.create(name='Runner', email='runner@example.com', team='Team DC')
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def log(self, points):
+        return Activity.objects.create(
+            user_email='runner@example.com', user_name='Runner', team='Team DC', activity_type='Running',
+            duration_minutes=30, points_earned=points, date=date.today()
+        )
+
+    def totals(self):
+        self.user.refresh_from_db()
+        self.team.refresh_from_db()
+        return self.user.total_points, self.team.total_points
+
+    def test_totals_follow_activity_writes(self):
+        """Test that creates, edits and deletes adjust the stored totals"""
+        activity = self.log(40)
+        self.log(10)
+        self.assertEqual(self.totals(), (50, 50))
+        activity.points_earned = 25
+        activity.save()
+        self.assertEqual(self.totals(), (35, 35))
+        activity.delete()
+        self.assertEqual(self.totals(), (10, 10))
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        """Test that reconcile_totals finds drifted totals and corrects them with --fix"""
+        self.log(40)
+        User.objects.filter(pk=self.user.pk).update(total_points=7)
+        output = io.StringIO()
+        call_command('reconcile_totals', chunk_size=1, stdout=output)
+        self.assertIn('runner@example.com: stored 7, activities 40 (+33)', output.getvalue())
+        self.assertEqual(self.totals(), (7, 40))
+
+        call_command('reconcile_totals', fix=True, settle=0, stdout=io.StringIO())
+        self.assertEqual(self.totals(), (40, 40))
+
+    def test_reconcile_adds_difference_and_waits_for_recent_changes(self):
+        """Test that --fix adds the drift on top of increments and skips totals still settling"""
+        self.log(40)
+        User.objects.filter(pk=self.user.pk).update(total_points=7)
+        output = io.StringIO()
+        call_command('reconcile_totals', fix=True, stdout=output)
+        self.assertIn('fixed all but 1 with recent activity changes', output.getvalue())
+        self.assertEqual(self.totals(), (7, 40))
+
+        # An activity written between the sum and the fix keeps its increment
+        def write_then_increment(*args, **kwargs):
+            self.log(5)
+            increment(*args, **kwargs)
+        with mock.patch('octofit_tracker.management.commands.reconcile_totals.increment',
+                        side_effect=write_then_increment):
+            call_command('reconcile_totals', fix=True, settle=0, stdout=io.StringIO())
+        self.assertEqual(self.totals(), (45, 45))
+
+    def test_increments_natively_on_djongo(self):
+        """Test that totals are added with $inc on djongo, which cannot translate F() updates"""
+        connection = djongo_connection()
+        collection = mock.Mock()
+        with mock.patch('octofit_tracker.repositories.write_connection', return_value=connection), \
+                mock.patch('octofit_tracker.repositories._collection', return_value=collection):
+            increment_totals(User, 'email', {'a@example.com': 5, 'b@example.com': 5, 'c@example.com': -2, '': 3})
+        calls = sorted(collection.update_many.call_args_list, key=lambda call: call.args[1]['$inc']['total_points'])
+        self.assertEqual([call.args[0] for call in calls], [
+            {'email': {'$in': ['c@example.com']}},
+            {'email': {'$in': ['a@example.com', 'b@example.com']}},
+        ])
+        self.assertEqual([call.args[1]['$inc'] for call in calls], [{'total_points': -2}, {'total_points': 5}])
+        updated_at = calls[0].args[1]['$set']['updated_at']
+        self.assertIsNone(updated_at.tzinfo)
+        self.assertEqual(self.totals(), (0, 0))
+
+    def test_increments_each_key_natively_on_djongo(self):
+        """Test that per-key increments are one $inc each, returning the value they replaced"""
+        collection = mock.Mock()
+        collection.find_one_and_update.side_effect = [{'total_points': 410}, None]
+        with mock.patch('octofit_tracker.repositories.write_connection', return_value=djongo_connection()), \
+                mock.patch('octofit_tracker.repositories._collection', return_value=collection):
+            previous = increment_each(
+                Leaderboard, {'entity_type': 'user'}, 'entity_name', 'total_points', {'Batman': 20, 'Nobody': 5},
+            )
+        self.assertEqual(previous, {'Batman': 410})
+        self.assertEqual([call.args for call in collection.find_one_and_update.call_args_list], [
+            ({'entity_type': 'user', 'entity_name': 'Batman'}, {'$inc': {'total_points': 20}}),
+            ({'entity_type': 'user', 'entity_name': 'Nobody'}, {'$inc': {'total_points': 5}}),
+        ])
+
+    def test_accumulates_natively_on_djongo(self):
+        """Test that rows are created through the ORM and added to with one bulk $inc write"""
+        Leaderboard.objects.create(entity_type='user', entity_name='Batman', total_points=410)
+        batman = Leaderboard.objects.get(entity_name='Batman').pk
+        collection = mock.Mock()
+        with mock.patch('octofit_tracker.repositories.write_connection', return_value=djongo_connection()), \
+                mock.patch('octofit_tracker.repositories._collection', return_value=collection):
+            accumulate(Leaderboard, ('entity_type', 'entity_name'), {
+                ('user', 'Batman'): {'total_points': 20}, ('user', 'Thor'): {'total_points': 5},
+            })
+        thor = Leaderboard.objects.get(entity_name='Thor')
+        self.assertEqual(thor.total_points, 0)
+        (requests,), options = collection.bulk_write.call_args
+        self.assertEqual(options, {'ordered': False})
+        self.assertEqual(sorted((request._filter['id'], request._doc) for request in requests), sorted([
+            (batman, {'$inc': {'total_points': 20}}), (thor.pk, {'$inc': {'total_points': 5}}),
+        ]))
+
+
+@override_settings(ACTIVITY_SYNC_SETTLE_SECONDS=0)
+class DeltaSyncTest(TestCase):
+    """Test cases for conditional GET and delta sync on the activity feed"""
+
+    path = '/api/activities/by_user/'
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def log(self, points, email='runner@example.com'):
+        return Activity.objects.create(
+            user_email=email, user_name='Runner', team='Team DC', activity_type='Running',
+            duration_minutes=30, points_earned=points, date=date.today()
+        )
+
+    def sync(self, since, **params):
+        response = self.client.get(self.path, {'user_email': 'runner@example.com', 'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes_after_token(self):
+        """Test that creates, edits and deletes after a token are reported once"""
+        kept = self.log(10)
+        removed = self.log(20)
+        self.log(30, email='other@example.com')
+        first = self.sync((timezone.now() - timedelta(days=1)).isoformat())
+        self.assertEqual(sorted(item['id'] for item in first['activities']), [kept.id, removed.id])
+        self.assertEqual(first['deleted'], [])
+
+        kept.points_earned = 15
+        kept.save()
+        removed_id = removed.id
+        removed.delete()
+        added = self.log(40)
+        second = self.sync(first['next_since'])
+        self.assertEqual(sorted(item['id'] for item in second['activities']), [kept.id, added.id])
+        self.assertEqual(second['deleted'], [removed_id])
+        self.assertFalse(second['has_more'])
+
+        third = self.sync(second['next_since'])
+        self.assertEqual((third['activities'], third['deleted']), ([], []))
+
+    def test_changes_are_paginated(self):
+        """Test that a sync larger than page_size continues from next_since"""
+        created = {self.log(points).id for points in range(5)}
+        seen = set()
+        since, pages = (timezone.now() - timedelta(days=1)).isoformat(), 0
+        while True:
+            page = self.sync(since, page_size=2)
+            seen.update(item['id'] for item in page['activities'])
+            since, pages = page['next_since'], pages + 1
+            if not page['has_more']:
+                break
+        self.assertEqual(seen, created)
+        self.assertEqual(pages, 3)
+
+    def test_conditional_get(self):
+        """Test that an unchanged feed answers 304 and any change issues a new ETag"""
+        self.log(10)
+        params = {'user_email': 'runner@example.com'}
+        etag = self.client.get(self.path, params)['ETag']
+        self.assertEqual(self.client.get(self.path, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.log(20, email='other@example.com')
+        self.assertEqual(self.client.get(self.path, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Activity.objects.filter(user_email='runner@example.com').first().delete()
+        response = self.client.get(self.path, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_rename_changes_etag(self):
+        """Test that renaming the team an activity shows issues a new ETag"""
+        team = Team.objects.create(name='Team DC')
+        self.log(10)
+        params = {'user_email': 'runner@example.com'}
+        etag = self.client.get(self.path, params)['ETag']
+        team.name = 'Justice League'
+        team.save()
+        response = self.client.get(self.path, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['team'], 'Justice League')
+
+    def test_invalid_and_expired_since(self):
+        """Test that a malformed since is rejected and one past the tombstone history is gone"""
+        response = self.client.get(self.path, {'user_email': 'runner@example.com', 'since': 'not-a-token!'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.path, {'user_email': 'runner@example.com', 'since': '2024-02-30'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.path, {'user_email': 'runner@example.com', 'since': '1990-01-01'})
+        self.assertEqual(response.status_code, 410)
+
+    def test_prune_tombstones(self):
+        """Test that prune_tombstones removes only tombstones past the retention period"""
+        self.log(10).delete()
+        self.log(20).delete()
+        ActivityTombstone.objects.filter(pk=ActivityTombstone.objects.first().pk).update(
+            deleted_at=timezone.now() - timedelta(days=90)
+        )
+        call_command('prune_tombstones', stdout=io.StringIO())
+        self.assertEqual(ActivityTombstone.objects.count(), 1)
+
+
+class SearchTest(TestCase):
+    """Test cases for the search index and the search endpoint"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        self.wonder = User.objects.create(name='Diana Prince', email='wonder@themyscira.com', team='Team DC')
+        self.flash = User.objects.create(name='Barry Allen', email='flash@central.com', team='Team DC')
+        self.workout = Workout.objects.create(
+            name='Speedster Sprint', description='Interval sprints for Barry', difficulty_level='advanced',
+            estimated_duration_minutes=30, points_value=60, category='cardio'
+        )
+        self.activity = Activity.objects.create(
+            user_email='flash@central.com', user_name='Barry Allen', team='Team DC', activity_type='Running',
+            duration_minutes=30, points_earned=50, date=date.today(), notes='Sprinted around Central City'
+        )
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def ranked(self, query, doc_types=None):
+        return [(doc_type, doc_id) for doc_type, doc_id, _ in search(query, doc_types)]
+
+    def test_tokenize(self):
+        """Test that text is folded to lowercase ASCII alphanumeric tokens"""
+        self.assertEqual(
+            tokenize('Café-Run #2 wonder@Themyscira.com'), ['cafe', 'run', '2', 'wonder', 'themyscira', 'com']
+        )
+
+    def test_prefix_match_ranked_by_field_weight(self):
+        """Test that prefixes match and a name outranks a description or notes"""
+        self.assertEqual(self.ranked('barr'), [('user', self.flash.id), ('workout', self.workout.id)])
+        self.assertEqual(self.ranked('sprint'), [('workout', self.workout.id), ('activity', self.activity.id)])
+        self.assertEqual(self.ranked('barry sprint'), [('workout', self.workout.id)])
+        self.assertEqual(self.ranked('sprint', ['activity']), [('activity', self.activity.id)])
+        self.assertEqual(self.ranked('b'), [])
+
+    def test_index_follows_writes(self):
+        """Test that edits and deletes are reflected in the index"""
+        self.flash.name = 'Wally West'
+        self.flash.save()
+        self.assertEqual(self.ranked('wally'), [('user', self.flash.id)])
+        self.assertEqual(self.ranked('barry', ['user']), [])
+        self.activity.points_earned = 60
+        self.activity.save()
+        self.assertEqual(self.ranked('central', ['activity']), [('activity', self.activity.id)])
+        self.activity.delete()
+        self.workout.delete()
+        self.assertEqual(self.ranked('sprint'), [])
+
+    @override_settings(SEARCH_MAX_MATCHES=2)
+    def test_rare_token_not_crowded_out(self):
+        """Test that a document matching a rare token is found past the match cap of a common one"""
+        for index in range(3):
+            Workout.objects.create(
+                name=f'Sprint Drill {index}', description='', difficulty_level='beginner',
+                estimated_duration_minutes=10, points_value=10, category='cardio',
+            )
+        # 'sprint' matches five documents; the activity's notes weigh least of them
+        self.assertEqual(self.ranked('sprint central', ['activity', 'workout']), [('activity', self.activity.id)])
+
+    def test_rebuild_matches_incremental_index(self):
+        """Test that rebuilding the index reproduces the terms maintained on save"""
+        def terms():
+            return sorted(SearchTerm.objects.values_list('term', 'doc_type', 'doc_id', 'weight'))
+        maintained = terms()
+        rebuild_search_index(chunk_size=2)
+        self.assertEqual(terms(), maintained)
+
+    def test_search_endpoint(self):
+        """Test that the endpoint returns ranked, paginated documents"""
+        response = self.client.get('/api/search/', {'q': 'Barr', 'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['results'][0]['type'], 'user')
+        self.assertEqual(data['results'][0]['object']['email'], 'flash@central.com')
+        self.assertIsNone(data['previous'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(data['results'][0]['object']['name'], 'Speedster Sprint')
+        self.assertIsNone(data['next'])
+
+    def test_search_endpoint_validation(self):
+        """Test that a missing query or unknown type is rejected"""
+        self.assertEqual(self.client.get('/api/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'barry', 'type': 'team'}).status_code, 400)
+
+
+class QueuedIngestionTest(TestCase):
+    """Test cases for queued activity creation and the drain worker"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        queued = override_settings(
+            ACTIVITY_INGEST_MODE='queued', ACTIVITY_INGEST_QUEUE_PATH=f'{directory.name}/queue.sqlite3'
+        )
+        queued.enable()
+        self.addCleanup(queued.disable)
+        self.addCleanup(lambda: activity_queue().close())
+        self.user = User.objects.create(name='Runner', email='runner@example.com', team='Team DC')
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def item(self, points, **overrides):
+        return {
+            'user_email': 'runner@example.com', 'user_name': 'Runner', 'team': 'Team DC',
+            'activity_type': 'Running', 'duration_minutes': 30, 'points_earned': points,
+            'date': date.today().isoformat(), **overrides,
+        }
+
+    def test_create_is_queued_until_drained(self):
+        """Test that create answers 202 and the worker writes and scores the activity"""
+        response = self.client.post('/api/activities/', self.item(40), content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Activity.objects.count(), 0)
+        self.assertEqual(self.client.get('/api/activities/queue/').json()['depth'], 1)
+
+        call_command('drain_activity_queue', once=True, stdout=io.StringIO())
+        self.assertEqual(Activity.objects.get().points_earned, 40)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_points, 40)
+        self.assertEqual(self.client.get('/api/activities/queue/').json()['depth'], 0)
+
+    @override_settings(ACTIVITY_INGEST_MODE='direct')
+    def test_direct_mode_leaves_queue_closed(self):
+        """Test that the queue stats endpoint does not open a queue in direct mode"""
+        with mock.patch('octofit_tracker.views.activity_queue') as queue:
+            self.assertEqual(self.client.get('/api/activities/queue/').json(), {'mode': 'direct'})
+        queue.assert_not_called()
+
+    def test_invalid_create_is_not_queued(self):
+        """Test that validation still happens in the request"""
+        response = self.client.post(
+            '/api/activities/', self.item(40, duration_minutes='long'), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(activity_queue().stats()['depth'], 0)
+
+    def test_claims_are_leased(self):
+        """Test that claimed entries are hidden until released or their lease expires"""
+        queue = IngestQueue(activity_queue().path)
+        self.addCleanup(queue.close)
+        first, second = queue.enqueue([self.item(1), self.item(2)])
+        self.assertEqual([pk for pk, _ in queue.claim(1)], [first])
+        self.assertEqual([pk for pk, _ in queue.claim(10)], [second])
+        self.assertEqual(queue.claim(10), [])
+        queue.release([first])
+        self.assertEqual([pk for pk, _ in queue.claim(10, lease_seconds=-1)], [first])
+        self.assertEqual([pk for pk, _ in queue.claim(10)], [first])
+
+    def test_unwritable_entries_are_dead_lettered(self):
+        """Test that entries failing validation when drained move to the dead-letter table"""
+        activity_queue().enqueue([self.item(10), self.item(20, date='yesterday')])
+        call_command('drain_activity_queue', once=True, stdout=io.StringIO())
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(activity_queue().stats(), {'depth': 0, 'lag_seconds': 0.0, 'dead_letters': 1})
+        self.assertIn('octofit_ingest_queue_depth 0', registry.expose())
+
+
+class MongoPoolTest(SimpleTestCase):
+    """Test cases for the shared MongoDB clients and their pool metrics"""
+
+    def tearDown(self):
+        for alias in ('pool-test-primary', 'pool-test-reads'):
+            mongo_listeners.pop(alias, None)
+            client = mongo_clients.pop(alias, None)
+            if client is not None:
+                client.close()
+
+    def test_one_client_per_alias(self):
+        """Test that each alias keeps one client with its own options"""
+        options = {'host': 'localhost', 'port': 27017, 'maxPoolSize': 5}
+        primary = shared_client('pool-test-primary', dict(options))
+        self.assertIs(shared_client('pool-test-primary', dict(options)), primary)
+        reads = shared_client('pool-test-reads', {**options, 'readPreference': 'secondaryPreferred'})
+        self.assertIsNot(reads, primary)
+        self.assertEqual(reads.read_preference.mongos_mode, 'secondaryPreferred')
+        self.assertEqual(mongo_listeners['pool-test-primary'].max_size, 5)
+
+    def test_changed_options_replace_client(self):
+        """Test that asking for an alias with other options closes the old client and builds a new one"""
+        options = {'host': 'localhost', 'port': 27017, 'maxPoolSize': 5}
+        first = shared_client('pool-test-primary', dict(options))
+        with mock.patch.object(first, 'close') as close:
+            second = shared_client('pool-test-primary', {**options, 'maxPoolSize': 10})
+        close.assert_called_once_with()
+        self.assertIsNot(second, first)
+        self.assertEqual(mongo_listeners['pool-test-primary'].max_size, 10)
+        self.assertIs(shared_client('pool-test-primary', {**options, 'maxPoolSize': 10}), second)
+
+    def test_pool_listener_counts(self):
+        """Test that pool events are counted per server and exposed as metrics"""
+        listener = mongo_listeners['pool-test-primary'] = PoolListener('pool-test-primary', 5)
+        address = ('db.local', 27017)
+        for connection_id in (1, 2):
+            listener.connection_created(monitoring.ConnectionCreatedEvent(address, connection_id))
+            listener.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+            listener.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, connection_id))
+        listener.connection_checked_in(monitoring.ConnectionCheckedInEvent(address, 1))
+        listener.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        listener.connection_check_out_failed(monitoring.ConnectionCheckOutFailedEvent(address, 'timeout'))
+
+        snapshot = listener.snapshot()
+        self.assertEqual(snapshot['open'], {'db.local:27017': 2})
+        self.assertEqual(snapshot['checked_out'], {'db.local:27017': 1})
+        self.assertEqual(snapshot['peak_checked_out'], {'db.local:27017': 2})
+        self.assertEqual(snapshot['checkout_failures'], {'timeout': 1})
+        exposed = registry.expose()
+        self.assertIn('octofit_mongo_pool_checked_out{alias="pool-test-primary",address="db.local:27017"} 1', exposed)
+        self.assertIn('octofit_mongo_pool_checkout_failures_total{alias="pool-test-primary",reason="timeout"} 1',
+                      exposed)
+
+    def test_read_alias_falls_back_to_default(self):
+        """Test that reads use the default database when no read alias is configured"""
+        with override_settings(READ_DATABASE_ALIAS='missing'):
+            self.assertEqual(read_alias(), 'default')
+
+
+class MongoSchemaTest(SimpleTestCase):
+    """Test cases for creating model indexes on MongoDB"""
+
+    def setUp(self):
+        self.editor = djongo_connection().schema_editor()
+        self.collection = mock.Mock()
+        self.editor.collection = mock.Mock(return_value=self.collection)
+
+    def index(self, model, name):
+        return next(index for index in model._meta.indexes if index.name == name)
+
+    def test_descending_fields_keep_their_direction(self):
+        """Test that descending index fields are created as -1 keys, not as literal names"""
+        self.editor.add_index(Activity, self.index(Activity, 'activities_recent_idx'))
+        self.editor.add_index(Leaderboard, self.index(Leaderboard, 'leaderboard_standings_idx'))
+        self.assertEqual([call.args[0] for call in self.collection.create_index.call_args_list], [
+            [('date', -1), ('created_at', -1), ('id', 1)],
+            [('entity_type', 1), ('total_points', -1), ('entity_name', 1)],
+        ])
+        self.assertEqual(self.collection.create_index.call_args.kwargs, {'name': 'leaderboard_standings_idx'})
+
+    def test_model_indexes_left_out_of_index_sql(self):
+        """Test that creating a model leaves its Meta.indexes to the native path"""
+        statements = [str(statement) for statement in self.editor._model_indexes_sql(Activity)]
+        self.assertFalse([statement for statement in statements if 'DESC' in statement])
+
+    def test_repair_recreates_mistranslated_index(self):
+        """Test that an index stock djongo created with literal DESC names is recreated"""
+        index = self.index(Activity, 'activities_team_date_idx')
+        self.collection.index_information.return_value = {
+            'activities_team_date_idx': {'key': [('team', 1), ('date" DESC', 1)]},
+        }
+        self.editor.repair_index(Activity, index)
+        self.collection.drop_index.assert_called_once_with('activities_team_date_idx')
+        self.collection.create_index.assert_called_once_with(
+            [('team', 1), ('date', -1)], name='activities_team_date_idx',
+        )
+
+        self.collection.reset_mock()
+        self.collection.index_information.return_value = {
+            'activities_team_date_idx': {'key': [('team', 1), ('date', -1)]},
+        }
+        self.editor.repair_index(Activity, index)
+        self.collection.drop_index.assert_not_called()
+
+
+class ReadRouterTest(SimpleTestCase):
+    """Test cases for the read replica router decisions"""
+
+    def test_reads_routed_only_inside_replica_reads(self):
+        """Test that reads use the read alias only in replica_reads() and writes never do"""
+        self.assertEqual(User.objects.all().db, 'default')
+        with replica_reads():
+            self.assertEqual(User.objects.all().db, read_alias())
+            self.assertEqual(router.db_for_write(User), 'default')
+        self.assertEqual(User.objects.all().db, 'default')
+
+    def test_pinned_cookie(self):
+        """Test that only an unexpired pin cookie keeps a client on the default database"""
+        factory = RequestFactory()
+        for value, pinned in ((time.time() + 60, True), (time.time() - 60, False), ('soon', False)):
+            request = factory.get('/api/users/')
+            request.COOKIES[PIN_COOKIE] = str(value)
+            self.assertEqual(pinned_to_primary(request), pinned)
+
+
+@skipUnless('reads' in settings.DATABASES, 'needs a reads database alias, e.g. settings_replica')
+class ReplicaRoutingTest(TransactionTestCase):
+    """Test cases for read/write splitting between the default and reads databases"""
+
+    # Every configured alias, so the suite still loads where 'reads' is absent
+    databases = '__all__'
+
+    def queries(self, method, path, data=None):
+        """Send a request and return it with the number of queries run on each database"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['reads']) as replica:
+            if method == 'post':
+                response = self.client.post(path, data, content_type='application/json')
+            else:
+                response = self.client.get(path)
+        return response, len(primary.captured_queries), len(replica.captured_queries)
+
+    def test_get_actions_read_replica(self):
+        """Test that list, retrieve and custom GET actions read from the replica"""
+        for path in ('/api/users/', '/api/users/by_team/?team=Team+DC', '/api/stats/streak/?user_email=a@b.c'):
+            response, primary, replica = self.queries('get', path)
+            self.assertLess(response.status_code, 400, path)
+            self.assertEqual(primary, 0, path)
+            self.assertGreater(replica, 0, path)
+
+    def test_write_pins_client_to_primary(self):
+        """Test that a client reads from the primary for a while after a write"""
+        response, primary, replica = self.queries(
+            'post', '/api/users/', {'name': 'Runner', 'email': 'runner@example.com', 'team': 'Team DC'}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        response, primary, replica = self.queries('get', '/api/users/')
+        self.assertEqual(response.json()['results'][0]['email'], 'runner@example.com')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    @override_settings(READ_YOUR_WRITES_SECONDS=0)
+    def test_stickiness_can_be_disabled(self):
+        """Test that without stickiness reads go to the replica right after a write"""
+        response, _, _ = self.queries(
+            'post', '/api/users/', {'name': 'Runner', 'email': 'runner@example.com', 'team': 'Team DC'}
+        )
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        _, primary, replica = self.queries('get', '/api/users/')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+
+    def test_cache_fills_after_invalidation_read_primary(self):
+        """Test that responses cached while the replica may lag the invalidating write read the primary"""
+        caches['default'].clear()
+        _, primary, replica = self.queries('get', '/api/leaderboard/users/')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        _, primary, replica = self.queries('get', '/api/leaderboard/users/')
+        self.assertEqual((primary, replica), (0, 0))
+        with override_settings(REPLICA_LAG_SECONDS=0):
+            caches['default'].clear()
+            _, primary, replica = self.queries('get', '/api/leaderboard/users/')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_benchmark_counts_queries_on_every_database(self):
+        """Test that the API benchmark counts the queries routed to the replica too"""
+        from .management.commands.benchmark_api import Command
+
+        _, primary, replica = self.queries('get', '/api/users/')
+        result = Command().drive('get', '/api/users/', None, requests=2, concurrency=1)
+        self.assertEqual(result['queries_max'], primary + replica)
+        self.assertGreater(result['queries_max'], 0)
+
+
+class DjongoTranslationTest(TestCase):
+    """Test cases for the SQL the write and export paths issue on djongo"""
+
+    def setUp(self):
+        leaderboard_engine.invalidate()
+        caches['default'].clear()
+        Team.objects.create(name='Team Marvel')
+        User.objects.create(email='thor@marvel.com', name='Thor', team='Team Marvel')
+        User.objects.create(email='hulk@marvel.com', name='Hulk', team='Team Marvel')
+
+    def tearDown(self):
+        leaderboard_engine.invalidate()
+
+    def log(self, email, name, points):
+        return Activity.objects.create(
+            user_email=email, user_name=name, team='Team Marvel', activity_type='Running',
+            duration_minutes=30, points_earned=points, date=date.today(),
+        )
+
+    def test_untranslatable_sql_is_caught(self):
+        """Test that SQL djongo cannot translate fails the check"""
+        from djongo.exceptions import SQLDecodeError
+
+        with translated_for_djongo(), self.assertRaises(SQLDecodeError):
+            User.objects.update(total_points=F('total_points') + 1)
+
+    def test_activity_writes_translate(self):
+        """Test that logging, editing and deleting activities issue only translatable SQL"""
+        with translated_for_djongo() as collection:
+            activity = self.log('thor@marvel.com', 'Thor', 40)
+            activity.points_earned = 25
+            activity.save()
+            activity.delete()
+            response = self.client.post('/api/activities/bulk/', [
+                {'user_email': 'hulk@marvel.com', 'user_name': 'Hulk', 'team': 'Team Marvel',
+                 'activity_type': 'Smashing', 'duration_minutes': 10, 'points_earned': 15,
+                 'date': date.today().isoformat()},
+            ], content_type='application/json')
+        self.assertLess(response.status_code, 400)
+        self.assertTrue(collection.update_many.called)
+        self.assertTrue(collection.bulk_write.called)
+
+    def test_rank_moves_translate(self):
+        """Test that moving, renaming and ranking leaderboard entries issue only translatable SQL"""
+        for name, points in (('Thor', 380), ('Hulk', 290), ('Batman', 410)):
+            leaderboard_engine.apply('user', {name: points})
+        with translated_for_djongo() as collection:
+            leaderboard_engine.apply('user', {'Hulk': 200, 'Flash': 300}, teams={'Flash': 'Team DC'})
+            leaderboard_engine.rename('user', 'Hulk', 'Thor')
+            self.client.get('/api/leaderboard/users/')
+            self.client.get('/api/leaderboard/users/', {'around': 'Thor', 'lean': 'true'})
+            leaderboard_engine.rebuild()
+        self.assertTrue(collection.find_one_and_update.called)
+
+    def test_bulk_totals_translate(self):
+        """Test that seeding the benchmark dataset issues only translatable SQL"""
+        with translated_for_djongo() as collection:
+            seed_dataset(users=6, teams=2, activities=40, workouts=2, chunk_size=16)
+        self.assertTrue(collection.bulk_write.called)
+
+    def test_export_translates(self):
+        """Test that the export and lean pages read relations with translatable SQL"""
+        self.log('thor@marvel.com', 'Thor', 40)
+        with translated_for_djongo():
+            response = self.client.get('/api/activities/export/')
+            body = b''.join(response.streaming_content)
+            self.client.get('/api/activities/', {'lean': 'true'})
+            self.client.get('/api/users/', {'lean': 'true'})
+        self.assertIn(b'Thor', body)
+
+
+class RepositoryTest(TestCase):
+    """Test cases for the repository read paths"""
+
+    def setUp(self):
+        caches['default'].clear()
+        Team.objects.create(name='Team Marvel')
+        User.objects.create(email='thor@marvel.com', name='Thor', team='Team Marvel')
+        for number in range(5):
+            Activity.objects.create(
+                user_email='thor@marvel.com', user_name='Thor', team='Team Marvel' if number % 2 else 'Team DC',
+                activity_type=f'Run {number}', duration_minutes=30, points_earned=number,
+                date=date.today() - timedelta(days=number % 2), notes=f'Lap {number}'
+            )
+        User.objects.filter(email='thor@marvel.com').update(name='Thor Odinson')
+
+    def test_page_matches_model_serializer(self):
+        """Test that repository rows render like the model serializer, relations included"""
+        ordering = ActivityPagination.ordering
+        rows = Repository(ActivitySerializer).page(
+            {'user_email': 'thor@marvel.com'}, ActivitySerializer.Meta.fields, ordering, limit=10,
+        )
+        expected = ActivitySerializer(Activity.objects.order_by(*ordering), many=True).data
+        self.assertEqual(LeanListSerializer(ActivitySerializer, rows).data, expected)
+        self.assertEqual({row['user_name'] for row in expected}, {'Thor Odinson'})
+
+    def test_page_after_cursor(self):
+        """Test that pages start strictly after the cursor values"""
+        ordering = ActivityPagination.ordering
+        ids = list(Activity.objects.order_by(*ordering).values_list('id', flat=True))
+        first = Activity.objects.get(pk=ids[1])
+        rows = Repository(ActivitySerializer).page(
+            {}, ['id'], ordering, after=[first.date, first.created_at, first.id], limit=2,
+        )
+        self.assertEqual([row['id'] for row in rows], ids[2:4])
+
+    def test_by_user_pages_both_ways(self):
+        """Test that the activity feed pages forward and back through the repository"""
+        first = self.client.get('/api/activities/by_user/', {'user_email': 'thor@marvel.com', 'page_size': 2}).json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        expected = list(Activity.objects.order_by(*ActivityPagination.ordering).values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in first['results'] + second['results']], expected[:4])
+        self.assertEqual(back['results'], first['results'])
+
+    def test_mongo_keyset_filter(self):
+        """Test that the native cursor filter matches the ordering tuple comparison"""
+        connection = connections['default']
+        today = date.today()
+        condition = Repository(ActivitySerializer).after(connection, ('-date', 'id'), [today, 7])
+        day = Activity._meta.get_field('date').get_db_prep_value(today, connection)
+        self.assertEqual(condition, {'$or': [{'date': {'$lt': day}}, {'date': day, 'id': {'$gt': 7}}]})
+
+    def test_reads_through_orm_off_mongo(self):
+        """Test that the native path is only taken on the Mongo engine"""
+        self.assertFalse(is_native(Activity))
+        self.assertEqual(count_members_by_team(['Team Marvel', 'Team DC']), {'Team Marvel': 1})
+
+
+class SeedingTest(TestCase):
+    """Test cases for the synthetic benchmark dataset"""
+
+    def test_seed_dataset_is_consistent(self):
+        """Test that seeded totals, ranks and relations agree with the activities"""
+        seed_dataset(users=20, teams=3, activities=500, workouts=4, chunk_size=64)
+        self.assertEqual(Activity.objects.count(), 500)
+        self.assertFalse(Activity.objects.filter(user__isnull=True).exists())
+        activity_points = Activity.objects.aggregate(total=Sum('points_earned'))['total']
+        self.assertEqual(User.objects.aggregate(total=Sum('total_points'))['total'], activity_points)
+        self.assertEqual(Team.objects.aggregate(total=Sum('member_count'))['total'], 20)
+        ranked = list(Leaderboard.objects.filter(entity_type='user').values_list('total_points', flat=True))
+        self.assertEqual(ranked, sorted(ranked, reverse=True))
+        self.assertEqual(Workout.objects.count(), 4)
+        rollup_points = ActivityRollup.objects.filter(period='month', entity_type='user').aggregate(
+            total=Sum('total_points')
+        )['total']
+        self.assertEqual(rollup_points, activity_points)
+
+    def test_totals_written_natively_on_djongo(self):
+        """Test that totals are saved as batches of $set updates on djongo, which cannot translate bulk_update"""
+        teams = [Team.objects.create(name=name) for name in ('Team Marvel', 'Team DC', 'Team X')]
+        for points, team in enumerate(teams):
+            team.total_points, team.member_count = points * 10, points
+        collection = mock.Mock()
+        with mock.patch('octofit_tracker.repositories.write_connection', return_value=djongo_connection()), \
+                mock.patch('octofit_tracker.repositories._collection', return_value=collection):
+            update_each(Team, teams, ['total_points', 'member_count'], batch_size=2)
+        batches = [call.args[0] for call in collection.bulk_write.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(
+            [(request._filter, request._doc) for request in batches[1]],
+            [({'id': teams[2].pk}, {'$set': {'total_points': 20, 'member_count': 2}})],
+        )
+        self.assertEqual(Team.objects.aggregate(total=Sum('total_points'))['total'], 0)
+
+    def test_generation_is_deterministic(self):
+        """Test that a chunk is reproducible from the seed and its offset"""
+        first = synthetic_activities(100, 10, users=50, teams=5, seed=7)
+        second = synthetic_activities(100, 10, users=50, teams=5, seed=7)
+        key = lambda activity: (activity.user_email, activity.activity_type, activity.points_earned, activity.date)
+        self.assertEqual(list(map(key, first)), list(map(key, second)))
+
+
+class BenchmarkingTest(SimpleTestCase):
+    """Test cases for the benchmark summary helpers"""
+
+    def test_percentiles(self):
+        """Test nearest-rank percentiles reported in milliseconds"""
+        summary = summarize([index / 1000 for index in range(1, 101)])
+        self.assertEqual((summary['p50_ms'], summary['p95_ms'], summary['p99_ms']), (50.0, 95.0, 99.0))
+        self.assertEqual(summary['count'], 100)
+
+    def test_refuses_to_wipe_other_databases(self):
+        """Test that seeding benchmarks refuse to run outside the benchmark settings unless told to"""
+        with self.assertRaisesMessage(CommandError, '--i-know-this-drops-data'):
+            call_command('benchmark_api', users=1, teams=1, activities=1)
+        with self.assertRaisesMessage(CommandError, '--i-know-this-drops-data'):
+            call_command('benchmark_indexes', activities=1)
+        with override_settings(BENCHMARK_DATABASE=True):
+            ensure_disposable_database({}, 'seed')
+        ensure_disposable_database({'drops_data': True}, 'seed')
@@ -18,7 +18,11 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
+from . import async_views, live
+from .instrumentation import metrics
+from .views import (
+    UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet, StatsViewSet, SearchViewSet,
+)
 import os
 
 # Get codespace URL or use localhost
@@ -32,14 +36,22 @@ else:
 def api_root(request):
     """
     API root endpoint that returns all available API endpoints.
+
+    The leaderboard stream is only listed when this process serves it under
+    ASGI, and only carries rank changes made by this process (see ``live``).
     """
-    return Response({
+    endpoints = {
         'users': f'{base_url}/api/users/',
         'teams': f'{base_url}/api/teams/',
         'activities': f'{base_url}/api/activities/',
         'leaderboard': f'{base_url}/api/leaderboard/',
         'workouts': f'{base_url}/api/workouts/',
-    })
+        'stats': f'{base_url}/api/stats/',
+        'search': f'{base_url}/api/search/',
+    }
+    if live.streaming():
+        endpoints['leaderboard_stream'] = f'{base_url}/api/leaderboard/stream/'
+    return Response(endpoints)
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()
@@ -48,10 +60,22 @@ router.register(r'teams', TeamViewSet, basename='team')
 router.register(r'activities', ActivityViewSet, basename='activity')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
+router.register(r'stats', StatsViewSet, basename='stats')
+router.register(r'search', SearchViewSet, basename='search')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics, name='metrics'),
     path('api/', api_root, name='api-root'),
+    path('api/async/activities/by_user/', async_views.activities_by_user, name='async-activity-by-user'),
+    path('api/async/leaderboard/users/', async_views.leaderboard, {'entity_type': 'user'},
+         name='async-leaderboard-users'),
+    path('api/async/leaderboard/teams/', async_views.leaderboard, {'entity_type': 'team'},
+         name='async-leaderboard-teams'),
+    path('api/async/teams/', async_views.teams, name='async-teams'),
+    # Reached only outside the ASGI application, which serves these paths itself
+    path('api/leaderboard/stream/', live.stream_unavailable, name='leaderboard-stream'),
+    path('leaderboard/stream/', live.stream_unavailable),
     path('', include(router.urls)),  # Root path points to API with api_root view
     path('api/', include(router.urls)),  # Keep backward compatibility
 ]
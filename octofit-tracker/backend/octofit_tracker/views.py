@@ -1,15 +1,137 @@
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.utils import timezone
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
-from .models import User, Team, Activity, Leaderboard, Workout
-from .serializers import UserSerializer, TeamSerializer, ActivitySerializer, LeaderboardSerializer, WorkoutSerializer
+from rest_framework.utils.urls import replace_query_param
+from .caching import cached_response, conditional_response
+from .exports import EXPORT_FORMATS, prefer_linked
+from .ingestion import activity_queue, write_activities
+from .models import User, Team, Activity, ActivityRollup, ActivityTombstone, Leaderboard, Workout
+from .pagination import ActivityPagination, KeysetPagination, LeaderboardPagination
+from .repositories import Repository
+from .ranking import window_rankings
+from .rollups import PERIODS, bucket_start, previous_bucket
+from .routers import pin_to_primary, pinned_to_primary, replica_reads
+from .search import DOCUMENTS as SEARCH_DOCUMENTS, search
+from .serializers import (
+    LeanListSerializer, UserSerializer, TeamSerializer, ActivitySerializer, LeaderboardSerializer, WorkoutSerializer,
+)
+from .sync import ExpiredToken, InvalidToken, feed_changes, feed_version
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def parse_day(value):
+    """Parse a YYYY-MM-DD date, returning None when it is malformed or impossible like 2024-02-30"""
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
+
+class SparseFieldsetMixin:
+    """Reads ``?fields=a,b`` and ``?lean=true`` on GET requests.
+
+    ``fields`` narrows both the serializer output and the columns loaded from
+    the database. ``lean`` renders list pages from ``values()`` rows with
+    ``LeanListSerializer`` instead of building model instances and walking the
+    DRF fields for each of them. The hottest list actions always take the lean
+    path, through ``repository_page``.
+    """
+    fields_query_param = 'fields'
+    lean_query_param = 'lean'
+
+    def requested_fields(self):
+        """Return the requested field names in serializer order, or None for all of them"""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = None
+            raw = self.request.query_params.get(self.fields_query_param) if self.request else None
+            if raw and self.request.method in SAFE_METHODS:
+                available = self.get_serializer_class().Meta.fields
+                names = {name.strip() for name in raw.split(',') if name.strip()}
+                unknown = sorted(names.difference(available))
+                if unknown:
+                    raise ValidationError({self.fields_query_param: f'Unknown fields: {", ".join(unknown)}'})
+                self._requested_fields = [name for name in available if name in names]
+        return self._requested_fields
+
+    def is_lean(self):
+        value = self.request.query_params.get(self.lean_query_param, '') if self.request else ''
+        return self.request.method in SAFE_METHODS and value.lower() in ('1', 'true', 'yes')
+
+    def ordering_fields(self):
+        """Fields the paginator reads from each row to build its cursors"""
+        ordering = getattr(self.paginator, 'ordering', ())
+        return tuple(field.lstrip('-') for field in ordering)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.requested_fields()
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.requested_fields()
+        if fields is None or self.is_lean():
+            return queryset
+        return self.get_serializer_class().narrow_queryset(queryset, fields, self.ordering_fields())
+
+    def lean_rows(self, queryset):
+        """Return ``queryset`` as the ``values()`` rows ``LeanListSerializer`` renders"""
+        fields = self.requested_fields() or self.get_serializer_class().Meta.fields
+        return self.get_serializer_class().lean_values(queryset, fields, self.ordering_fields())
+
+    def repository_page(self, **filters):
+        """Respond with the keyset page of rows matching ``filters``, read through a ``Repository``"""
+        serializer_class = self.get_serializer_class()
+        repository = Repository(serializer_class)
+        fields = self.requested_fields() or serializer_class.Meta.fields
+        rows = self.paginator.paginate_rows(
+            lambda ordering, after, limit: repository.page(filters, fields, ordering, after, limit),
+            repository.model, self.request,
+        )
+        serializer = LeanListSerializer(serializer_class, rows, fields, self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    def paginate_queryset(self, queryset):
+        if self.is_lean():
+            queryset = self.lean_rows(queryset)
+        return super().paginate_queryset(queryset)
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and self.is_lean():
+            return LeanListSerializer(
+                self.get_serializer_class(), args[0], self.requested_fields(), self.get_serializer_context()
+            )
+        return super().get_serializer(*args, **kwargs)
+
+
+class ReadPreferenceMixin:
+    """Routes the queries of GET actions to the read alias, unless the client just wrote.
+
+    Successful writes pin the client to the default database for
+    ``READ_YOUR_WRITES_SECONDS``; see ``routers``.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            response = super().dispatch(request, *args, **kwargs)
+            return pin_to_primary(response) if response.status_code < 400 else response
+        if pinned_to_primary(request):
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class UserViewSet(ReadPreferenceMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing users.
     """
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('team_ref')
     serializer_class = UserSerializer
 
     @action(detail=False, methods=['get'])
@@ -17,13 +139,14 @@ class UserViewSet(viewsets.ModelViewSet):
         """Get users filtered by team"""
         team = request.query_params.get('team', None)
         if team:
-            users = User.objects.filter(team=team)
-            serializer = self.get_serializer(users, many=True)
-            return Response(serializer.data)
+            users = self.get_queryset().filter(team=team)
+            page = self.paginate_queryset(users)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         return Response({'error': 'Team parameter is required'}, status=400)
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ReadPreferenceMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing teams.
     """
@@ -31,59 +154,407 @@ class TeamViewSet(viewsets.ModelViewSet):
     serializer_class = TeamSerializer
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ReadPreferenceMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing activities.
     """
-    queryset = Activity.objects.all()
+    queryset = Activity.objects.select_related('user', 'team_ref')
     serializer_class = ActivitySerializer
+    pagination_class = ActivityPagination
+    bulk_max_items = 1000
+    bulk_batch_size = 500
+
+    def user_feed_version(self, request):
+        user_email = request.query_params.get('user_email')
+        if not user_email:
+            return None
+        return feed_version(
+            Activity.objects.filter(user_email=user_email),
+            ActivityTombstone.objects.filter(user_email=user_email),
+        )
 
     @action(detail=False, methods=['get'])
+    @conditional_response(user_feed_version)
     def by_user(self, request):
-        """Get activities filtered by user email"""
+        """Get activities filtered by user email, or only the changes after ``since``"""
         user_email = request.query_params.get('user_email', None)
-        if user_email:
-            activities = Activity.objects.filter(user_email=user_email)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
-        return Response({'error': 'user_email parameter is required'}, status=400)
+        if not user_email:
+            return Response({'error': 'user_email parameter is required'}, status=400)
+        since = request.query_params.get('since')
+        if since:
+            return self.user_feed_changes(request, user_email, since)
+        return self.repository_page(user_email=user_email)
+
+    def user_feed_changes(self, request, user_email, since):
+        """Activities created or edited and ids deleted after ``since``, with the token for the next sync"""
+        try:
+            changed, deleted, next_since, has_more = feed_changes(
+                self.queryset.filter(user_email=user_email),
+                ActivityTombstone.objects.filter(user_email=user_email),
+                since,
+                self.paginator.get_page_size(request),
+            )
+        except InvalidToken:
+            return Response({'error': 'since must be a sync token or an ISO 8601 timestamp'}, status=400)
+        except ExpiredToken:
+            return Response(
+                {'error': 'since is older than the deletion history; fetch the full feed again'}, status=410,
+            )
+        serializer = self.get_serializer_class()(changed, many=True, context=self.get_serializer_context())
+        return Response({
+            'activities': serializer.data,
+            'deleted': [tombstone.activity_id for tombstone in deleted],
+            'next_since': next_since,
+            'has_more': has_more,
+        })
+
+    def create(self, request, *args, **kwargs):
+        """Create an activity, or only validate and queue it when ingestion is queued"""
+        if settings.ACTIVITY_INGEST_MODE != 'queued':
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queue_id, = activity_queue().enqueue([serializer.validated_data])
+        return Response({'status': 'queued', 'queue_id': queue_id}, status=202)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create a list of activities with batched inserts, reporting errors per item"""
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'Request body must be a non-empty list of activities'}, status=400)
+        if len(items) > self.bulk_max_items:
+            return Response({'error': f'At most {self.bulk_max_items} activities per request'}, status=400)
+
+        created, errors = write_activities(items, self.bulk_batch_size)
+        if not created:
+            return Response({'created': [], 'errors': errors}, status=400)
+        serializer = self.get_serializer(created, many=True)
+        return Response({'created': serializer.data, 'errors': errors}, status=207 if errors else 201)
+
+    @action(detail=False, methods=['get'])
+    def queue(self, request):
+        """Get the depth and lag of the activity ingestion queue"""
+        if settings.ACTIVITY_INGEST_MODE != 'queued':
+            return Response({'mode': settings.ACTIVITY_INGEST_MODE})
+        return Response({'mode': settings.ACTIVITY_INGEST_MODE, **activity_queue().stats()})
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream activities as NDJSON or CSV, optionally filtered by date range and team"""
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({'error': f'output must be one of: {", ".join(EXPORT_FORMATS)}'}, status=400)
+
+        activities = Activity.objects.order_by('-date', '-created_at', 'id')
+        for param, lookup in (('date_from', 'date__gte'), ('date_to', 'date__lte')):
+            value = request.query_params.get(param)
+            if value:
+                day = parse_day(value)
+                if day is None:
+                    return Response({'error': f'{param} must be a YYYY-MM-DD date'}, status=400)
+                activities = activities.filter(**{lookup: day})
+        team = request.query_params.get('team')
+        if team:
+            activities = activities.filter(team=team)
+
+        fields = ActivitySerializer.Meta.fields
+        # Same values as the API: current names through the relations when linked
+        linked = {fields.index(own): path for own, path in ActivitySerializer.field_sources.values()}
+        # iterator() reads through a server-side cursor instead of caching the result set
+        rows = activities.values_list(*fields, *linked.values()).iterator(chunk_size=2000)
+        encode, content_type = EXPORT_FORMATS[output]
+        rows = prefer_linked(rows, list(linked))
+        response = StreamingHttpResponse(encode(rows, fields), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="activities.{output}"'
+        return response
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(ReadPreferenceMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing leaderboard entries.
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardPagination
+    windows = ('all',) + PERIODS
+    max_radius = 100
+
+    @cached_response('leaderboard')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     @action(detail=False, methods=['get'])
+    @cached_response('leaderboard')
     def users(self, request):
-        """Get user leaderboard"""
-        leaderboard = Leaderboard.objects.filter(entity_type='user')
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response(serializer.data)
+        """Get user leaderboard, optionally for a day, week or month and around one user"""
+        return self.ranking(request, 'user')
 
     @action(detail=False, methods=['get'])
+    @cached_response('leaderboard')
     def teams(self, request):
-        """Get team leaderboard"""
-        leaderboard = Leaderboard.objects.filter(entity_type='team')
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response(serializer.data)
+        """Get team leaderboard, optionally for a day, week or month and around one team"""
+        return self.ranking(request, 'team')
+
+    def ranking(self, request, entity_type):
+        """Serve ``?window=day|week|month|all&date=&around=&radius=`` for one entity type.
+
+        ``around`` is a user email or a team name and returns that entry with
+        ``radius`` neighbours on each side. Windowed rankings come from the
+        in-memory boards built over the activity rollups.
+        """
+        window = request.query_params.get('window', 'all')
+        if window not in self.windows:
+            return Response({'error': f'window must be one of: {", ".join(self.windows)}'}, status=400)
+        around = request.query_params.get('around', None)
+        try:
+            radius = min(max(int(request.query_params.get('radius', 10)), 0), self.max_radius)
+        except ValueError:
+            return Response({'error': 'radius must be an integer'}, status=400)
+
+        if window == 'all':
+            if around is None:
+                return self.repository_page(entity_type=entity_type)
+            return self.all_time_around(entity_type, around, radius)
+
+        day = timezone.localdate()
+        if 'date' in request.query_params:
+            day = parse_day(request.query_params['date'])
+            if day is None:
+                return Response({'error': 'date must be a YYYY-MM-DD date'}, status=400)
+        start = bucket_start(day, window)
+        board = window_rankings.board(entity_type, window, start)
+        data = {'window': window, 'bucket_start': start}
+        if around is not None:
+            entries = board.around(around, radius)
+            if not entries:
+                return Response({'error': f'{around} has no points in this window'}, status=404)
+            data['results'] = self.window_entries(entity_type, entries)
+            return Response(data)
+
+        paginator = self.paginator
+        page_size = paginator.get_page_size(request)
+        try:
+            first_rank = max(int(request.query_params.get('start', 1)), 1)
+        except ValueError:
+            return Response({'error': 'start must be an integer'}, status=400)
+        entries = board.top(page_size, first_rank)
+        following = first_rank + page_size
+        url = request.build_absolute_uri()
+        data['next'] = replace_query_param(url, 'start', following) if following <= len(board) else None
+        data['previous'] = replace_query_param(url, 'start', max(first_rank - page_size, 1)) if first_rank > 1 else None
+        data['results'] = self.window_entries(entity_type, entries)
+        return Response(data)
+
+    def all_time_around(self, entity_type, around, radius):
+        name = around
+        if entity_type == 'user':
+            name = User.objects.filter(email=around).values_list('name', flat=True).first() or around
+        entries = self.get_queryset().filter(entity_type=entity_type)
+        points = entries.filter(entity_name=name).values_list('total_points', flat=True).first()
+        if points is None:
+            return Response({'error': f'{around} is not on the leaderboard'}, status=404)
+        # The neighbours are the keyset pages either side of the entry, in rank order
+        ordering = LeaderboardPagination.ordering
+        position = [entity_type, points, name]
+        flipped = [KeysetPagination._flip(field) for field in ordering]
+        above = entries.filter(KeysetPagination._after(flipped, position)).order_by(*flipped)
+        below = entries.filter(KeysetPagination._after(ordering, position) | Q(entity_name=name)).order_by(*ordering)
+        if self.is_lean():
+            above, below = self.lean_rows(above), self.lean_rows(below)
+        rows = list(above[:radius])[::-1] + list(below[:radius + 1])
+        serializer = self.get_serializer(rows, many=True)
+        return Response({'window': 'all', 'results': serializer.data})
+
+    def window_entries(self, entity_type, entries):
+        """Turn board ``(rank, key, points)`` entries into response rows"""
+        if entity_type == 'user':
+            users = {
+                email: (name, team)
+                for email, name, team in User.objects.filter(email__in=[key for _, key, _ in entries])
+                .values_list('email', 'name', 'team')
+            }
+            return [
+                {
+                    'rank': rank, 'entity_type': 'user', 'entity_name': users.get(key, (key, None))[0],
+                    'user_email': key, 'team': users.get(key, (key, None))[1], 'total_points': points,
+                }
+                for rank, key, points in entries
+            ]
+        return [
+            {'rank': rank, 'entity_type': 'team', 'entity_name': key, 'team': key, 'total_points': points}
+            for rank, key, points in entries
+        ]
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ReadPreferenceMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing workouts.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
 
+    @cached_response('workouts')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     @action(detail=False, methods=['get'])
+    @cached_response('workouts')
     def by_difficulty(self, request):
         """Get workouts filtered by difficulty level"""
         difficulty = request.query_params.get('difficulty', None)
         if difficulty:
-            workouts = Workout.objects.filter(difficulty_level=difficulty)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+            workouts = self.get_queryset().filter(difficulty_level=difficulty)
+            page = self.paginate_queryset(workouts)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         return Response({'error': 'difficulty parameter is required'}, status=400)
+
+
+class StatsViewSet(ReadPreferenceMixin, viewsets.ViewSet):
+    """
+    API endpoint for activity statistics, served from the rollup buckets.
+    """
+    default_buckets = 12
+
+    @action(detail=False, methods=['get'])
+    def users(self, request):
+        """Get points, minutes and activity counts per period for one user"""
+        return self.bucket_stats(request, 'user', 'user_email')
+
+    @action(detail=False, methods=['get'])
+    def teams(self, request):
+        """Get points, minutes and activity counts per period for one team"""
+        return self.bucket_stats(request, 'team', 'team')
+
+    @action(detail=False, methods=['get'])
+    def streak(self, request):
+        """Get the current and longest run of consecutive active days for one user"""
+        user_email = request.query_params.get('user_email', None)
+        if not user_email:
+            return Response({'error': 'user_email parameter is required'}, status=400)
+        days = (
+            ActivityRollup.objects.filter(entity_type='user', entity_key=user_email, period='day')
+            .filter(activity_count__gt=0)
+            .order_by('bucket_start')
+            .values_list('bucket_start', flat=True)
+            .distinct()
+        )
+        longest = run = 0
+        previous = None
+        for day in days:
+            run = run + 1 if previous is not None and (day - previous).days == 1 else 1
+            longest = max(longest, run)
+            previous = day
+        today = timezone.localdate()
+        current = run if previous is not None and (today - previous).days <= 1 else 0
+        return Response({
+            'user_email': user_email,
+            'current_streak': current,
+            'longest_streak': longest,
+            'last_active': previous,
+        })
+
+    def bucket_stats(self, request, entity_type, param):
+        key = request.query_params.get(param, None)
+        if not key:
+            return Response({'error': f'{param} parameter is required'}, status=400)
+        period = request.query_params.get('period', 'week')
+        if period not in PERIODS:
+            return Response({'error': f'period must be one of: {", ".join(PERIODS)}'}, status=400)
+
+        end = bucket_start(timezone.localdate(), period)
+        start = end
+        for _ in range(self.default_buckets - 1):
+            start = previous_bucket(start, period)
+        for name in ('date_from', 'date_to'):
+            value = request.query_params.get(name)
+            if value:
+                day = parse_day(value)
+                if day is None:
+                    return Response({'error': f'{name} must be a YYYY-MM-DD date'}, status=400)
+                if name == 'date_from':
+                    start = bucket_start(day, period)
+                else:
+                    end = day
+
+        rows = ActivityRollup.objects.filter(
+            entity_type=entity_type, entity_key=key, period=period,
+            bucket_start__gte=start, bucket_start__lte=end,
+        ).order_by('bucket_start', 'activity_type')
+        buckets = []
+        totals = {'activity_count': 0, 'total_points': 0, 'total_minutes': 0}
+        for row in rows:
+            if not buckets or buckets[-1]['bucket_start'] != row.bucket_start:
+                buckets.append({
+                    'bucket_start': row.bucket_start,
+                    'activity_count': 0, 'total_points': 0, 'total_minutes': 0,
+                    'by_activity_type': {},
+                })
+            bucket = buckets[-1]
+            values = {field: getattr(row, field) for field in totals}
+            bucket['by_activity_type'][row.activity_type] = values
+            for field, value in values.items():
+                bucket[field] += value
+                totals[field] += value
+        return Response({
+            param: key,
+            'period': period,
+            'date_from': start,
+            'date_to': end,
+            'totals': totals,
+            'buckets': buckets,
+        })
+
+
+class SearchViewSet(ReadPreferenceMixin, viewsets.GenericViewSet):
+    """
+    API endpoint for ranked prefix search over users, workouts and activity notes.
+    """
+    # Each hit is loaded and rendered the way its own endpoint does
+    document_viewsets = {'user': UserViewSet, 'workout': WorkoutViewSet, 'activity': ActivityViewSet}
+
+    def list(self, request):
+        """Search with ``q``, optionally limited to ``type=user,workout,activity``"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q parameter is required'}, status=400)
+        doc_types = list(SEARCH_DOCUMENTS)
+        if request.query_params.get('type'):
+            doc_types = request.query_params['type'].split(',')
+            unknown = set(doc_types) - set(SEARCH_DOCUMENTS)
+            if unknown:
+                return Response({'error': f'type must be among: {", ".join(SEARCH_DOCUMENTS)}'}, status=400)
+
+        page_size = self.paginator.get_page_size(request)
+        try:
+            first = max(int(request.query_params.get('start', 1)), 1)
+        except ValueError:
+            return Response({'error': 'start must be an integer'}, status=400)
+        hits = search(query, doc_types)
+        page = hits[first - 1:first - 1 + page_size]
+        following = first + page_size
+        url = request.build_absolute_uri()
+        return Response({
+            'count': len(hits),
+            'next': replace_query_param(url, 'start', following) if following <= len(hits) else None,
+            'previous': replace_query_param(url, 'start', max(first - page_size, 1)) if first > 1 else None,
+            'results': self.search_results(page),
+        })
+
+    def search_results(self, page):
+        """Load and serialize the documents of one page of hits, one query per type"""
+        ids = {}
+        for doc_type, doc_id, _ in page:
+            ids.setdefault(doc_type, []).append(doc_id)
+        documents = {}
+        for doc_type, doc_ids in ids.items():
+            viewset = self.document_viewsets[doc_type]
+            objects = viewset.queryset.filter(pk__in=doc_ids)
+            serializer = viewset.serializer_class(objects, many=True, context={'request': self.request})
+            documents.update(((doc_type, item['id']), item) for item in serializer.data)
+        return [
+            {'type': doc_type, 'score': score, 'object': documents[doc_type, doc_id]}
+            for doc_type, doc_id, score in page
+            if (doc_type, doc_id) in documents
+        ]
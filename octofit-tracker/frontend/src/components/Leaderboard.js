@@ -1,13 +1,17 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 
 function Leaderboard() {
   const [leaderboard, setLeaderboard] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const entriesRef = useRef([]);
+  entriesRef.current = leaderboard;
 
   useEffect(() => {
+    const baseUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/leaderboard/`;
+
     const fetchLeaderboard = async () => {
-      const apiUrl = `https://${process.env.REACT_APP_CODESPACE_NAME}-8000.app.github.dev/api/leaderboard/`;
+      const apiUrl = baseUrl;
       console.log('Fetching leaderboard from:', apiUrl);
       
       try {
@@ -30,7 +34,62 @@ function Leaderboard() {
       }
     };
 
+    // Apply a pushed batch as one replacement: the batch's entries take their
+    // final ranks and the others keep their order in the ranks left over
+    const applyRankBatch = (batch) => {
+      const moved = new Map(batch.entries.map((change) => [change.entity_name, change]));
+      const known = entriesRef.current.filter(
+        (entry) => entry.entity_type === batch.entity_type && moved.has(entry.entity_name)
+      );
+      if (known.length < moved.size) {
+        fetchLeaderboard();
+        return;
+      }
+      const oldRanks = batch.entries.filter((change) => change.old_rank !== null).map((change) => change.old_rank);
+      const newRanks = batch.entries.map((change) => change.new_rank).sort((a, b) => a - b);
+      const now = new Date().toISOString();
+      setLeaderboard((entries) =>
+        entries
+          .map((entry) => {
+            if (entry.entity_type !== batch.entity_type) {
+              return entry;
+            }
+            const change = moved.get(entry.entity_name);
+            if (change) {
+              return { ...entry, rank: change.new_rank, total_points: change.total_points, updated_at: now };
+            }
+            // Position among the entries the batch left alone, then skip the ranks it took
+            let rank = entry.rank - oldRanks.filter((oldRank) => oldRank < entry.rank).length;
+            for (const newRank of newRanks) {
+              if (newRank <= rank) {
+                rank += 1;
+              }
+            }
+            return rank === entry.rank ? entry : { ...entry, rank };
+          })
+          .sort((a, b) => a.rank - b.rank || a.id - b.id)
+      );
+    };
+
     fetchLeaderboard();
+
+    // Rank changes are pushed over Server-Sent Events when the server streams
+    // them (ASGI only); if the stream is refused, fall back to polling
+    const stream = new EventSource(`${baseUrl}stream/`);
+    let poll = null;
+    stream.addEventListener('ranks', (event) => applyRankBatch(JSON.parse(event.data)));
+    stream.addEventListener('resync', () => fetchLeaderboard());
+    stream.onerror = () => {
+      if (stream.readyState === EventSource.CLOSED && poll === null) {
+        poll = setInterval(fetchLeaderboard, 30000);
+      }
+    };
+    return () => {
+      stream.close();
+      if (poll !== null) {
+        clearInterval(poll);
+      }
+    };
   }, []);
 
   if (loading) {